@@ -0,0 +1,167 @@
+import re
+import json
+import time
+import random
+import logging
+import collections
+import urllib.parse
+import apsw
+
+from prettytable import PrettyTable
+
+from counterpartycli.util import GETROWS_PARAMS, getrows_query, QueryError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_SIZE = 1000
+EQUALITY_OPERATORS = ['==', '=', 'IS', 'IN']
+RANGE_OPERATORS = ['>', '<', '>=', '<=']
+REST_REQUEST = re.compile(r'"(?:GET|POST) /(?:rest|REST)/(\w+)/get\??(\S*) HTTP')
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?! USING (?:COVERING )?INDEX)(?:\s|$)')
+
+def parse_request(line):
+    """Return the `(table, params)` of the `get_<table>` call logged or
+       recorded in `line`, or `None`. Understands JSON-RPC requests, entries
+       of `--rpc-record` cassettes and REST lines of the API access log."""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        payload = json.loads(line)
+    except ValueError:
+        match = REST_REQUEST.search(line)
+        if not match:
+            return None
+        # As the server's `handle_rest`: each argument (its first value) is
+        # an `==` filter on a string, and `op` the filter operator.
+        args = collections.OrderedDict()
+        for key, value in urllib.parse.parse_qsl(match.group(2)):
+            args.setdefault(key, value)
+        filterop = args.pop('op', 'AND')
+        filters = [{'field': key, 'op': '==', 'value': value} for key, value in args.items()]
+        return match.group(1).lower(), {'filters': filters, 'filterop': filterop}
+    if isinstance(payload, dict) and 'key' in payload:
+        key = json.loads(payload['key'])
+        if len(key) != 3:
+            return None # a batch
+        path, method, params = key
+    elif isinstance(payload, dict):
+        method, params = payload.get('method'), payload.get('params')
+    else:
+        return None
+    if not isinstance(method, str) or not method.startswith('get_') or not isinstance(params or {}, dict):
+        return None
+    return method[4:], params or {}
+
+def load_requests(path, sample_size=DEFAULT_SAMPLE_SIZE):
+    """Return a random sample of `sample_size` `get_<table>` calls from the file at `path`."""
+    requests = []
+    seen = 0
+    with open(path, 'r', encoding='utf-8') as request_file:
+        for line in request_file:
+            request = parse_request(line)
+            if not request:
+                continue
+            # Reservoir sampling: the log is read once, and only the sample is kept.
+            seen += 1
+            if len(requests) < sample_size:
+                requests.append(request)
+            else:
+                index = random.randrange(seen)
+                if index < sample_size:
+                    requests[index] = request
+    return requests
+
+def get_filters(params):
+    filters = params.get('filters') or []
+    if isinstance(filters, dict):
+        filters = [filters]
+    for filter_ in filters:
+        if isinstance(filter_, dict):
+            yield filter_['field'], filter_['op'].upper()
+        else:
+            yield filter_[0], filter_[1].upper()
+
+def index_columns(table, params):
+    """Columns of an index serving the query: equality columns first, then
+       one range column or, without one, the sort column."""
+    filters = list(get_filters(params))
+    if len(filters) > 1 and (params.get('filterop') or 'AND').upper() == 'OR':
+        filters = []
+    equality = [field for field, op in filters if op in EQUALITY_OPERATORS]
+    ranges = [field for field, op in filters if op in RANGE_OPERATORS]
+    status = params.get('status')
+    if status:
+        equality.append('status')
+    if table != 'balances' and (params.get('start_block') is not None or params.get('end_block') is not None):
+        ranges.insert(0, 'tx0_block_index' if table in ['order_matches', 'bet_matches'] else 'block_index')
+
+    columns = []
+    for column in equality + (ranges[:1] or [params.get('order_by')]):
+        if column and column not in columns:
+            columns.append(column)
+    return columns
+
+def query_plan(db, statement, bindings):
+    return [row['detail'] for row in db.cursor().execute('EXPLAIN QUERY PLAN ' + statement, bindings)]
+
+def time_query(db, statement, bindings):
+    start_time = time.time()
+    list(db.cursor().execute(statement, bindings))
+    return time.time() - start_time
+
+def analyze(db, request_file=None, sample_size=DEFAULT_SAMPLE_SIZE, create_indexes=False):
+    """Run `ANALYZE`, then replay the `get_<table>` calls sampled from
+       `request_file` through `EXPLAIN QUERY PLAN`, report full table scans
+       and suggest (or create) indexes, timing the queries before and after."""
+    cursor = db.cursor()
+    start_time = time.time()
+    cursor.execute('ANALYZE')
+    logger.info('Database analyzed in {:.1f}s.'.format(time.time() - start_time))
+    if not request_file:
+        return {}
+
+    queries = collections.OrderedDict()
+    for table, params in load_requests(request_file, sample_size=sample_size):
+        try:
+            statement, bindings = getrows_query(table, **{key: value for key, value in params.items() if key in GETROWS_PARAMS})
+            plan = query_plan(db, statement, bindings)
+        except (QueryError, TypeError, KeyError, ValueError, apsw.Error) as e:
+            logger.debug('Skipping `get_{}` call: {}'.format(table, e))
+            continue
+        scans = [match.group(1) for match in map(FULL_SCAN.match, plan) if match]
+        shape = re.sub(r'LIMIT \d+( OFFSET \d+)?', '', statement)
+        query = queries.setdefault(shape, {'table': table, 'calls': [], 'scans': scans, 'columns': index_columns(table, params)})
+        query['calls'].append((statement, bindings))
+    logger.info('Replaying {} distinct queries.'.format(len(queries)))
+
+    suggestions = collections.OrderedDict()
+    for shape, query in queries.items():
+        query['before'] = sum(time_query(db, statement, bindings) for statement, bindings in query['calls'])
+        if query['scans'] and query['columns']:
+            name = '{}_{}_idx'.format(query['table'], '_'.join(query['columns']))
+            query['index'] = name
+            suggestions[name] = 'CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(name, query['table'], ', '.join(query['columns']))
+
+    if create_indexes and suggestions:
+        for name, statement in suggestions.items():
+            logger.info('Creating index `{}`.'.format(name))
+            cursor.execute(statement)
+        cursor.execute('ANALYZE')
+        for query in queries.values():
+            query['after'] = sum(time_query(db, statement, bindings) for statement, bindings in query['calls'])
+
+    table = PrettyTable(['Query', 'Calls', 'Full scan', 'Before (ms)', 'After (ms)', 'Index'])
+    table.align['Query'] = 'l'
+    for shape, query in sorted(queries.items(), key=lambda item: item[1]['before'], reverse=True):
+        table.add_row([shape if len(shape) <= 80 else shape[:77] + '...', len(query['calls']), ', '.join(query['scans']) or '-',
+                       '{:.1f}'.format(query['before'] * 1000), '{:.1f}'.format(query['after'] * 1000) if 'after' in query else '-',
+                       query.get('index', '-')])
+    print(table)
+    if suggestions and not create_indexes:
+        print('Suggested indexes (use --create-indexes to create them):')
+        for statement in suggestions.values():
+            print('    {};'.format(statement))
+    return suggestions
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,151 @@
+"""Decode many transactions at once: raw transactions are fetched from the
+backend in batches and decoded locally, with counterpartylib's parser, by a
+pool of processes."""
+
+import os
+import re
+import binascii
+import logging
+import multiprocessing
+
+from counterpartylib.lib import blocks, config, script
+from counterpartylib.lib import util as lib_util
+from counterpartycli import util, txparse
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000 # transactions fetched while the previous chunk is decoded
+BATCH_SIZE = 100 # calls per JSON-RPC batch
+TXID = re.compile('^[0-9a-fA-F]{64}$')
+# Settings the parser reads, passed on to the workers.
+PARSER_SETTINGS = ['TESTNET', 'TESTCOIN', 'PREFIX', 'ADDRESSVERSION', 'P2SH_ADDRESSVERSION', 'UNSPENDABLE']
+
+class PrevoutReader:
+    """Serve the transactions spent by the inputs, fetched beforehand, to
+       `blocks.get_tx_info` in place of a block parser."""
+
+    def __init__(self, transactions):
+        self.transactions = transactions
+
+    def read_raw_transaction(self, tx_hash):
+        return {'__data__': self.transactions[tx_hash]}
+
+def init_worker(settings, block_index):
+    for name, value in settings.items():
+        setattr(config, name, value)
+    lib_util.CURRENT_BLOCK_INDEX = block_index
+
+def decode(item):
+    """Decode `(tx_hash, tx_hex, prevouts, block_index)` as the server's
+       `get_tx_info` would."""
+    tx_hash, tx_hex, prevouts, block_index = item
+    result = {'tx_hash': tx_hash}
+    if tx_hex is None:
+        result['error'] = 'transaction not found'
+        return result
+    try:
+        source, destination, btc_amount, fee, data = blocks.get_tx_info(tx_hex, block_parser=PrevoutReader(prevouts), block_index=block_index)
+    except KeyError as e:
+        result['error'] = 'input transaction {} not found'.format(e.args[0])
+        return result
+    except Exception as e:
+        result['error'] = str(e) or type(e).__name__
+        return result
+    result.update({
+        'source': '' if isinstance(source, bytes) else source, # `get_tx_info` gives `b''` for non-Counterparty transactions.
+        'destination': destination,
+        'btc_amount': btc_amount,
+        'fee': fee,
+        'data': binascii.hexlify(data).decode('ascii') if data else ''
+    })
+    return result
+
+def getrawtransactions(tx_hashes):
+    """Return `{tx_hash: tx_hex}` from the backend, in batches, with `None`
+       for the transactions it doesn't have."""
+    transactions = {}
+    tx_hashes = list(tx_hashes)
+    for i in range(0, len(tx_hashes), BATCH_SIZE):
+        batch = tx_hashes[i:i + BATCH_SIZE]
+        try:
+            results = util.rpc_batch(config.WALLET_URL, [('getrawtransaction', [tx_hash]) for tx_hash in batch], ssl_verify=config.WALLET_SSL_VERIFY)
+        except util.RPCError:
+            # One missing transaction fails the batch: fall back to single calls.
+            results = []
+            for tx_hash in batch:
+                try:
+                    results.append(util.wallet_api('getrawtransaction', [tx_hash]))
+                except util.RPCError:
+                    results.append(None)
+        transactions.update(zip(batch, results))
+    return transactions
+
+def prepare(lines, block_index):
+    """Turn input lines (txids or raw transactions) into items for `decode`,
+       fetching the missing transactions and, for the Counterparty
+       candidates, the transactions their inputs spend."""
+    inputs = []
+    for line in lines:
+        if TXID.match(line):
+            inputs.append((line.lower(), None))
+        else:
+            inputs.append((None, line))
+    raw = getrawtransactions({tx_hash for tx_hash, tx_hex in inputs if tx_hex is None})
+
+    unspendable_hash160 = script.base58_check_decode(config.UNSPENDABLE, config.ADDRESSVERSION)
+    parsed = []
+    prevout_hashes = set()
+    for tx_hash, tx_hex in inputs:
+        tx_hex = tx_hex if tx_hex is not None else raw.get(tx_hash)
+        tx = None
+        if tx_hex is not None:
+            try:
+                tx, _ = txparse.parse_tx(binascii.unhexlify(tx_hex))
+            except (ValueError, IndexError, txparse.ParseError):
+                pass
+        # Only transactions with data or paying the burn address have their sources looked up.
+        if tx is not None and txparse.is_candidate(tx, config.PREFIX, unspendable_hash160):
+            prevout_hashes.update(txparse.hex_hash(prevout_hash) for prevout_hash, n, _ in tx['vin'])
+        parsed.append((tx_hash or (tx['txid'] if tx else None), tx_hex, tx))
+    prevouts = {tx_hash: tx_hex for tx_hash, tx_hex in getrawtransactions(prevout_hashes).items() if tx_hex is not None}
+
+    items = []
+    for tx_hash, tx_hex, tx in parsed:
+        spent = {}
+        if tx is not None:
+            spent = {txparse.hex_hash(prevout_hash): prevouts[txparse.hex_hash(prevout_hash)] for prevout_hash, n, _ in tx['vin']
+                     if txparse.hex_hash(prevout_hash) in prevouts}
+        items.append((tx_hash, tx_hex, spent, block_index))
+    return items
+
+def get_tx_infos(lines, workers=None, block_index=None):
+    """Yield the decoded transactions of `lines`, in order. A chunk is
+       fetched from the backend while the previous one is decoded."""
+    workers = workers or os.cpu_count() or 1
+    if block_index is None:
+        block_index = util.api('get_running_info')['last_block']['block_index']
+    settings = {name: getattr(config, name) for name in PARSER_SETTINGS}
+
+    def chunks():
+        chunk = []
+        for line in lines:
+            line = line.strip()
+            if line:
+                chunk.append(line)
+            if len(chunk) == CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(settings, block_index)) as pool:
+        pending = None
+        for chunk in chunks():
+            items = prepare(chunk, block_index)
+            if pending is not None:
+                yield from pending.get()
+            pending = pool.map_async(decode, items, chunksize=max(1, len(items) // (workers * 4)))
+        if pending is not None:
+            yield from pending.get()
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,127 @@
+import json
+import time
+import logging
+import threading
+import collections
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from counterpartycli import util
+
+logger = logging.getLogger(__name__)
+
+class CassetteError(Exception):
+    pass
+
+def request_key(url, body):
+    """Identify a JSON-RPC call by endpoint path, method and params, and a
+       batch (see `util.rpc_batch`) by endpoint path and the list of the
+       `[method, params]` of its calls.
+
+       The host, port and credentials are left out so that a cassette
+       recorded against one server can be replayed with any configuration."""
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    payload = json.loads(body)
+    path = urlsplit(url).path or '/'
+    if isinstance(payload, list):
+        return json.dumps([path, [[call.get('method'), call.get('params')] for call in payload]], sort_keys=True)
+    return json.dumps([path, payload.get('method'), payload.get('params')], sort_keys=True)
+
+class Cassette:
+    """Request/response pairs stored as JSON lines."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def record(self, request, response):
+        entry = {
+            'key': request_key(request.url, request.body),
+            'status': response.status_code,
+            'reason': response.reason,
+            'response': response.text
+        }
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as cassette_file:
+                cassette_file.write(json.dumps(entry, sort_keys=True) + '\n')
+
+    def load(self):
+        entries = collections.defaultdict(collections.deque)
+        with open(self.path, 'r', encoding='utf-8') as cassette_file:
+            for line in cassette_file:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry['key']].append(entry)
+        return entries
+
+class RecordingAdapter(HTTPAdapter):
+    """Transport adapter passing requests through and saving every exchange."""
+
+    def __init__(self, cassette, *args, **kwargs):
+        super(RecordingAdapter, self).__init__(*args, **kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        response = super(RecordingAdapter, self).send(request, **kwargs)
+        self.cassette.record(request, response)
+        return response
+
+class ReplayAdapter(BaseAdapter):
+    """Transport adapter serving recorded responses, without any network access.
+
+       Identical calls are answered in recording order; once exhausted, the
+       last recorded response keeps being served so that benchmarks can loop."""
+
+    def __init__(self, cassette, latency=0):
+        super(ReplayAdapter, self).__init__()
+        self.entries = cassette.load()
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        key = request_key(request.url, request.body)
+        with self.lock:
+            self.calls += 1
+            entries = self.entries.get(key)
+            if not entries:
+                raise CassetteError('No recorded response for {}'.format(key))
+            entry = entries.popleft() if len(entries) > 1 else entries[0]
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = entry['reason']
+        response.headers = CaseInsensitiveDict({'content-type': 'application/json'})
+        response.encoding = 'utf-8'
+        response._content = entry['response'].encode('utf-8')
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+def use_adapter(adapter):
+    util.rpc_sessions.clear()
+    util.rpc_adapter = adapter
+
+def record(path):
+    """Record every RPC call (Counterparty server and wallet) to `path`."""
+    adapter = RecordingAdapter(Cassette(path))
+    use_adapter(adapter)
+    return adapter
+
+def replay(path, latency=0):
+    """Serve every RPC call from `path`, waiting `latency` seconds per call."""
+    adapter = ReplayAdapter(Cassette(path), latency=latency)
+    use_adapter(adapter)
+    return adapter
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,134 @@
+import os
+import re
+import time
+import logging
+import threading
+import apsw
+
+from counterpartylib.lib import blocks, check, database, util
+from counterpartycli.snapshot import backup_database
+from counterpartycli.util import connect_read_only
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_POLL_INTERVAL = 30 # seconds
+
+def checkpoint_dir(database_path):
+    return database_path + '.checkpoints'
+
+def list_checkpoints(database_path):
+    """Return the `(block_index, path)` of every checkpoint, oldest first."""
+    directory = checkpoint_dir(database_path)
+    if not os.path.isdir(directory):
+        return []
+    pattern = re.compile(r'^{}\.(\d+)$'.format(re.escape(os.path.basename(database_path))))
+    checkpoints = []
+    for filename in os.listdir(directory):
+        match = pattern.match(filename)
+        if match:
+            checkpoints.append((int(match.group(1)), os.path.join(directory, filename)))
+    return sorted(checkpoints)
+
+def take_checkpoint(database_path):
+    directory = checkpoint_dir(database_path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, mode=0o755)
+    tmp_path = os.path.join(directory, os.path.basename(database_path) + '.tmp')
+    block_index = backup_database(database_path, tmp_path)
+    path = os.path.join(directory, '{}.{}'.format(os.path.basename(database_path), block_index))
+    os.replace(tmp_path, path)
+    return block_index, path
+
+def prune_checkpoints(database_path, retention):
+    checkpoints = list_checkpoints(database_path)
+    for block_index, path in checkpoints[:max(len(checkpoints) - retention, 0)]:
+        logger.debug('Removing checkpoint at block {}.'.format(block_index))
+        os.remove(path)
+
+class Checkpointer(threading.Thread):
+    """Checkpoint the database every `interval` blocks while the server
+       follows the blockchain, keeping the `retention` most recent ones."""
+
+    def __init__(self, database_path, interval, retention):
+        threading.Thread.__init__(self, name='Checkpointer')
+        self.daemon = True
+        self.database_path = database_path
+        self.interval = interval
+        self.retention = retention
+
+    def last_block(self):
+        db = connect_read_only(self.database_path)
+        try:
+            return db.execute('SELECT MAX(block_index) FROM blocks').fetchone()[0] or 0
+        finally:
+            db.close()
+
+    def run(self):
+        checkpoints = list_checkpoints(self.database_path)
+        next_checkpoint = (checkpoints[-1][0] // self.interval + 1) * self.interval if checkpoints else 0
+        while True:
+            try:
+                if self.last_block() >= next_checkpoint:
+                    start_time = time.time()
+                    block_index, path = take_checkpoint(self.database_path)
+                    logger.info('Checkpoint at block {} written to `{}` in {:.1f}s.'.format(block_index, path, time.time() - start_time))
+                    prune_checkpoints(self.database_path, self.retention)
+                    next_checkpoint = (block_index // self.interval + 1) * self.interval
+            except Exception as e:
+                logger.error('Could not checkpoint database: {}'.format(e))
+            time.sleep(CHECKPOINT_POLL_INTERVAL)
+
+def undolog_reaches(db, block_index):
+    """Whether the lib can roll back to `block_index` from the undolog, as
+       `blocks.reparse_from_undolog` decides."""
+    cursor = db.cursor()
+    try:
+        return bool(list(cursor.execute('''SELECT block_index FROM undolog_block WHERE block_index IN (?, ?)''', (block_index, block_index + 1))))
+    finally:
+        cursor.close()
+
+def rollback(db, database_path, block_index):
+    """Roll the database back to the end of block `block_index` by restoring
+       the nearest checkpoint at or below it and parsing the blocks in between
+       again, with the checks `blocks.reparse` runs. Return False if the
+       undolog reaches the block, which is quicker, or there is no usable
+       checkpoint."""
+    if undolog_reaches(db, block_index):
+        logger.info('Undolog reaches block {}: not using a checkpoint.'.format(block_index))
+        return False
+    checkpoints = [checkpoint for checkpoint in list_checkpoints(database_path) if checkpoint[0] <= block_index]
+    if not checkpoints:
+        logger.info('No checkpoint at or below block {}.'.format(block_index))
+        return False
+    checkpoint_index, checkpoint_path = checkpoints[-1]
+    check.software_version()
+
+    # Keep the blocks and transactions the checkpoint doesn't have.
+    cursor = db.cursor()
+    kept_blocks = list(cursor.execute('''SELECT * FROM blocks WHERE block_index > ? AND block_index <= ? ORDER BY block_index''', (checkpoint_index, block_index)))
+    kept_transactions = list(cursor.execute('''SELECT * FROM transactions WHERE block_index > ? AND block_index <= ? ORDER BY tx_index''', (checkpoint_index, block_index)))
+
+    logger.info('Restoring checkpoint at block {}.'.format(checkpoint_index))
+    source = apsw.Connection(checkpoint_path, flags=apsw.SQLITE_OPEN_READONLY)
+    try:
+        with db.backup('main', source, 'main') as backup:
+            while not backup.done:
+                backup.step(-1)
+    finally:
+        source.close()
+
+    logger.info('Parsing {} blocks from block {} to block {}.'.format(len(kept_blocks), checkpoint_index + 1, block_index))
+    with db:
+        cursor = db.cursor()
+        for table, rows in (('blocks', kept_blocks), ('transactions', kept_transactions)):
+            for row in rows:
+                cursor.execute('''INSERT INTO {} ({}) VALUES ({})'''.format(table, ', '.join(row.keys()), ', '.join(':' + key for key in row.keys())), row)
+        for block in kept_blocks:
+            util.CURRENT_BLOCK_INDEX = block['block_index']
+            blocks.parse_block(db, block['block_index'], block['block_time'])
+        check.asset_conservation(db)
+        database.update_version(db)
+    cursor.close()
+    return True
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -2,6 +2,7 @@
 
 import os
 import sys
+import json
 import argparse
 import logging
 import getpass
@@ -16,7 +17,7 @@ from counterpartylib.lib.log import isodt
 from counterpartylib.lib.exceptions import TransactionError
 from counterpartycli.util import add_config_arguments
 from counterpartycli.setup import generate_config_files
-from counterpartycli import APP_VERSION, util, messages, wallet, console, clientapi
+from counterpartycli import APP_VERSION, profiler, util, messages, wallet, console, clientapi, cassette, deposits, mirror, orderbook, holders, bulktx
 
 APP_NAME = 'counterparty-client'
 
@@ -50,7 +51,10 @@ CONFIG_ARGS = [
     [('--unsigned',), {'action': 'store_true', 'default': False, 'help': 'print out unsigned hex of transaction; do not sign or broadcast'}],
     [('--disable-utxo-locks',), {'action': 'store_true', 'default': False, 'help': 'disable locking of UTXOs being spend'}],
     [('--dust-return-pubkey',), {'help': 'pubkey for dust outputs (required for P2SH)'}],
-    [('--requests-timeout',), {'type': int, 'default': clientapi.DEFAULT_REQUESTS_TIMEOUT, 'help': 'timeout value (in seconds) used for all HTTP requests (default: 5)'}]
+    [('--requests-timeout',), {'type': int, 'default': clientapi.DEFAULT_REQUESTS_TIMEOUT, 'help': 'timeout value (in seconds) used for all HTTP requests (default: 5)'}],
+    [('--unlock-duration',), {'type': int, 'default': wallet.DEFAULT_UNLOCK_DURATION, 'help': 'number of seconds the backend keeps the wallet unlocked once the passphrase is entered (default: 60); the client keeps neither the passphrase nor the unlock state between runs'}],
+    [('--mirror',), {'help': 'local SQLite mirror (see `sync`) to answer `getrows` and wallet views from, for the tables it has, when it is synced to the last block of the server'}],
+    [('--mirror-max-lag',), {'type': int, 'default': mirror.DEFAULT_MAX_LAG, 'help': 'number of blocks the mirror may be behind the server and still answer (default: {}); 0 to require the last block'.format(mirror.DEFAULT_MAX_LAG)}]
 ]
 
 def main():
@@ -67,6 +71,11 @@ def main():
     parser.add_argument('-h', '--help', dest='help', action='store_true', help='show this help message and exit')
     parser.add_argument('-V', '--version', action='version', version="{} v{}; {} v{}".format(APP_NAME, APP_VERSION, 'counterparty-lib', config.VERSION_STRING))
     parser.add_argument('--config-file', help='the location of the configuration file')
+    profiler.add_arguments(parser, APP_NAME)
+
+    parser.add_argument('--rpc-record', metavar='CASSETTE', help='record every RPC request and response to the specified file')
+    parser.add_argument('--rpc-replay', metavar='CASSETTE', help='answer every RPC request from the specified file instead of the network')
+    parser.add_argument('--rpc-replay-latency', type=float, default=0, metavar='SECONDS', help='latency added to each replayed RPC request (default: 0)')
 
     add_config_arguments(parser, CONFIG_ARGS, 'client.conf')
 
@@ -175,8 +184,35 @@ def main():
     parser_asset.add_argument('asset', help='the asset you are interested in')
 
     parser_wallet = subparsers.add_parser('wallet', help='list the addresses in your backend wallet along with their balances in all {} assets'.format(config.XCP_NAME))
+    parser_wallet.add_argument('--stream', action='store_true', default=False, help='print each address as soon as its balances are fetched (one JSON object per line with --json-output)')
 
     parser_pending = subparsers.add_parser('pending', help='list pending order matches awaiting {}payment from you'.format(config.BTC))
+    parser_pending.add_argument('--watch', action='store_true', default=False, help='keep running and report new, completed and expired order matches as blocks arrive')
+    parser_pending.add_argument('--interval', type=float, default=wallet.PENDING_WATCH_INTERVAL, help='number of seconds between two polls of the server, with --watch')
+
+    parser_holders = subparsers.add_parser('holders', help='list the holders of an asset, optionally at a past block, with the cost of a dividend to them')
+    parser_holders.add_argument('asset', help='the asset you are interested in')
+    parser_holders.add_argument('--block', type=int, help='list the holdings at this block, from credits and debits (escrowed quantities are left out)')
+    parser_holders.add_argument('--quantity-per-unit', help='compute the cost of paying this quantity of DIVIDEND_ASSET per whole unit held')
+    parser_holders.add_argument('--dividend-asset', default=config.XCP, help='asset in which the dividend would be paid (default: %(default)s)')
+    parser_holders.add_argument('--source', help='the address that would pay the dividend (not paid itself)')
+    parser_holders.add_argument('--limit', type=int, default=100, help='number of holders to display, largest first (0 for all; ignored with --json-output)')
+
+    parser_orderbook = subparsers.add_parser('orderbook', help='display the open orders between two assets, by price level')
+    parser_orderbook.add_argument('base', help='the asset bought and sold')
+    parser_orderbook.add_argument('quote', help='the asset prices are in')
+    parser_orderbook.add_argument('--depth', type=int, default=orderbook.DEFAULT_DEPTH, help='number of price levels to display on each side')
+    parser_orderbook.add_argument('--watch', action='store_true', default=False, help='keep running and display the book again after each block')
+    parser_orderbook.add_argument('--interval', type=float, default=orderbook.WATCH_INTERVAL, help='number of seconds between two polls of the server, with --watch')
+
+    parser_deposits = subparsers.add_parser('deposits', help='watch a list of addresses for deposits, writing their credits as JSON lines')
+    parser_deposits.add_argument('--addresses', required=True, help='file listing the addresses to watch, one per line')
+    parser_deposits.add_argument('--cursor', required=True, help='file where the last block scanned is saved, to resume from')
+    parser_deposits.add_argument('--output', help='file to append the deposits to (default: standard output)')
+    parser_deposits.add_argument('--start-block', type=int, help='first block to scan when there is no cursor yet (default: the next block)')
+    parser_deposits.add_argument('--confirmations', type=int, default=deposits.DEFAULT_CONFIRMATIONS, help='number of confirmations before a block is scanned (default: %(default)s)')
+    parser_deposits.add_argument('--interval', type=float, default=deposits.SCAN_INTERVAL, help='number of seconds between two polls of the server')
+    parser_deposits.add_argument('--once', action='store_true', default=False, help='exit once all confirmed blocks are scanned')
 
     parser_getrows = subparsers.add_parser('getrows', help='get rows from a Counterparty table')
     parser_getrows.add_argument('--table', required=True, help='table name')
@@ -190,10 +226,17 @@ def main():
     parser_getrows.add_argument('--limit', help='number of rows to return', default=100)
     parser_getrows.add_argument('--offset', help='number of rows to skip', default=0)
 
+    parser_sync = subparsers.add_parser('sync', help='copy new rows of server tables into the local SQLite mirror given by --mirror')
+    parser_sync.add_argument('--tables', nargs='+', default=mirror.DEFAULT_TABLES, help='tables to mirror (default: %(default)s)')
+    parser_sync.add_argument('--start-block', type=int, default=0, help='first block to copy rows from, on the first sync')
+
     parser_getrunninginfo = subparsers.add_parser('getinfo', help='get the current state of the server')
 
     parser_get_tx_info = subparsers.add_parser('get_tx_info', help='display info of a raw TX')
-    parser_get_tx_info.add_argument('tx_hex', help='the raw TX')
+    parser_get_tx_info.add_argument('tx_hex', nargs='?', help='the raw TX')
+    parser_get_tx_info.add_argument('--file', help='decode the raw TXs or TX hashes listed in this file (`-` for standard input), one per line, locally; TXs are fetched from the wallet backend, which needs `txindex` for TXs not in the wallet')
+    parser_get_tx_info.add_argument('--workers', type=int, help='number of processes decoding TXs, with --file (default: one per CPU)')
+    parser_get_tx_info.add_argument('--block-index', type=int, help='decode TXs with the rules of this block, with --file (default: the last block of the server)')
 
     args = parser.parse_args()
 
@@ -216,45 +259,119 @@ def main():
                         wallet_name=args.wallet_name, wallet_connect=args.wallet_connect, wallet_port=args.wallet_port, 
                         wallet_user=args.wallet_user, wallet_password=args.wallet_password,
                         wallet_ssl=args.wallet_ssl, wallet_ssl_verify=args.wallet_ssl_verify,
-                        requests_timeout=args.requests_timeout)
-
-    # MESSAGE CREATION
-    if args.action in list(messages.MESSAGE_PARAMS.keys()):
-        unsigned_hex = messages.compose(args.action, args)
-        logger.info('Transaction (unsigned): {}'.format(unsigned_hex))
-        if not args.unsigned:
-            if script.is_multisig(args.source):
-                logger.info('Multi‐signature transactions are signed and broadcasted manually.')
+                        requests_timeout=args.requests_timeout,
+                        unlock_duration=args.unlock_duration)
+
+    if args.mirror and args.action != 'sync':
+        mirror.use(args.mirror, max_lag=args.mirror_max_lag)
+
+    if args.rpc_replay:
+        cassette.replay(args.rpc_replay, latency=args.rpc_replay_latency)
+    elif args.rpc_record:
+        cassette.record(args.rpc_record)
+
+    def execute():
+        # MESSAGE CREATION
+        if args.action in list(messages.MESSAGE_PARAMS.keys()):
+            unsigned_hex = messages.compose(args.action, args)
+            logger.info('Transaction (unsigned): {}'.format(unsigned_hex))
+            if not args.unsigned:
+                if script.is_multisig(args.source):
+                    logger.info('Multi‐signature transactions are signed and broadcasted manually.')
             
-            elif input('Sign and broadcast? (y/N) ') == 'y':
-
-                if wallet.is_mine(args.source):
-                    if wallet.is_locked():
-                        passphrase = getpass.getpass('Enter your wallet passhrase: ')
-                        logger.info('Unlocking wallet for 60 (more) seconds.')
-                        wallet.unlock(passphrase)
-                    signed_tx_hex = wallet.sign_raw_transaction(unsigned_hex)
-                else:
-                    private_key_wif = input('Source address not in wallet. Please enter the private key in WIF format for {}:'.format(args.source))
-                    if not private_key_wif:
-                        raise TransactionError('invalid private key')
-                    signed_tx_hex = wallet.sign_raw_transaction(unsigned_hex, private_key_wif=private_key_wif)
-
-                logger.info('Transaction (signed): {}'.format(signed_tx_hex))
-                tx_hash = wallet.send_raw_transaction(signed_tx_hex)
-                logger.info('Hash of transaction (broadcasted): {}'.format(tx_hash))
-
-
-    # VIEWING
-    elif args.action in ['balances', 'asset', 'wallet', 'pending', 'getinfo', 'getrows', 'get_tx_info']:
-        view = console.get_view(args.action, args)
-        print_method = getattr(console, 'print_{}'.format(args.action), None)
-        if args.json_output or print_method is None:
-            util.json_print(view)
+                elif input('Sign and broadcast? (y/N) ') == 'y':
+
+                    if wallet.is_mine(args.source):
+                        if wallet.is_locked():
+                            passphrase = getpass.getpass('Enter your wallet passhrase: ')
+                            logger.info('Unlocking wallet for {} (more) seconds.'.format(args.unlock_duration))
+                            wallet.unlock(passphrase, renew=False)
+                        signed_tx_hex = wallet.sign_raw_transaction(unsigned_hex)
+                    else:
+                        private_key_wif = input('Source address not in wallet. Please enter the private key in WIF format for {}:'.format(args.source))
+                        if not private_key_wif:
+                            raise TransactionError('invalid private key')
+                        signed_tx_hex = wallet.sign_raw_transaction(unsigned_hex, private_key_wif=private_key_wif)
+
+                    logger.info('Transaction (signed): {}'.format(signed_tx_hex))
+                    tx_hash = wallet.send_raw_transaction(signed_tx_hex)
+                    logger.info('Hash of transaction (broadcasted): {}'.format(tx_hash))
+
+
+        # DEPOSITS
+        elif args.action == 'deposits':
+            addresses = deposits.load_addresses(args.addresses)
+            output = open(args.output, 'a', encoding='utf-8') if args.output else sys.stdout
+            try:
+                deposits.watch(addresses, args.cursor, output=output, start_block=args.start_block,
+                               confirmations=args.confirmations, interval=args.interval, once=args.once)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                if args.output:
+                    output.close()
+
+        # MIRROR
+        elif args.action == 'sync':
+            if not args.mirror:
+                parser.error('sync needs the path of the mirror (--mirror)')
+            mirror.sync(args.mirror, tables=args.tables, start_block=args.start_block)
+
+        # VIEWING
+        elif args.action == 'pending' and args.watch:
+            try:
+                console.print_pending_events(wallet.watch_pending(interval=args.interval), json_output=args.json_output)
+            except KeyboardInterrupt:
+                pass
+
+        elif args.action == 'holders':
+            quantity_per_unit = util.value_in(args.quantity_per_unit, config.XCP) if args.quantity_per_unit else None
+            holdings = holders.holders(args.asset, block_index=args.block, quantity_per_unit=quantity_per_unit,
+                                       dividend_asset=args.dividend_asset, source=args.source)
+            try:
+                console.print_holders(holdings, limit=args.limit, json_output=args.json_output)
+            finally:
+                holdings.close()
+
+        elif args.action == 'get_tx_info' and args.file:
+            lines = sys.stdin if args.file == '-' else open(args.file, 'r', encoding='utf-8')
+            try:
+                for tx_info in bulktx.get_tx_infos(lines, workers=args.workers, block_index=args.block_index):
+                    print(json.dumps(tx_info, sort_keys=True), flush=True)
+            finally:
+                if lines is not sys.stdin:
+                    lines.close()
+
+        elif args.action == 'get_tx_info' and not args.tx_hex:
+            parser.error('get_tx_info needs a raw TX or --file')
+
+        elif args.action == 'wallet' and args.stream:
+            console.print_wallet_stream(wallet.iter_wallet(), json_output=args.json_output)
+
+        elif args.action == 'orderbook' and args.watch:
+            try:
+                for book in orderbook.watch(args.base, args.quote, depth=args.depth, interval=args.interval):
+                    if args.json_output:
+                        util.json_print(book)
+                    else:
+                        console.print_orderbook(book)
+            except KeyboardInterrupt:
+                pass
+
+        elif args.action in ['balances', 'asset', 'wallet', 'pending', 'orderbook', 'getinfo', 'getrows', 'get_tx_info']:
+            view = console.get_view(args.action, args)
+            print_method = getattr(console, 'print_{}'.format(args.action), None)
+            if args.json_output or print_method is None:
+                util.json_print(view)
+            else:
+                print_method(view)
+
         else:
-            print_method(view)
+            parser.print_help()
 
+    if args.profile:
+        profiler.profile_call(execute, args.profile_file)
     else:
-        parser.print_help()
+        execute()
 
 # vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
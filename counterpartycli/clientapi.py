@@ -6,6 +6,7 @@ from counterpartylib.lib import config, script
 from counterpartycli import util
 from counterpartycli import wallet
 from counterpartycli import messages
+from counterpartycli import orderbook
 from counterpartycli.messages import get_pubkeys
 
 logger = logging.getLogger()
@@ -22,7 +23,8 @@ def initialize(testnet=False, testcoin=False,
                 wallet_name=None, wallet_connect=None, wallet_port=None, 
                 wallet_user=None, wallet_password=None,
                 wallet_ssl=False, wallet_ssl_verify=False,
-                requests_timeout=DEFAULT_REQUESTS_TIMEOUT):
+                requests_timeout=DEFAULT_REQUESTS_TIMEOUT,
+                unlock_duration=wallet.DEFAULT_UNLOCK_DURATION):
 
     def handle_exception(exc_type, exc_value, exc_traceback):
         logger.error("Unhandled Exception", exc_info=(exc_type, exc_value, exc_traceback))
@@ -125,6 +127,11 @@ def initialize(testnet=False, testcoin=False,
 
     config.REQUESTS_TIMEOUT = requests_timeout
 
+    # Wallet unlock
+    if unlock_duration <= 0:
+        raise ConfigurationError('invalid wallet unlock duration (must be a positive number of seconds)')
+    config.UNLOCK_DURATION = unlock_duration
+
     # Encoding
     if config.TESTCOIN:
         config.PREFIX = b'XX'                   # 2 bytes (possibly accidentally created)
@@ -187,6 +194,8 @@ def call(method, args, pubkey_resolver=None):
     if method in WALLET_METHODS:
         func = getattr(wallet, method)
         return func(**args)
+    elif method == 'orderbook':
+        return orderbook.get_orderbook(**args)
     else:
         if method.startswith('create_'):
             # Get provided pubkeys from params.
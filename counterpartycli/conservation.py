@@ -0,0 +1,102 @@
+import os
+import time
+import logging
+import multiprocessing
+
+from prettytable import PrettyTable
+
+from counterpartylib.lib import config
+from counterpartycli.util import connect_read_only
+
+logger = logging.getLogger(__name__)
+
+# Same definitions as `counterpartylib.lib.util.creations`, `destructions` and `held`,
+# restricted to the assets in `temp.checked_assets`.
+ISSUED_SQL = '''SELECT asset, SUM(quantity) AS total FROM issuances
+                WHERE status = 'valid' AND asset IN (SELECT asset FROM temp.checked_assets) GROUP BY asset'''
+DESTROYED_SQL = '''SELECT asset, SUM(quantity) AS total FROM destructions
+                   WHERE status = 'valid' AND asset != :xcp AND asset IN (SELECT asset FROM temp.checked_assets) GROUP BY asset'''
+HELD_SQL = '''SELECT asset, SUM(total) AS total FROM (
+                  SELECT asset, SUM(quantity) AS total FROM balances GROUP BY asset
+                  UNION ALL
+                  SELECT give_asset AS asset, SUM(give_remaining) AS total FROM orders WHERE status = 'open' GROUP BY give_asset
+                  UNION ALL
+                  SELECT forward_asset AS asset, SUM(forward_quantity) AS total FROM order_matches WHERE status = 'pending' GROUP BY forward_asset
+                  UNION ALL
+                  SELECT backward_asset AS asset, SUM(backward_quantity) AS total FROM order_matches WHERE status = 'pending' GROUP BY backward_asset
+              ) WHERE asset IN (SELECT asset FROM temp.checked_assets) GROUP BY asset'''
+XCP_CREATED_SQL = '''SELECT SUM(earned) AS total FROM burns WHERE status = 'valid' '''
+XCP_DESTROYED_SQL = '''SELECT
+                           (SELECT SUM(quantity) FROM destructions WHERE status = 'valid' AND asset = :xcp),
+                           (SELECT SUM(fee_paid) FROM issuances WHERE status = 'valid'),
+                           (SELECT SUM(fee_paid) FROM dividends WHERE status = 'valid')'''
+XCP_ESCROWED_SQL = '''SELECT
+                          (SELECT SUM(wager_remaining) FROM bets WHERE status = 'open'),
+                          (SELECT SUM(forward_quantity) + SUM(backward_quantity) FROM bet_matches WHERE status = 'pending'),
+                          (SELECT SUM(wager) FROM rps WHERE status = 'open'),
+                          (SELECT SUM(wager * 2) FROM rps_matches WHERE status IN ('pending', 'pending and resolved', 'resolved and pending')),
+                          (SELECT SUM(gas_cost) FROM executions WHERE status IN ('valid', 'out of gas')),
+                          (SELECT SUM(gas_remained) FROM executions WHERE status = 'out of gas')'''
+
+def check_assets(database_path, assets):
+    """Return `{asset: (supply, held)}` for `assets`, where the supply is
+       issuances minus destructions and holdings include escrowed quantities."""
+    db = connect_read_only(database_path)
+    try:
+        db.execute('CREATE TEMP TABLE checked_assets (asset TEXT PRIMARY KEY)')
+        db.executemany('INSERT INTO temp.checked_assets VALUES (?)', [(asset,) for asset in assets])
+
+        supplies = {asset: 0 for asset in assets}
+        held = {asset: 0 for asset in assets}
+        for asset, total in db.execute(ISSUED_SQL):
+            supplies[asset] += total or 0
+        for asset, total in db.execute(DESTROYED_SQL, {'xcp': config.XCP}):
+            supplies[asset] -= total or 0
+        for asset, total in db.execute(HELD_SQL):
+            held[asset] += total or 0
+
+        if config.XCP in supplies:
+            supplies[config.XCP] = (db.execute(XCP_CREATED_SQL).fetchone()[0] or 0) - \
+                                   sum(total or 0 for total in db.execute(XCP_DESTROYED_SQL, {'xcp': config.XCP}).fetchone())
+            held[config.XCP] += sum(total or 0 for total in db.execute(XCP_ESCROWED_SQL).fetchone())
+    finally:
+        db.close()
+    return {asset: (supplies[asset], held[asset]) for asset in assets}
+
+def list_assets(database_path):
+    db = connect_read_only(database_path)
+    try:
+        return [config.XCP] + [row[0] for row in db.execute('''SELECT DISTINCT asset FROM issuances WHERE status = 'valid' ORDER BY asset''')]
+    finally:
+        db.close()
+
+def check(database_path, workers=None):
+    """Verify the conservation of every asset in the database at
+       `database_path`, splitting the assets across `workers` processes.
+       Print and return the discrepancies as `{asset: (supply, held)}`."""
+    workers = workers or os.cpu_count() or 1
+    start_time = time.time()
+    assets = list_assets(database_path)
+    # Round-robin, so that XCP (the most expensive asset) doesn't land with a full share of the others.
+    shares = [assets[i::workers] for i in range(workers) if assets[i::workers]]
+    logger.info('Checking conservation of {} assets with {} workers.'.format(len(assets), len(shares)))
+
+    totals = {}
+    with multiprocessing.Pool(len(shares)) as pool:
+        for result in pool.starmap(check_assets, [(database_path, share) for share in shares]):
+            totals.update(result)
+
+    discrepancies = {asset: (supply, held) for asset, (supply, held) in totals.items() if supply != held}
+    if discrepancies:
+        table = PrettyTable(['Asset', 'Issued', 'Held', 'Difference'])
+        for asset in sorted(discrepancies):
+            supply, held = discrepancies[asset]
+            table.add_row([asset, supply, held, held - supply])
+        print(table)
+        logger.error('{} of {} assets not conserved.'.format(len(discrepancies), len(assets)))
+    else:
+        logger.info('All {} assets conserved.'.format(len(assets)))
+    logger.info('Checked in {:.1f}s.'.format(time.time() - start_time))
+    return discrepancies
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
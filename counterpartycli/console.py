@@ -1,6 +1,8 @@
 import os
+import json
 from prettytable import PrettyTable
-from counterpartycli import wallet, util
+from counterpartycli import wallet, util, orderbook
+from counterpartylib.lib import config
 
 # TODO: inelegant
 def get_view(view_name, args):
@@ -12,6 +14,8 @@ def get_view(view_name, args):
         return wallet.wallet()
     elif view_name == 'pending':
         return wallet.pending()
+    elif view_name == 'orderbook':
+        return orderbook.get_orderbook(args.base, args.quote, depth=args.depth)
     elif view_name == 'getinfo':
         return util.api('get_running_info')
     elif view_name == 'get_tx_info':
@@ -100,13 +104,95 @@ def print_wallet(wallet):
     lines.append('')
     print(os.linesep.join(lines))
 
+def format_order_match(order_match, block_index):
+    blocks_left = order_match['match_expire_index'] - block_index
+    return [order_match['id'], '{} blocks'.format(max(blocks_left, 0))]
+
+def print_wallet_stream(items, json_output=False):
+    """Print each address of `wallet.iter_wallet()` as it comes, then the totals."""
+    for item in items:
+        if json_output:
+            print(json.dumps(item, sort_keys=True, cls=util.JsonDecimalEncoder), flush=True)
+            continue
+        if 'address' in item:
+            if not item['balances']:
+                continue
+            title, balances = item['address'], item['balances']
+        else:
+            title, balances = 'TOTAL', item['assets']
+        table = PrettyTable(['Asset', 'Balance'])
+        for asset in balances:
+            table.add_row([asset, balances[asset]])
+        print(os.linesep.join([title, table.get_string(), '']), flush=True)
+
 def print_pending(awaiting_btcs):
+    block_index = util.api('get_running_info')['last_block']['block_index']
     table = PrettyTable(['Matched Order ID', 'Time Left'])
     for order_match in awaiting_btcs:
-        order_match = format_order_match(order_match)
+        order_match = format_order_match(order_match, block_index)
         table.add_row(order_match)
     print(table)
 
+def print_pending_events(events, json_output=False):
+    for event in events:
+        if json_output:
+            print(json.dumps(event, sort_keys=True, cls=util.JsonDecimalEncoder), flush=True)
+        else:
+            id_, time_left = format_order_match(event['order_match'], event['block_index'])
+            print('{:>8} {:>9}  {}  ({} left)'.format(event['block_index'], event['event'], id_, time_left), flush=True)
+
+def print_orderbook(book):
+    lines = []
+    lines.append('')
+    lines.append('{}/{} at block {}'.format(book['base'], book['quote'], book['block_index']))
+    for side in ('asks', 'bids'):
+        table = PrettyTable(['Price ({})'.format(book['quote']), 'Quantity ({})'.format(book['base']), 'Orders'])
+        table.align = 'r'
+        for level in book[side]:
+            table.add_row([level['price'], level['quantity'], level['orders']])
+        lines.append(side.capitalize())
+        lines.append(table.get_string())
+    lines.append('')
+    print(os.linesep.join(lines), flush=True)
+
+def print_holders(holdings, limit=None, json_output=False):
+    summary = holdings.summary
+    divisible = util.is_divisible(summary['asset'])
+    dividend_divisible = 'dividend_asset' in summary and (summary['dividend_asset'] in (config.BTC, config.XCP) or util.is_divisible(summary['dividend_asset']))
+    if json_output:
+        # One line per holder, then the summary: the list may not fit in memory.
+        for address, quantity, dividend in holdings:
+            line = {'address': address, 'quantity': quantity}
+            if 'dividend_asset' in summary:
+                line['dividend'] = dividend
+            print(json.dumps(line, sort_keys=True))
+        print(json.dumps({'summary': summary}, sort_keys=True))
+        return
+
+    headers = ['Address', 'Quantity']
+    if 'dividend_asset' in summary:
+        headers.append('Dividend ({})'.format(summary['dividend_asset']))
+    table = PrettyTable(headers)
+    table.align = 'r'
+    table.align['Address'] = 'l'
+    for i, (address, quantity, dividend) in enumerate(holdings):
+        if limit and i >= limit:
+            break
+        row = [address, util.value_out(quantity, summary['asset'], divisible=divisible)]
+        if 'dividend_asset' in summary:
+            row.append(util.value_out(dividend, summary['dividend_asset'], divisible=dividend_divisible))
+        table.add_row(row)
+    lines = ['', '{} holders{}'.format(summary['asset'], ' at block {}'.format(summary['block_index']) if summary['block_index'] is not None else ''), table.get_string()]
+    if limit and summary['holders'] > limit:
+        lines.append('({} more)'.format(summary['holders'] - limit))
+    lines.append('Holders: {}'.format(summary['holders']))
+    lines.append('Total: {}'.format(util.value_out(summary['total'], summary['asset'], divisible=divisible)))
+    if 'dividend_asset' in summary:
+        lines.append('Dividend: {} {}'.format(util.value_out(summary['dividend_total'], summary['dividend_asset'], divisible=dividend_divisible), summary['dividend_asset']))
+        lines.append('Fee: {} {}'.format(util.value_out(summary['fee'], config.XCP, divisible=True), config.XCP))
+    lines.append('')
+    print(os.linesep.join(lines))
+
 def print_getrows(rows):
     if len(rows) > 0:
         headers = list(rows[0].keys())
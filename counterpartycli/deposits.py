@@ -0,0 +1,121 @@
+"""Watch a large set of deposit addresses for credits, block range by block
+range, matching the rows locally: the cost of a scan depends on the
+activity in the blocks, not on the number of addresses watched."""
+
+import os
+import sys
+import json
+import time
+import logging
+
+from counterpartycli import util
+
+logger = logging.getLogger(__name__)
+
+SCAN_INTERVAL = 10 # seconds
+MAX_BLOCKS_PER_SCAN = 100
+PAGE_SIZE = 1000
+DEFAULT_CONFIRMATIONS = 6
+KEPT_SCAN_POINTS = 100
+
+class DepositsError(Exception):
+    pass
+
+def load_addresses(path):
+    """Return the addresses listed in the file at `path`, one per line."""
+    with open(path, 'r', encoding='utf-8') as address_file:
+        return frozenset(line.strip() for line in address_file if line.strip() and not line.startswith('#'))
+
+def read_cursor(path):
+    """Return the `(block_index, block_hash)` of the last blocks of the
+       ranges scanned, most recent first, as saved at `path`, or `[]`."""
+    try:
+        with open(path, 'r', encoding='utf-8') as cursor_file:
+            cursor = json.load(cursor_file)
+    except FileNotFoundError:
+        return []
+    # Cursors written before the hashes were saved have only `block_index`.
+    return [tuple(point) for point in cursor.get('blocks', [])] or [(cursor['block_index'], None)]
+
+def write_cursor(path, scan_points):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as cursor_file:
+        json.dump({'block_index': scan_points[0][0], 'blocks': scan_points[:KEPT_SCAN_POINTS]}, cursor_file)
+        cursor_file.flush()
+        os.fsync(cursor_file.fileno())
+    os.replace(temp_path, path)
+
+def block_hash(block_index):
+    return util.api('get_block_info', {'block_index': block_index})['block_hash']
+
+def find_fork(scan_points):
+    """Return the scan points still on the server's chain."""
+    for i, (block_index, saved_hash) in enumerate(scan_points):
+        try:
+            if saved_hash is None or block_hash(block_index) == saved_hash:
+                return scan_points[i:]
+        except util.RPCError:
+            pass
+    return []
+
+def scan(addresses, start_block, end_block):
+    """Yield the credits to `addresses` between `start_block` and `end_block`
+       included. Credits cover sends as well as order, BTCpay, dividend and
+       other credits."""
+    # Pages are ordered by `rowid`: `block_index` isn't unique, and offsets
+    # into rows of equal `block_index` may skip or repeat credits.
+    credits = util.api_pages('get_credits', {
+        'start_block': start_block,
+        'end_block': end_block,
+        'order_by': 'rowid'
+    }, page_size=PAGE_SIZE)
+    for credit in credits:
+        if credit['address'] in addresses:
+            yield credit
+
+def watch(addresses, cursor_path, output=sys.stdout, start_block=None, confirmations=DEFAULT_CONFIRMATIONS, interval=SCAN_INTERVAL, once=False):
+    """Write the credits to `addresses` to `output` as JSON lines, as blocks
+       reach `confirmations` confirmations. The last block scanned is saved
+       at `cursor_path` once its credits are written, so that a restarted
+       watch resumes after it (a crash in between repeats the last range:
+       deduplicate on `event`, `address` and `asset`). If the server's chain
+       no longer has the last block scanned, the blocks after the last one it
+       still has are scanned again. With `once`, stop when caught up."""
+    scan_points = read_cursor(cursor_path)
+    if not scan_points:
+        if start_block is None:
+            start_block = util.api('get_running_info')['last_block']['block_index'] + 1
+        scan_points = [(start_block - 1, None)]
+    logger.info('Watching {} addresses from block {}.'.format(len(addresses), scan_points[0][0] + 1))
+
+    while True:
+        last_block = util.api('get_running_info')['last_block']
+        if last_block is not None and scan_points[0][1] is not None:
+            fork = find_fork(scan_points)
+            if not fork:
+                raise DepositsError('Server chain shares no block with `{}`: scan again from a known block.'.format(cursor_path))
+            if fork[0] != scan_points[0]:
+                logger.warning('Server chain reorganised: scanning again from block {}.'.format(fork[0][0] + 1))
+                scan_points = fork
+        last_scanned = scan_points[0][0]
+        confirmed = last_block['block_index'] - confirmations + 1 if last_block is not None else last_scanned
+        end_block = min(confirmed, last_scanned + MAX_BLOCKS_PER_SCAN)
+        if end_block > last_scanned:
+            start_time = time.time()
+            # Hashed before the scan: a reorg during the scan is caught at the next poll.
+            end_hash = block_hash(end_block)
+            count = 0
+            for credit in scan(addresses, last_scanned + 1, end_block):
+                output.write(json.dumps(credit, sort_keys=True) + '\n')
+                count += 1
+            output.flush()
+            scan_points.insert(0, (end_block, end_hash))
+            write_cursor(cursor_path, scan_points)
+            logger.debug('Scanned blocks {}–{} in {:.2f}s: {} deposits.'.format(last_scanned + 1, end_block, time.time() - start_time, count))
+            if end_block < confirmed:
+                continue
+        if once:
+            break
+        time.sleep(interval)
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import logging
+import threading
+import http.client
+import urllib.request
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_SEGMENT_SIZE = 64 * 1024 * 1024
+DOWNLOAD_TIMEOUT = 60 # seconds
+DOWNLOAD_RETRIES = 5
+PROGRESS_INTERVAL = 0.5 # seconds
+
+class DownloadError(Exception):
+    pass
+
+def format_duration(seconds):
+    """Format `seconds` as days, hours and minutes, e.g. `2d 03h 15m`;
+       under an hour, as minutes and seconds."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return '{}d {:02d}h {:02d}m'.format(days, hours, minutes)
+    if hours:
+        return '{}h {:02d}m'.format(hours, minutes)
+    return '{}m {:02d}s'.format(minutes, seconds)
+
+class Progress:
+    """Thread-safe progress bar with throughput and ETA, written to stderr."""
+
+    def __init__(self, total_size=None, stream=sys.stderr):
+        self.total_size = total_size
+        self.stream = stream
+        self.done = 0
+        self.start_time = time.time()
+        self.last_display = 0
+        self.lock = threading.Lock()
+
+    def add(self, size):
+        with self.lock:
+            self.done += size
+            now = time.time()
+            if now - self.last_display >= PROGRESS_INTERVAL or (self.total_size and self.done >= self.total_size):
+                self.last_display = now
+                self.display(now)
+
+    def display(self, now):
+        elapsed = max(now - self.start_time, 1e-6)
+        throughput = self.done / elapsed
+        if self.total_size:
+            eta = (self.total_size - self.done) / throughput if throughput else 0
+            line = '\r%5.1f%% %*d / %d  %6.2f MB/s  ETA %s' % (
+                self.done * 1e2 / self.total_size, len(str(self.total_size)), self.done, self.total_size,
+                throughput / 1e6, format_duration(eta))
+        else:
+            line = '\rread %d  %6.2f MB/s' % (self.done, throughput / 1e6)
+        self.stream.write(line)
+        self.stream.flush()
+
+    def finish(self):
+        with self.lock:
+            self.display(time.time())
+            self.stream.write('\n')
+
+def probe(url):
+    """Return the size of the resource at `url` and whether it can be fetched by byte ranges."""
+    request = urllib.request.Request(url, method='HEAD')
+    with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response:
+        content_length = response.getheader('Content-Length')
+        accept_ranges = response.getheader('Accept-Ranges', '')
+    size = int(content_length) if content_length is not None else None
+    return size, size is not None and 'bytes' in accept_ranges.lower()
+
+def fetch_segment(url, path, start, end, progress=None, retries=DOWNLOAD_RETRIES):
+    """Download bytes `start` to `end` (inclusive) of `url` into `path`,
+       resuming from the last written byte on each retry."""
+    position = start
+    attempt = 0
+    while position <= end:
+        try:
+            request = urllib.request.Request(url, headers={'Range': 'bytes={}-{}'.format(position, end)})
+            with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response:
+                if response.status != 206:
+                    raise DownloadError('{} does not support byte ranges.'.format(url))
+                with open(path, 'r+b') as target:
+                    target.seek(position)
+                    while position <= end:
+                        chunk = response.read(min(DOWNLOAD_CHUNK_SIZE, end - position + 1))
+                        if not chunk:
+                            break
+                        target.write(chunk)
+                        position += len(chunk)
+                        if progress:
+                            progress.add(len(chunk))
+            if position <= end:
+                raise DownloadError('connection closed early')
+        except (OSError, http.client.HTTPException, DownloadError) as e:
+            attempt += 1
+            if attempt > retries:
+                raise DownloadError('Segment {}-{} failed: {}'.format(start, end, e))
+            logger.warning('Segment {}-{} interrupted at byte {} ({}), retrying ({}/{}).'.format(start, end, position, e, attempt, retries))
+            time.sleep(min(2 ** attempt, 30))
+
+def segmented_download(url, path, size, workers=4, segment_size=DOWNLOAD_SEGMENT_SIZE, retries=DOWNLOAD_RETRIES, progress=None):
+    """Download `url` (of `size` bytes) into `path` with `workers` concurrent
+       byte-range requests. Each segment is retried individually."""
+    with open(path, 'wb') as target:
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(target.fileno(), 0, size)
+        else:
+            target.truncate(size)
+
+    segments = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fetch_segment, url, path, start, end, progress, retries) for start, end in segments]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+        except:
+            for future in futures:
+                future.cancel()
+            raise
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,243 @@
+"""Holder distribution of an asset, now or at a past block, with the cost of
+paying a dividend to its holders, as counterparty-lib computes it."""
+
+import os
+import queue
+import logging
+import sqlite3
+import tempfile
+import threading
+
+from counterpartylib.lib import config
+from counterpartycli import util
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 1000
+PREFETCH_PAGES = 4
+MAX_IN_MEMORY = 200000 # addresses aggregated before spilling to disk
+
+def prefetch(method, params, page_size=PAGE_SIZE, pages=PREFETCH_PAGES):
+    """Yield the rows of a `get_<table>` call while a thread fetches the next
+       `pages` pages."""
+    fetched = queue.Queue(maxsize=pages)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up once the consumer is gone, rather than block on a full queue.
+        while not stop.is_set():
+            try:
+                fetched.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fetch():
+        try:
+            page = []
+            for row in util.api_pages(method, params, page_size=page_size):
+                page.append(row)
+                if len(page) == page_size:
+                    if not put(page):
+                        return
+                    page = []
+            if put(page):
+                put(None)
+        except Exception as e:
+            put(e)
+
+    threading.Thread(target=fetch, name='Prefetch-{}'.format(method), daemon=True).start()
+    try:
+        while True:
+            page = fetched.get()
+            if page is None:
+                return
+            if isinstance(page, Exception):
+                raise page
+            yield from page
+    finally:
+        stop.set()
+
+def current_holdings(asset):
+    """Yield `(address, quantity)` for the balances and escrowed quantities
+       of `asset`, as `counterpartylib.lib.util.holders` lists them (but for
+       the gas of contract executions, which the API doesn't serve)."""
+    sources = [
+        ('get_balances', [('asset', '==', asset)], 'address', 'quantity', None),
+        ('get_orders', [('give_asset', '==', asset)], 'source', 'give_remaining', 'open'),
+        ('get_order_matches', [('forward_asset', '==', asset)], 'tx0_address', 'forward_quantity', 'pending'),
+        ('get_order_matches', [('backward_asset', '==', asset)], 'tx1_address', 'backward_quantity', 'pending'),
+    ]
+    # Bets and RPS only escrow XCP.
+    if asset == config.XCP:
+        sources += [
+            ('get_bets', [], 'source', 'wager_remaining', 'open'),
+            ('get_bet_matches', [], 'tx0_address', 'forward_quantity', 'pending'),
+            ('get_bet_matches', [], 'tx1_address', 'backward_quantity', 'pending'),
+            ('get_rps', [], 'source', 'wager', 'open'),
+            ('get_rps_matches', [], 'tx0_address', 'wager', ['pending', 'pending and resolved', 'resolved and pending']),
+            ('get_rps_matches', [], 'tx1_address', 'wager', ['pending', 'pending and resolved', 'resolved and pending']),
+        ]
+    for method, filters, address_field, quantity_field, status in sources:
+        params = {'filters': filters, 'order_by': 'rowid'}
+        if status:
+            params['status'] = status
+        for row in prefetch(method, params):
+            yield row[address_field], row[quantity_field]
+
+def past_holdings(asset, block_index):
+    """Yield `(address, quantity)` for the credits and (negated) debits of
+       `asset` up to `block_index`. Quantities escrowed then were debited, so
+       they are left out."""
+    params = {'filters': [('asset', '==', asset)], 'end_block': block_index, 'order_by': 'rowid'}
+    for credit in prefetch('get_credits', params):
+        yield credit['address'], credit['quantity']
+    for debit in prefetch('get_debits', params):
+        yield debit['address'], -debit['quantity']
+
+class Aggregator:
+    """Sum quantities (and dividends) by address, in memory up to
+       `max_in_memory` addresses, then in a temporary SQLite database."""
+
+    def __init__(self, max_in_memory=MAX_IN_MEMORY):
+        self.max_in_memory = max_in_memory
+        self.totals = {}
+        self.db = None
+        self.path = None
+
+    def add(self, address, quantity, dividend=0):
+        total = self.totals.get(address)
+        self.totals[address] = (total[0] + quantity, total[1] + dividend) if total else (quantity, dividend)
+        if len(self.totals) >= self.max_in_memory:
+            self.spill()
+
+    def spill(self):
+        if self.db is None:
+            handle, self.path = tempfile.mkstemp(prefix='holders-', suffix='.db')
+            os.close(handle)
+            self.db = sqlite3.connect(self.path)
+            self.db.execute('''PRAGMA journal_mode = OFF''')
+            self.db.execute('''PRAGMA synchronous = OFF''')
+            self.db.execute('''CREATE TABLE totals (address TEXT PRIMARY KEY, quantity INTEGER, dividend INTEGER)''')
+            logger.debug('Spilling holder totals to `{}`.'.format(self.path))
+        # Without `ON CONFLICT ... DO UPDATE`, which needs SQLite 3.24.
+        with self.db:
+            self.db.executemany('''INSERT OR IGNORE INTO totals VALUES (?, 0, 0)''', [(address,) for address in self.totals])
+            self.db.executemany('''UPDATE totals SET quantity = quantity + ?, dividend = dividend + ? WHERE address = ?''',
+                                [(quantity, dividend, address) for address, (quantity, dividend) in self.totals.items()])
+        self.totals = {}
+
+    def __iter__(self):
+        """Yield `(address, quantity, dividend)` by decreasing quantity."""
+        if self.db is None:
+            yield from ((address, quantity, dividend) for address, (quantity, dividend)
+                        in sorted(self.totals.items(), key=lambda item: (-item[1][0], item[0])))
+        else:
+            self.spill()
+            yield from self.db.execute('''SELECT address, quantity, dividend FROM totals ORDER BY quantity DESC, address''')
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            os.remove(self.path)
+            self.db = None
+
+def dividend_quantity(quantity, quantity_per_unit, divisible, dividend_divisible):
+    """What `dividend.validate` pays for `quantity` of the asset, before the
+       dust check and the rounding down: computed the same way, in floating
+       point, so that large quantities round the same."""
+    dividend = quantity * quantity_per_unit
+    if divisible:
+        dividend /= config.UNIT
+    if not dividend_divisible:
+        dividend /= config.UNIT
+    return dividend
+
+def dividend_fee(recipients, dividend_asset, block_index):
+    """The XCP fee of a dividend to `recipients` addresses at `block_index`."""
+    if dividend_asset == config.BTC:
+        return 0
+    if block_index >= 330000 or config.TESTNET: # Protocol change.
+        return int(0.0002 * config.UNIT * recipients)
+    return 0
+
+class Holdings:
+    """Holders of an asset, by decreasing quantity, as `(address, quantity,
+       dividend)`, and a `summary` of them."""
+
+    def __init__(self, aggregator, summary, pay=None):
+        self.aggregator = aggregator
+        self.summary = summary
+        self.pay = pay
+
+    def __iter__(self):
+        for address, quantity, dividend in self.aggregator:
+            if quantity > 0:
+                yield address, quantity, self.pay(address, quantity) if self.pay else dividend
+
+    def close(self):
+        self.aggregator.close()
+
+def holders(asset, block_index=None, quantity_per_unit=None, dividend_asset=config.XCP, source=None, max_in_memory=MAX_IN_MEMORY):
+    """Aggregate the holdings of `asset`, now or, with `block_index`, at
+       that block. With `quantity_per_unit` (in smallest units of
+       `dividend_asset` per whole unit of `asset`), also compute what a
+       dividend from `source` would pay each holder, and its fee, following
+       `dividend.validate` and its protocol changes at that block (or the
+       server's last block)."""
+    divisible = util.is_divisible(asset)
+    dividend_divisible = dividend_asset in (config.BTC, config.XCP) or util.is_divisible(dividend_asset)
+    rules_block = block_index
+    if quantity_per_unit is not None and rules_block is None:
+        rules_block = util.api('get_running_info')['last_block']['block_index']
+    # Protocol change: the source is paid too before block 296000.
+    paid_source = rules_block is not None and rules_block < 296000 and not config.TESTNET
+
+    def recipient(address):
+        return address != source or paid_source
+
+    def pay(address, quantity):
+        if quantity_per_unit is None or not recipient(address):
+            return 0
+        dividend = dividend_quantity(quantity, quantity_per_unit, divisible, dividend_divisible)
+        if dividend_asset == config.BTC and dividend < config.DEFAULT_MULTISIG_DUST_SIZE:
+            return 0
+        return int(dividend)
+
+    aggregator = Aggregator(max_in_memory=max_in_memory)
+    if block_index is None:
+        # Each balance and escrowed quantity is paid (and rounded down) on its own.
+        for address, quantity in current_holdings(asset):
+            aggregator.add(address, quantity, pay(address, quantity))
+        holdings = Holdings(aggregator, None)
+    else:
+        # Escrowed quantities were debited, so they are left out, where
+        # `dividend.validate` pays them from block 294500.
+        for address, quantity in past_holdings(asset, block_index):
+            aggregator.add(address, quantity)
+        holdings = Holdings(aggregator, None, pay=pay)
+
+    summary = {'asset': asset, 'block_index': block_index, 'holders': 0, 'total': 0}
+    recipients = dividend_total = 0
+    for address, quantity, dividend in aggregator:
+        if holdings.pay:
+            dividend = pay(address, quantity) if quantity > 0 else 0
+        if quantity > 0:
+            summary['holders'] += 1
+            summary['total'] += quantity
+        # Every address with a balance, even an empty one, counts towards the
+        # fee; for BTC dividends, which have no fee, dust outputs are dropped.
+        if recipient(address):
+            recipients += 1
+        dividend_total += dividend
+    if quantity_per_unit is not None:
+        summary.update({
+            'dividend_asset': dividend_asset,
+            'dividend_total': dividend_total,
+            'fee': dividend_fee(recipients, dividend_asset, rules_block)
+        })
+    holdings.summary = summary
+    return holdings
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
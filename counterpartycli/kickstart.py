@@ -0,0 +1,230 @@
+"""Parallel `kickstart`: worker processes read and decode the blocks ahead of
+the database writer, with counterpartylib's own block parser and
+`get_tx_info`, and hand them over in chain order."""
+
+import os
+import time
+import logging
+import binascii
+import collections
+import multiprocessing
+
+from counterpartylib import server
+from counterpartylib.lib import blocks, config
+from counterpartylib.lib import util as lib_util
+from counterpartylib.lib.kickstart.blocks_parser import BlockchainParser, ChainstateParser
+from counterpartylib.lib.kickstart.bc_data_stream import BCDataStream
+from counterpartylib.lib.kickstart.utils import ib2h, inverse_hash
+from counterpartycli import bulktx
+from counterpartycli.util import patch
+
+logger = logging.getLogger(__name__)
+
+BLOCKS_IN_FLIGHT = 8 # per worker; bounds the memory used by decoded blocks
+
+class PrevoutsNeeded(Exception):
+    """The inputs of a transaction must be looked up, which only the writer
+       can do: LevelDB can't be opened by several processes."""
+
+class BlockFileReader(BlockchainParser):
+    """`BlockchainParser` reading blocks at known positions of the block
+       files, without the block and transaction index."""
+
+    def __init__(self, blocks_dir):
+        self.blocks_dir = blocks_dir
+        self.file_num = -1
+        self.current_file_size = 0
+        self.current_block_file = None
+        self.data_stream = None
+        self.ldb = None
+
+    def prepare_data_stream(self, file_num, pos_in_file):
+        # Unmap the previous file: a mapping keeps its file descriptor open.
+        if self.data_stream is not None and file_num != self.file_num:
+            self.data_stream.close_file()
+        super(BlockFileReader, self).prepare_data_stream(file_num, pos_in_file)
+
+    def read_block_at(self, file_num, position, block_index):
+        self.prepare_data_stream(file_num, position)
+        block = self.read_block(self.data_stream)
+        block['block_index'] = block_index
+        return block
+
+    def read_raw_transaction(self, tx_hash):
+        raise PrevoutsNeeded(tx_hash)
+
+    def close(self):
+        if self.data_stream is not None:
+            self.data_stream.close_file()
+        if self.current_block_file:
+            self.current_block_file.close()
+
+READER = None # `BlockFileReader` of the worker process
+
+def init_worker(blocks_dir, settings, block_index):
+    global READER
+    bulktx.init_worker(settings, block_index)
+    READER = BlockFileReader(blocks_dir)
+
+def decode_block(location):
+    """Read the block at `location` and decode its transactions as
+       `blocks.kickstart` does. Transactions whose inputs must be looked up
+       are left out, for the writer to decode."""
+    block_hash, block_index, file_num, position = location
+    block = READER.read_block_at(file_num, position, block_index)
+    tx_infos = {}
+    for tx in block['transactions']:
+        try:
+            tx_infos[tx['__data__']] = blocks.get_tx_info(tx['__data__'], block_parser=READER, block_index=block_index)
+        except PrevoutsNeeded:
+            pass
+    # Only what `blocks.kickstart` uses is sent back.
+    return {
+        'block_hash': block['block_hash'],
+        'block_index': block_index,
+        'block_time': block['block_time'],
+        'hash_prev': block['hash_prev'],
+        'transactions': [{'tx_hash': tx['tx_hash'], '__data__': tx['__data__']} for tx in block['transactions']],
+        'tx_infos': tx_infos
+    }
+
+def block_location(ldb, block_hash):
+    """Return the height of `block_hash`, its file number and position in
+       that file, and the hash of its parent, read from the block index as
+       `BlockchainParser.read_raw_block` reads them."""
+    ds = BCDataStream()
+    ds.write(ldb.get(b'b' + binascii.unhexlify(inverse_hash(block_hash))))
+    ds.read_var_int() # version
+    height = ds.read_var_int()
+    ds.read_var_int() # status
+    ds.read_var_int() # transaction count
+    file_num = ds.read_var_int()
+    position = ds.read_var_int() - 8
+    ds.read_var_int() # undo position
+    header = ds.read_bytes(80)
+    return height, file_num, position, ib2h(header[4:36])
+
+def chain_height(bitcoind_dir):
+    """Return the height of the last block `blocks.kickstart` will read from
+       `bitcoind_dir`, or `None` if it can't be read. The chainstate and
+       block index are closed again before the kickstart opens them."""
+    if config.TESTNET:
+        bitcoind_dir = os.path.join(bitcoind_dir, 'testnet3')
+    try:
+        chainstate = ChainstateParser(os.path.join(bitcoind_dir, 'chainstate'))
+        try:
+            last_hash = chainstate.get_last_block_hash()
+        finally:
+            chainstate.close()
+        parser = BlockchainParser(os.path.join(bitcoind_dir, 'blocks'), os.path.join(bitcoind_dir, 'blocks', 'index'))
+        try:
+            return block_location(parser.ldb, last_hash)[0]
+        finally:
+            parser.close()
+    except Exception as e:
+        logger.warning('Could not read the height of the chain: {}'.format(e))
+        return None
+
+def chain(ldb, last_hash, first_hash):
+    """Yield `(block_hash, block_index, file_num, position)` from `last_hash`
+       back to `first_hash`, the order in which `blocks.kickstart` reads them."""
+    block_hash = last_hash
+    while block_hash is not None:
+        height, file_num, position, previous_hash = block_location(ldb, block_hash)
+        yield block_hash, height, file_num, position
+        block_hash = previous_hash if block_hash != first_hash else None
+
+class PrefetchingParser(BlockchainParser):
+    """`BlockchainParser` for `blocks.kickstart`, serving the blocks decoded
+       ahead by `workers` processes. The transactions they decoded are
+       served by `use_decoded`; the others are decoded as usual."""
+
+    def __init__(self, blocks_dir, leveldb_dir, workers):
+        super(PrefetchingParser, self).__init__(blocks_dir, leveldb_dir)
+        self.workers = workers
+        self.pool = None
+        self.locations = None
+        self.pending = collections.deque()
+        self.tx_infos = {}
+        self.decoded = self.deferred = 0
+        self.start_time = None
+
+    def start(self, last_hash):
+        first_hash = config.BLOCK_FIRST_TESTNET_HASH if config.TESTNET else config.BLOCK_FIRST_MAINNET_HASH
+        self.locations = chain(self.ldb, last_hash, first_hash)
+        settings = {name: getattr(config, name) for name in bulktx.PARSER_SETTINGS}
+        # `get_tx_info` reads protocol changes at the current block index, which doesn't change until the reparse.
+        self.pool = multiprocessing.Pool(self.workers, initializer=init_worker, initargs=(self.blocks_dir, settings, lib_util.CURRENT_BLOCK_INDEX))
+        self.start_time = time.time()
+
+    def read_raw_block(self, block_hash):
+        if self.locations is None:
+            self.start(block_hash)
+        while len(self.pending) < self.workers * BLOCKS_IN_FLIGHT:
+            location = next(self.locations, None)
+            if location is None:
+                break
+            self.pending.append((location[0], self.pool.apply_async(decode_block, (location,))))
+
+        if self.pending and self.pending[0][0] == block_hash:
+            block = self.pending.popleft()[1].get()
+            self.tx_infos = block.pop('tx_infos')
+            self.decoded += len(self.tx_infos)
+            self.deferred += len(block['transactions']) - len(self.tx_infos)
+            return block
+
+        # Not the block the index led to: read this one, and the next ones, as usual.
+        if self.pool is not None:
+            logger.warning('Block {} was not read ahead; reading the remaining blocks without workers.'.format(block_hash))
+            self.stop()
+        self.locations = iter(())
+        self.tx_infos = {}
+        return super(PrefetchingParser, self).read_raw_block(block_hash)
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.pending.clear()
+
+    def close(self):
+        if self.start_time is not None:
+            logger.info('Read blocks in {:.1f}s: {} transactions decoded by {} workers, {} by the writer.'.format(
+                time.time() - self.start_time, self.decoded, self.workers, self.deferred))
+        self.stop()
+        super(PrefetchingParser, self).close()
+
+def use_decoded(get_tx_info):
+    def wrapper(tx_hex, block_parser=None, block_index=None):
+        if isinstance(block_parser, PrefetchingParser) and tx_hex in block_parser.tx_infos:
+            return block_parser.tx_infos.pop(tx_hex)
+        return get_tx_info(tx_hex, block_parser=block_parser, block_index=block_index)
+    return wrapper
+
+def kickstart(db, bitcoind_dir=None, workers=1):
+    """Run `server.kickstart`, with `workers` processes reading and decoding
+       the blocks ahead of the database writer. Only the transactions whose
+       inputs must be looked up (those carrying data or burning) are decoded
+       by the writer."""
+    if workers <= 1:
+        return server.kickstart(db, bitcoind_dir=bitcoind_dir)
+
+    parsers = []
+    def make_parser(blocks_dir, leveldb_dir):
+        parser = PrefetchingParser(blocks_dir, leveldb_dir, workers)
+        parsers.append(parser)
+        return parser
+
+    original_parser = blocks.BlockchainParser
+    blocks.BlockchainParser = make_parser
+    undo = patch(blocks, 'get_tx_info', use_decoded)
+    try:
+        return server.kickstart(db, bitcoind_dir=bitcoind_dir)
+    finally:
+        undo()
+        blocks.BlockchainParser = original_parser
+        for parser in parsers:
+            parser.stop()
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,135 @@
+"""Move log file writes off the parsing and API threads: records are put on a
+queue and written, in batches, by a single writer thread."""
+
+import copy
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+import threading
+
+from counterpartylib.lib import api
+from counterpartycli.util import patch
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000 # records written between two flushes, at most
+API_LOGGERS = ('werkzeug',)
+
+class JSONFormatter(logging.Formatter):
+    """One compact JSON object per record."""
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, separators=(',', ':'))
+
+class LogWriter(threading.Thread):
+    """Write queued `(handlers, record)` pairs, flushing after each batch."""
+
+    def __init__(self):
+        threading.Thread.__init__(self, name='LogWriter')
+        self.daemon = True
+        self.queue = queue.Queue() # unbounded; SimpleQueue needs Python 3.7
+        self.handlers = set()
+
+    def forward(self, handlers):
+        """Return a handler queueing records for `handlers`."""
+        for handler in handlers:
+            # Flushed by the writer after each batch instead of after each record.
+            handler.flush = lambda: None
+            self.handlers.add(handler)
+        return QueueingHandler(self.queue, tuple(handlers))
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is None:
+                    stopping = True
+                    continue
+                handlers, record = item
+                for handler in handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            for handler in self.handlers:
+                type(handler).flush(handler)
+
+    def stop(self, timeout=5):
+        self.queue.put(None)
+        self.join(timeout)
+
+class QueueingHandler(logging.handlers.QueueHandler):
+
+    def __init__(self, queue, targets):
+        logging.handlers.QueueHandler.__init__(self, queue)
+        self.targets = targets
+
+    def prepare(self, record):
+        # Unlike `QueueHandler.prepare`, keep the message and the traceback apart, for `JSONFormatter`.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self.queue.put_nowait((self.targets, record))
+
+WRITER = None
+
+def file_handlers(logger):
+    return [handler for handler in logger.handlers if isinstance(handler, logging.FileHandler)]
+
+def reroute(logger, queued, json_format):
+    handlers = file_handlers(logger)
+    if not handlers:
+        return
+    if json_format:
+        for handler in handlers:
+            handler.setFormatter(JSONFormatter())
+    if queued:
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(WRITER.forward(handlers))
+
+def set_up(root_logger, queued=False, json_format=False):
+    """Queue (`queued`) and/or format as JSON lines (`json_format`) the
+       records written to the server and API log files."""
+    global WRITER
+    if not queued and not json_format:
+        return
+    if queued:
+        WRITER = LogWriter()
+        WRITER.start()
+        atexit.register(WRITER.stop)
+
+    reroute(root_logger, queued, json_format)
+
+    # The API server sets up its access log when it starts.
+    def wrap(init_api_access_log):
+        def wrapper(app, *args, **kwargs):
+            init_api_access_log(app, *args, **kwargs)
+            for name in API_LOGGERS + (app.logger.name,):
+                reroute(logging.getLogger(name), queued, json_format)
+        return wrapper
+    patch(api, 'init_api_access_log', wrap)
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,236 @@
+"""Prometheus metrics for a running server, in the text exposition format."""
+
+import re
+import json
+import time
+import logging
+import threading
+import collections
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+import jsonrpc
+
+from counterpartylib.lib import api, backend, blocks, config, database, util
+from counterpartycli.util import patch
+
+logger = logging.getLogger(__name__)
+
+BACKEND_POLL_INTERVAL = 10 # seconds
+RATE_WINDOW = 60 # seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PARSE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+REST_PATH = re.compile(r'^/rest/(\w+)/get$', re.IGNORECASE)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels) + '}'
+
+class Histogram:
+    """Cumulative buckets, sum and count, per label set."""
+
+    def __init__(self, name, help, buckets, label_names=()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label_names = label_names
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        series = self.series.setdefault(label_values, {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0})
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['buckets'][i] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        for label_values, series in sorted(self.series.items()):
+            labels = list(zip(self.label_names, label_values))
+            for bound, count in zip(self.buckets, series['buckets']):
+                lines.append('{}_bucket{} {}'.format(self.name, format_labels(labels + [('le', bound)]), count))
+            lines.append('{}_bucket{} {}'.format(self.name, format_labels(labels + [('le', '+Inf')]), series['count']))
+            lines.append('{}_sum{} {}'.format(self.name, format_labels(labels), series['sum']))
+            lines.append('{}_count{} {}'.format(self.name, format_labels(labels), series['count']))
+        return lines
+
+class Metrics:
+    """Instrument block parsing, mempool parsing, the API and database
+       connections, and poll the backend for its height."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.backend_height = None
+        self.blocks_parsed = 0
+        self.block_times = collections.deque()
+        self.sqlite_busy = 0
+        self.api_requests = collections.Counter()
+        self.api_latency = Histogram('counterparty_api_request_duration_seconds', 'API request latency, per method.', LATENCY_BUCKETS, ('method',))
+        self.block_parse = Histogram('counterparty_block_parse_duration_seconds', 'Time spent parsing a block.', PARSE_BUCKETS)
+        self.mempool_parse = Histogram('counterparty_mempool_tx_parse_duration_seconds', 'Time spent parsing a mempool transaction.', LATENCY_BUCKETS)
+
+    def install(self, db=None):
+        patch(blocks, 'parse_block', self.wrap_parse_block)
+        patch(blocks, 'parse_tx', self.wrap_parse_tx)
+        patch(jsonrpc.JSONRPCResponseManager, 'handle', self.wrap_handle)
+        patch(api, 'init_api_access_log', self.wrap_init_api_access_log)
+        patch(database, 'get_connection', self.wrap_get_connection)
+        if db is not None:
+            self.watch_connection(db)
+
+    def wrap_parse_block(self, parse_block):
+        def wrapper(db, block_index, *args, **kwargs):
+            start_time = time.time()
+            result = parse_block(db, block_index, *args, **kwargs)
+            now = time.time()
+            if block_index != config.MEMPOOL_BLOCK_INDEX:
+                with self.lock:
+                    self.block_parse.observe(now - start_time)
+                    self.blocks_parsed += 1
+                    self.block_times.append(now)
+            return result
+        return wrapper
+
+    def wrap_parse_tx(self, parse_tx):
+        def wrapper(db, tx, *args, **kwargs):
+            if tx['block_index'] != config.MEMPOOL_BLOCK_INDEX:
+                return parse_tx(db, tx, *args, **kwargs)
+            start_time = time.time()
+            try:
+                return parse_tx(db, tx, *args, **kwargs)
+            finally:
+                with self.lock:
+                    self.mempool_parse.observe(time.time() - start_time)
+        return wrapper
+
+    def wrap_handle(self, handle):
+        def wrapper(request_str, dispatcher):
+            try:
+                method = json.loads(request_str).get('method') or 'unknown'
+            except (ValueError, AttributeError):
+                method = 'invalid'
+            if method not in dispatcher:
+                method = 'unknown'
+            start_time = time.time()
+            try:
+                return handle(request_str, dispatcher)
+            finally:
+                self.observe_request(method, start_time)
+        return wrapper
+
+    def observe_request(self, method, start_time):
+        with self.lock:
+            self.api_requests[method] += 1
+            self.api_latency.observe(time.time() - start_time, method)
+
+    def wrap_init_api_access_log(self, init_api_access_log):
+        # The API server's Flask app is only reachable when it sets up its access log.
+        def wrapper(app, *args, **kwargs):
+            init_api_access_log(app, *args, **kwargs)
+            app.wsgi_app = self.wrap_rest(app.wsgi_app)
+        return wrapper
+
+    def wrap_rest(self, wsgi_app):
+        """Count REST requests, which `handle_rest` answers without
+           `JSONRPCResponseManager`, as calls of the `get_<table>` method."""
+        def wrapper(environ, start_response):
+            path = environ.get('PATH_INFO', '')
+            if not path.startswith('/rest/'):
+                return wsgi_app(environ, start_response)
+            match = REST_PATH.match(path)
+            table = match.group(1).lower() if match else None
+            method = 'get_{}'.format(table) if table in api.API_TABLES else 'unknown'
+            start_time = time.time()
+            try:
+                return wsgi_app(environ, start_response)
+            finally:
+                self.observe_request(method, start_time)
+        return wrapper
+
+    def wrap_get_connection(self, get_connection):
+        def wrapper(*args, **kwargs):
+            db = get_connection(*args, **kwargs)
+            self.watch_connection(db)
+            return db
+        return wrapper
+
+    def watch_connection(self, db):
+        # The lib's connections have no busy timeout: count each `SQLITE_BUSY`
+        # and let it fail as before.
+        def busy_handler(count):
+            with self.lock:
+                self.sqlite_busy += 1
+            return False
+        db.setbusyhandler(busy_handler)
+
+    def poll_backend(self):
+        while True:
+            try:
+                self.backend_height = backend.getblockcount()
+            except Exception as e:
+                logger.debug('Could not get block count from backend: {}'.format(e))
+            time.sleep(BACKEND_POLL_INTERVAL)
+
+    def render(self):
+        now = time.time()
+        last_block = util.CURRENT_BLOCK_INDEX
+        with self.lock:
+            while self.block_times and self.block_times[0] < now - RATE_WINDOW:
+                self.block_times.popleft()
+            gauges = [
+                ('counterparty_last_block', 'Index of the last block in the database.', last_block),
+                ('counterparty_backend_height', 'Block count of the backend.', self.backend_height),
+                ('counterparty_block_lag', 'Blocks the backend is ahead of the database.',
+                 self.backend_height - last_block if self.backend_height is not None and last_block is not None else None),
+                ('counterparty_blocks_per_second', 'Blocks parsed per second over the last minute.', len(self.block_times) / RATE_WINDOW)
+            ]
+            lines = []
+            for name, help, value in gauges:
+                if value is not None:
+                    lines += ['# HELP {} {}'.format(name, help), '# TYPE {} gauge'.format(name), '{} {}'.format(name, value)]
+            lines += ['# HELP counterparty_blocks_parsed_total Blocks parsed since startup.', '# TYPE counterparty_blocks_parsed_total counter',
+                      'counterparty_blocks_parsed_total {}'.format(self.blocks_parsed)]
+            lines += ['# HELP counterparty_sqlite_busy_total Statements that found the database busy or locked.', '# TYPE counterparty_sqlite_busy_total counter',
+                      'counterparty_sqlite_busy_total {}'.format(self.sqlite_busy)]
+            lines += ['# HELP counterparty_api_requests_total API requests, per method.', '# TYPE counterparty_api_requests_total counter']
+            for method, count in sorted(self.api_requests.items()):
+                lines.append('counterparty_api_requests_total{} {}'.format(format_labels([('method', method)]), count))
+            lines += self.api_latency.render() + self.block_parse.render() + self.mempool_parse.render()
+        return '\n'.join(lines) + '\n'
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, metrics, host, port):
+        HTTPServer.__init__(self, (host, port), MetricsRequestHandler)
+        self.metrics = metrics
+
+def start(host, port, db=None):
+    """Instrument the server and serve its metrics at `http://host:port/metrics`."""
+    metrics = Metrics()
+    metrics.install(db)
+    threading.Thread(target=metrics.poll_backend, name='MetricsBackendPoller', daemon=True).start()
+    metrics_server = MetricsServer(metrics, host, port)
+    threading.Thread(target=metrics_server.serve_forever, name='MetricsServer', daemon=True).start()
+    logger.info('Serving metrics at http://{}:{}/metrics.'.format(host, port))
+    return metrics
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,216 @@
+"""A local SQLite copy of some of the server's tables, kept up to date block
+range by block range, to run heavy `get_<table>` queries against."""
+
+import os
+import time
+import logging
+import sqlite3
+import threading
+
+from counterpartycli import util, wallet
+from counterpartycli.util import GETROWS_PARAMS, getrows_query, patch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TABLES = ['sends', 'credits', 'debits', 'issuances', 'orders']
+# Rows that may still change after their block, by table: key column and the
+# statuses that aren't final.
+MUTABLE_TABLES = {'orders': ('tx_hash', ['open'])}
+MAX_BLOCKS_PER_SYNC = 1000
+IN_CHUNK_SIZE = 500
+KEPT_SYNC_POINTS = 100
+DEFAULT_MAX_LAG = 3 # blocks
+
+class MirrorError(Exception):
+    pass
+
+def connect(path):
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    db.execute('''CREATE TABLE IF NOT EXISTS mirror_blocks (block_index INTEGER PRIMARY KEY, block_hash TEXT)''')
+    db.execute('''CREATE TABLE IF NOT EXISTS mirror_refreshes (table_name TEXT, key TEXT, block_index INTEGER,
+                  PRIMARY KEY (table_name, key))''')
+    return db
+
+def mirrored_tables(db):
+    return [row[0] for row in db.execute('''SELECT name FROM sqlite_master
+                                             WHERE type = 'table' AND name NOT IN ('mirror_blocks', 'mirror_refreshes') AND name NOT LIKE 'sqlite%' ''')]
+
+def last_synced_block(db):
+    return db.execute('''SELECT MAX(block_index) FROM mirror_blocks''').fetchone()[0]
+
+def columns(db, table):
+    return [row[1] for row in db.execute('PRAGMA table_info({})'.format(table))]
+
+def store(db, table, rows):
+    """Insert `rows`, or replace them by key in mutable tables, adding the
+       columns the table doesn't have yet."""
+    if not rows:
+        return
+    known = columns(db, table)
+    if not known:
+        key = MUTABLE_TABLES.get(table, (None,))[0]
+        definitions = ['{} PRIMARY KEY'.format(column) if column == key else column for column in rows[0]]
+        db.execute('CREATE TABLE {} ({})'.format(table, ', '.join(definitions)))
+        db.execute('CREATE INDEX {0}_block_index_idx ON {0} (block_index)'.format(table))
+        known = list(rows[0])
+    for column in rows[0]:
+        if column not in known:
+            db.execute('ALTER TABLE {} ADD COLUMN {}'.format(table, column))
+            known.append(column)
+    for row in rows:
+        names = list(row)
+        db.execute('INSERT OR REPLACE INTO {} ({}) VALUES ({})'.format(table, ', '.join(names), ', '.join(['?'] * len(names))),
+                   [row[name] for name in names])
+
+def store_mutable(db, table, rows, block_index):
+    """Store rows of a mutable table, fetched when the server was at
+       `block_index`, remembering when, to fetch them again after a reorg."""
+    key, _ = MUTABLE_TABLES[table]
+    store(db, table, rows)
+    db.executemany('''INSERT OR REPLACE INTO mirror_refreshes VALUES (?, ?, ?)''', [(table, row[key], block_index) for row in rows])
+
+def refresh(db, table, keys, block_index):
+    """Fetch again the rows of `table` with these `keys`."""
+    key, _ = MUTABLE_TABLES[table]
+    keys = list(keys)
+    for i in range(0, len(keys), IN_CHUNK_SIZE):
+        chunk = keys[i:i + IN_CHUNK_SIZE]
+        store_mutable(db, table, list(util.api_pages('get_{}'.format(table), {'filters': [(key, 'IN', chunk)]})), block_index)
+
+def find_fork(db):
+    """Return the last sync point still on the server's chain, or `None`."""
+    for row in db.execute('''SELECT block_index, block_hash FROM mirror_blocks ORDER BY block_index DESC''').fetchall():
+        try:
+            if util.api('get_block_info', {'block_index': row['block_index']})['block_hash'] == row['block_hash']:
+                return row['block_index']
+        except util.RPCError:
+            pass
+    return None
+
+def trim(db, block_index):
+    """Drop everything synced above `block_index`."""
+    logger.warning('Server chain reorganised: trimming mirror above block {}.'.format(block_index))
+    for table in mirrored_tables(db):
+        db.execute('DELETE FROM {} WHERE block_index > ?'.format(table), (block_index,))
+    db.execute('''DELETE FROM mirror_blocks WHERE block_index > ?''', (block_index,))
+    for table in MUTABLE_TABLES:
+        stale = [row[0] for row in db.execute('''SELECT key FROM mirror_refreshes WHERE table_name = ? AND block_index > ?''', (table, block_index))]
+        db.execute('''DELETE FROM mirror_refreshes WHERE table_name = ? AND block_index > ?''', (table, block_index))
+        if stale and table in mirrored_tables(db):
+            refresh(db, table, stale, block_index)
+
+def sync(path, tables=None, start_block=0):
+    """Bring the mirror at `path` up to the server's last block, in ranges of
+       at most `MAX_BLOCKS_PER_SYNC` blocks, and return its last block."""
+    tables = tables or DEFAULT_TABLES
+    db = connect(path)
+    try:
+        last_synced = last_synced_block(db)
+        if last_synced is not None:
+            fork = find_fork(db)
+            if fork is None:
+                raise MirrorError('Mirror does not share any block with the server: delete `{}` and sync again.'.format(path))
+            if fork != last_synced:
+                with db:
+                    trim(db, fork)
+                last_synced = fork
+        else:
+            last_synced = start_block - 1
+
+        last_block = util.api('get_running_info')['last_block']
+        if last_block is None:
+            raise MirrorError('Server has no blocks yet.')
+        start_time = time.time()
+
+        # The server returns rows as they are now, so the rows of mutable
+        # tables synced before need fetching again only once.
+        with db:
+            for table, (key, statuses) in MUTABLE_TABLES.items():
+                if table in tables and columns(db, table):
+                    changing = [row[0] for row in db.execute('SELECT {} FROM {} WHERE status IN ({})'.format(key, table, ','.join(['?'] * len(statuses))), statuses)]
+                    refresh(db, table, changing, last_block['block_index'])
+
+        while last_synced < last_block['block_index']:
+            end_block = min(last_synced + MAX_BLOCKS_PER_SYNC, last_block['block_index'])
+            # One transaction per range, so that an interrupted sync resumes at the last range synced.
+            with db:
+                for table in tables:
+                    # By `rowid`: offsets into rows of equal `block_index` may skip or repeat rows.
+                    rows = list(util.api_pages('get_{}'.format(table), {'start_block': last_synced + 1, 'end_block': end_block, 'order_by': 'rowid'}))
+                    if table in MUTABLE_TABLES:
+                        store_mutable(db, table, rows, last_block['block_index'])
+                    else:
+                        store(db, table, rows)
+                block_hash = last_block['block_hash'] if end_block == last_block['block_index'] else \
+                             util.api('get_block_info', {'block_index': end_block})['block_hash']
+                db.execute('''INSERT OR REPLACE INTO mirror_blocks VALUES (?, ?)''', (end_block, block_hash))
+                db.execute('''DELETE FROM mirror_blocks WHERE block_index NOT IN
+                              (SELECT block_index FROM mirror_blocks ORDER BY block_index DESC LIMIT ?)''', (KEPT_SYNC_POINTS,))
+                db.execute('''DELETE FROM mirror_refreshes WHERE block_index < (SELECT MIN(block_index) FROM mirror_blocks)''')
+            logger.info('Mirror synced to block {}.'.format(end_block))
+            last_synced = end_block
+        logger.debug('Synced in {:.1f}s.'.format(time.time() - start_time))
+        return last_synced
+    finally:
+        db.close()
+
+def open_mirror(path):
+    """Open the mirror at `path` read-only, for all the threads of the client."""
+    if not os.path.exists(path):
+        raise MirrorError('No mirror at `{}`: create it with `sync`.'.format(path))
+    db = util.connect_read_only(path, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    return db
+
+def get_rows(db, table, params):
+    """Answer a `get_<table>` call from the mirror `db`, or return `None` if
+       the table isn't mirrored."""
+    if table not in mirrored_tables(db):
+        return None
+    params = {key: value for key, value in (params or {}).items() if key in GETROWS_PARAMS}
+    statement, bindings = getrows_query(table, **params)
+    return [dict(row) for row in db.execute(statement, bindings)]
+
+def is_current(db, api, max_lag=DEFAULT_MAX_LAG):
+    """Whether the mirror `db` is synced to the last block of the server
+       `api` calls, or at most `max_lag` blocks before it."""
+    last_synced = last_synced_block(db)
+    try:
+        last_block = api('get_running_info')['last_block']
+    except util.RPCError as e:
+        logger.warning('Could not check that the mirror is up to date ({}): answering from it.'.format(e))
+        return True
+    if last_block is None or last_block['block_index'] == last_synced:
+        return True
+    if last_synced is not None and 0 < last_block['block_index'] - last_synced <= max_lag:
+        logger.info('Mirror is {} blocks behind the server: answering from it.'.format(last_block['block_index'] - last_synced))
+        return True
+    logger.warning('Mirror is at block {}, the server at block {}: answering from the server (run `sync`).'.format(
+        last_synced, last_block['block_index']))
+    return False
+
+def use(path, max_lag=DEFAULT_MAX_LAG):
+    """Answer the `get_<table>` calls of the client (`getrows`, wallet views)
+       from the mirror at `path` for the tables it has, as long as it is
+       synced to the server's last block or at most `max_lag` blocks before
+       it (checked once, at the first call)."""
+    db = open_mirror(path)
+    lock = threading.Lock()
+    current = []
+
+    def wrap(api):
+        def wrapper(method, params=None):
+            if method.startswith('get_'):
+                with lock:
+                    if not current:
+                        current.append(is_current(db, api, max_lag=max_lag))
+                    rows = get_rows(db, method[4:], params) if current[0] else None
+                if rows is not None:
+                    return rows
+            return api(method, params)
+        return wrapper
+    patch(util, 'api', wrap)
+    patch(wallet, 'api', wrap)
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,175 @@
+"""Price-level order books for asset pairs, loaded once and then kept up to
+date from the orders, matches, cancels and expirations of new blocks."""
+
+import time
+import bisect
+import logging
+from fractions import Fraction
+from decimal import Decimal as D
+
+from counterpartylib.lib import config
+from counterpartycli import util
+
+logger = logging.getLogger(__name__)
+
+IN_CHUNK_SIZE = 500
+DEFAULT_DEPTH = 10
+WATCH_INTERVAL = 10 # seconds
+
+class Side:
+    """Open orders on one side of a book, aggregated by price, with the
+       prices kept sorted."""
+
+    def __init__(self, descending=False):
+        self.descending = descending
+        self.prices = []
+        self.levels = {} # price: {tx_hash: quantity}
+        self.orders = {} # tx_hash: price
+
+    def key(self, price):
+        return -price if self.descending else price
+
+    def add(self, tx_hash, price, quantity):
+        self.remove(tx_hash)
+        if price not in self.levels:
+            bisect.insort(self.prices, self.key(price))
+            self.levels[price] = {}
+        self.levels[price][tx_hash] = quantity
+        self.orders[tx_hash] = price
+
+    def remove(self, tx_hash):
+        price = self.orders.pop(tx_hash, None)
+        if price is None:
+            return
+        level = self.levels[price]
+        del level[tx_hash]
+        if not level:
+            del self.levels[price]
+            del self.prices[bisect.bisect_left(self.prices, self.key(price))]
+
+    def depth(self, levels=None):
+        """Return the best `levels` price levels as `(price, quantity, order count)`."""
+        prices = self.prices[:levels] if levels else self.prices
+        result = []
+        for key in prices:
+            level = self.levels[self.key(key)]
+            result.append((self.key(key), sum(level.values()), len(level)))
+        return result
+
+class OrderBook:
+    """The open orders selling `base` for `quote` (asks) and `quote` for
+       `base` (bids). Prices are in `quote` per `base`, quantities in `base`,
+       both as integers of the assets' smallest units."""
+
+    def __init__(self, base, quote):
+        self.base = base
+        self.quote = quote
+        self.asks = Side()
+        self.bids = Side(descending=True)
+        self.block_index = None
+        self.divisible = None
+
+    def apply(self, order):
+        """Add, update or remove `order` from the book."""
+        if order['give_asset'] == self.base and order['get_asset'] == self.quote:
+            side, quantity = self.asks, order['give_remaining']
+            price = Fraction(order['get_quantity'], order['give_quantity'])
+        elif order['give_asset'] == self.quote and order['get_asset'] == self.base:
+            side, quantity = self.bids, order['get_remaining']
+            price = Fraction(order['give_quantity'], order['get_quantity'])
+        else:
+            return
+        if order['status'] == 'open' and quantity > 0:
+            side.add(order['tx_hash'], price, quantity)
+        else:
+            side.remove(order['tx_hash'])
+
+    def pair_filters(self):
+        return [('give_asset', 'IN', [self.base, self.quote]), ('get_asset', 'IN', [self.base, self.quote])]
+
+    def load(self):
+        block_index = util.api('get_running_info')['last_block']['block_index']
+        for order in util.api_pages('get_orders', {'filters': self.pair_filters(), 'status': 'open', 'end_block': block_index, 'order_by': 'tx_index'}):
+            self.apply(order)
+        self.block_index = block_index
+        logger.debug('Loaded {}/{} book at block {}: {} asks, {} bids.'.format(self.base, self.quote, block_index, len(self.asks.orders), len(self.bids.orders)))
+
+    def update(self):
+        """Apply the blocks parsed since the last load or update, and return
+           whether there were any."""
+        if self.block_index is None:
+            self.load()
+            return True
+        block_index = util.api('get_running_info')['last_block']['block_index']
+        if block_index <= self.block_index:
+            return False
+
+        # Filter on `block_index` rather than `start_block`/`end_block`: for
+        # order matches these select on the blocks of the matched orders.
+        in_range = [('block_index', '>', self.block_index), ('block_index', '<=', block_index)]
+        new_orders = list(util.api_pages('get_orders', {'filters': in_range + self.pair_filters(), 'order_by': 'tx_index'}))
+        changed = set()
+        for order_match in util.api_pages('get_order_matches', {'filters': in_range + [
+                ('forward_asset', 'IN', [self.base, self.quote]), ('backward_asset', 'IN', [self.base, self.quote])]}):
+            changed.update([order_match['tx0_hash'], order_match['tx1_hash']])
+        for cancel in util.api_pages('get_cancels', {'filters': in_range}):
+            changed.add(cancel['offer_hash'])
+        for expiration in util.api_pages('get_order_expirations', {'filters': in_range}):
+            changed.add(expiration['order_hash'])
+        changed = {tx_hash for tx_hash in changed if tx_hash in self.asks.orders or tx_hash in self.bids.orders}
+        # An expired BTC order match gives its orders, maybe filled since, their quantities back.
+        for expiration in util.api_pages('get_order_match_expirations', {'filters': in_range}):
+            changed.update(expiration['order_match_id'].split('_'))
+
+        for order in new_orders:
+            changed.discard(order['tx_hash'])
+            self.apply(order)
+        changed = list(changed)
+        for i in range(0, len(changed), IN_CHUNK_SIZE):
+            chunk = changed[i:i + IN_CHUNK_SIZE]
+            for order in util.api('get_orders', {'filters': [('tx_hash', 'IN', chunk)] + self.pair_filters()}):
+                self.apply(order)
+        self.block_index = block_index
+        return True
+
+    def view(self, depth=DEFAULT_DEPTH):
+        """Return the best `depth` levels of each side, in assets rather than
+           smallest units."""
+        if self.divisible is None:
+            self.divisible = {asset: util.is_divisible(asset) for asset in (self.base, self.quote)}
+        # Turn prices in smallest units into prices in assets.
+        factor = Fraction(config.UNIT if self.divisible[self.base] else 1, config.UNIT if self.divisible[self.quote] else 1)
+        def levels(side):
+            return [{
+                'price': round(D(price.numerator * factor.numerator) / D(price.denominator * factor.denominator), 8),
+                'quantity': D(util.value_out(quantity, self.base, divisible=self.divisible[self.base])),
+                'orders': count
+            } for price, quantity, count in side.depth(depth)]
+        return {
+            'base': self.base,
+            'quote': self.quote,
+            'block_index': self.block_index,
+            'asks': levels(self.asks),
+            'bids': levels(self.bids)
+        }
+
+BOOKS = {}
+
+def get_orderbook(base, quote, depth=DEFAULT_DEPTH):
+    """Return the best `depth` levels of the `base`/`quote` book. Books are
+       kept between calls and only updated with the new blocks."""
+    if (base, quote) not in BOOKS:
+        BOOKS[(base, quote)] = OrderBook(base, quote)
+    book = BOOKS[(base, quote)]
+    book.update()
+    return book.view(depth)
+
+def watch(base, quote, depth=DEFAULT_DEPTH, interval=WATCH_INTERVAL):
+    """Yield the `base`/`quote` book now and after every new block."""
+    book = OrderBook(base, quote)
+    while True:
+        if book.update():
+            yield book.view(depth)
+        time.sleep(interval)
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
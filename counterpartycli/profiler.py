@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import logging
+import cProfile
+import pstats
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_INTERVAL = 0.005 # seconds
+DEFAULT_TOP_FUNCTIONS = 20
+
+class StackSampler(threading.Thread):
+    """Periodically sample the stacks of every running thread, counting
+       collapsed stacks (`thread;module:function;...`) for flame graphs."""
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        threading.Thread.__init__(self, name='StackSampler')
+        self.daemon = True
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == self.ident:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                module = os.path.splitext(os.path.basename(code.co_filename))[0]
+                frames.append('{}:{}'.format(module, code.co_name))
+                frame = frame.f_back
+            frames.append(thread_names.get(thread_id, str(thread_id)))
+            self.stacks[';'.join(reversed(frames))] += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as collapsed_file:
+            for stack, count in sorted(self.stacks.items()):
+                collapsed_file.write('{} {}\n'.format(stack, count))
+
+def add_arguments(parser, app_name):
+    """Add `--profile` and `--profile-file` to the top-level `parser`, to be
+       given before the action."""
+    parser.add_argument('--profile', action='store_true', default=False, help='profile the action and write pstats and collapsed stacks to the profile file')
+    parser.add_argument('--profile-file', default='{}.prof'.format(app_name), metavar='PATH', help='the path of the profile file (default: `{}.prof`)'.format(app_name))
+
+def profile_call(func, profile_path, top=DEFAULT_TOP_FUNCTIONS):
+    """Run `func` under cProfile and a stack sampler, then write pstats to
+       `profile_path`, collapsed stacks to `profile_path.collapsed` and print
+       the most expensive functions to stderr."""
+    profile = cProfile.Profile()
+    sampler = StackSampler()
+    sampler.start()
+    start_time = time.time()
+    profile.enable()
+    try:
+        return func()
+    finally:
+        profile.disable()
+        elapsed = time.time() - start_time
+        sampler.stop()
+
+        profile.dump_stats(profile_path)
+        collapsed_path = '{}.collapsed'.format(profile_path)
+        sampler.write_collapsed(collapsed_path)
+
+        sys.stderr.write('\nProfiled in {:.3f}s. Stats written to `{}`, collapsed stacks written to `{}`.\n'.format(elapsed, profile_path, collapsed_path))
+        stats = pstats.Stats(profile, stream=sys.stderr)
+        stats.sort_stats('cumulative').print_stats(top)
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
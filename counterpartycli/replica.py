@@ -0,0 +1,58 @@
+import time
+import logging
+import threading
+import apsw
+
+from counterpartylib import server
+from counterpartylib.lib import api, blocks, config, database, util
+
+logger = logging.getLogger(__name__)
+
+class BlockIndexFollower(threading.Thread):
+    """Keep `util.CURRENT_BLOCK_INDEX` in step with a database that another
+       process writes to."""
+
+    def __init__(self, interval):
+        threading.Thread.__init__(self, name='BlockIndexFollower')
+        self.daemon = True
+        self.interval = interval
+
+    def run(self):
+        db = database.get_connection(read_only=True, integrity_check=False)
+        while True:
+            try:
+                block_index = blocks.last_db_index(db)
+                if block_index != util.CURRENT_BLOCK_INDEX:
+                    logger.debug('Database at block {}.'.format(block_index))
+                    util.CURRENT_BLOCK_INDEX = block_index
+            except apsw.Error as e:
+                logger.warning('Could not read last block from database: {}'.format(e))
+            time.sleep(self.interval)
+
+def start_api():
+    """Serve the API from a read-only connection to the database, without
+       taking the server lock or parsing blocks. Run any number of these
+       beside the process following the blockchain (the database is in WAL
+       mode, so readers don't block it), each on its own `--rpc-port`."""
+    db = database.get_connection(read_only=True, integrity_check=False)
+    util.CURRENT_BLOCK_INDEX = blocks.last_db_index(db)
+    db.close()
+    logger.info('Serving API read-only from `{}` at block {}.'.format(config.DATABASE, util.CURRENT_BLOCK_INDEX))
+
+    server.connect_to_backend()
+
+    BlockIndexFollower(config.BACKEND_POLL_INTERVAL).start()
+
+    api_status_poller = api.APIStatusPoller()
+    api_status_poller.daemon = True
+    api_status_poller.start()
+
+    api_server = api.APIServer()
+    api_server.daemon = True
+    api_server.start()
+
+    # Join with a timeout, so that the main thread still gets `KeyboardInterrupt`.
+    while api_server.is_alive():
+        api_server.join(1)
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -11,9 +11,9 @@ log.set_logger(logger)
 
 from counterpartylib import server
 from counterpartylib.lib import config
-from counterpartycli.util import add_config_arguments, bootstrap
+from counterpartycli.util import add_config_arguments, get_config_file_path, bootstrap
 from counterpartycli.setup import generate_config_files
-from counterpartycli import APP_VERSION
+from counterpartycli import APP_VERSION, profiler, snapshot, checkpoint, telemetry, kickstart, tune, conservation, analyze, replica, logqueue, metrics
 
 APP_NAME = 'counterparty-server'
 
@@ -47,7 +47,14 @@ CONFIG_ARGS = [
     [('--api-log-file',), {'nargs': '?', 'const': None, 'default': False, 'help': 'log API requests to the specified file (specify option without filename to use the default location)'}],
 
     [('--utxo-locks-max-addresses',), {'type': int, 'default': config.DEFAULT_UTXO_LOCKS_MAX_ADDRESSES, 'help': 'max number of addresses for which to track UTXO locks'}],
-    [('--utxo-locks-max-age',), {'type': int, 'default': config.DEFAULT_UTXO_LOCKS_MAX_AGE, 'help': 'how long to keep a lock on a UTXO being tracked'}]
+    [('--utxo-locks-max-age',), {'type': int, 'default': config.DEFAULT_UTXO_LOCKS_MAX_AGE, 'help': 'how long to keep a lock on a UTXO being tracked'}],
+
+    [('--checkpoint-interval',), {'type': int, 'default': 0, 'help': 'checkpoint the database every this many blocks while running, to speed up rollbacks (default: 0, disabled)'}],
+    [('--checkpoint-retention',), {'type': int, 'default': 3, 'help': 'number of database checkpoints to keep (default: 3)'}],
+    [('--metrics-host',), {'default': 'localhost', 'help': 'the IP of the interface to serve Prometheus metrics on'}],
+    [('--metrics-port',), {'type': int, 'default': None, 'help': 'serve Prometheus metrics on this port at /metrics (default: disabled)'}],
+    [('--log-queue',), {'action': 'store_true', 'default': False, 'help': 'write log files from a dedicated thread, in batches, instead of from the parsing and API threads'}],
+    [('--log-format',), {'choices': ['text', 'json'], 'default': 'text', 'help': 'format of the log files: text or JSON lines (default: text)'}]
 ]
 
 class VersionError(Exception):
@@ -66,25 +73,54 @@ def main():
     parser.add_argument('-h', '--help', dest='help', action='store_true', help='show this help message and exit')
     parser.add_argument('-V', '--version', action='version', version="{} v{}; {} v{}".format(APP_NAME, APP_VERSION, 'counterparty-lib', config.VERSION_STRING))
     parser.add_argument('--config-file', help='the path to the configuration file')
+    profiler.add_arguments(parser, APP_NAME)
 
     add_config_arguments(parser, CONFIG_ARGS, 'server.conf')
 
     subparsers = parser.add_subparsers(dest='action', help='the action to be taken')
 
+    parser_telemetry = argparse.ArgumentParser(add_help=False)
+    parser_telemetry.add_argument('--telemetry', action='store_true', default=False, help='periodically report parsing throughput, time per message type and ETA on stderr')
+    parser_telemetry.add_argument('--telemetry-file', help='also append telemetry reports, as JSON lines, to the specified file (implies --telemetry)')
+    parser_telemetry.add_argument('--telemetry-interval', type=float, default=telemetry.DEFAULT_INTERVAL, help='seconds between telemetry reports (default: {})'.format(telemetry.DEFAULT_INTERVAL))
+
     parser_server = subparsers.add_parser('start', help='run the server')
+    parser_server.add_argument('--api-only', action='store_true', default=False, help='serve the API from a read-only connection to the database, without following the blockchain (run beside a full server)')
 
-    parser_reparse = subparsers.add_parser('reparse', help='reparse all transactions in the database')
+    parser_reparse = subparsers.add_parser('reparse', help='reparse all transactions in the database', parents=[parser_telemetry])
 
     parser_vacuum = subparsers.add_parser('vacuum', help='VACUUM the database (to improve performance)')
 
-    parser_rollback = subparsers.add_parser('rollback', help='rollback database')
+    parser_analyze = subparsers.add_parser('analyze', help='ANALYZE the database and suggest indexes for the API queries sampled from a log')
+    parser_analyze.add_argument('--requests', help='file of API requests to replay: the API access log, JSON-RPC requests (one per line) or a `--rpc-record` cassette')
+    parser_analyze.add_argument('--sample-size', type=int, default=analyze.DEFAULT_SAMPLE_SIZE, help='number of requests sampled from the file (default: {})'.format(analyze.DEFAULT_SAMPLE_SIZE))
+    parser_analyze.add_argument('--create-indexes', action='store_true', default=False, help='create the suggested indexes and time the queries again')
+
+    parser_snapshot = subparsers.add_parser('snapshot', help='write a bootstrap archive of the database (safe to run while the server is running)')
+    parser_snapshot.add_argument('--output', help='the path of the archive (default: `counterparty-db.latest.tar.gz` or `counterparty-db-testnet.latest.tar.gz`)')
+    parser_snapshot.add_argument('--threads', type=int, default=None, help='number of compression threads (default: number of CPUs)')
+    parser_snapshot.add_argument('--compression-level', type=int, choices=range(1, 10), default=snapshot.SNAPSHOT_COMPRESSION_LEVEL, help='gzip compression level (default: {})'.format(snapshot.SNAPSHOT_COMPRESSION_LEVEL))
+
+    parser_check = subparsers.add_parser('check', help='check the conservation of all assets, read-only (safe to run while the server is running)')
+    parser_check.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+
+    parser_tune = subparsers.add_parser('tune', help='benchmark the backend and recommend values for --rpc-batch-size and --backend-poll-interval')
+    parser_tune.add_argument('--write', action='store_true', default=False, help='write the recommended values to the configuration file')
+    parser_tune.add_argument('--max-latency', type=float, default=tune.DEFAULT_MAX_LATENCY, help='maximum acceptable 95th percentile latency of a batch, in seconds (default: {})'.format(tune.DEFAULT_MAX_LATENCY))
+    parser_tune.add_argument('--sample-size', type=int, default=tune.SAMPLE_SIZE, help='number of transactions fetched per measurement (default: {})'.format(tune.SAMPLE_SIZE))
+
+    parser_rollback = subparsers.add_parser('rollback', help='rollback database', parents=[parser_telemetry])
     parser_rollback.add_argument('block_index', type=int, help='the index of the last known good block')
+    parser_rollback.add_argument('--no-checkpoint', action='store_true', default=False, help='reparse the whole database instead of restoring the nearest checkpoint')
 
-    parser_kickstart = subparsers.add_parser('kickstart', help='rapidly build database by reading from Bitcoin Core blockchain')
+    parser_kickstart = subparsers.add_parser('kickstart', help='rapidly build database by reading from Bitcoin Core blockchain', parents=[parser_telemetry])
     parser_kickstart.add_argument('--bitcoind-dir', help='Bitcoin Core data directory')
+    parser_kickstart.add_argument('--workers', type=int, default=1, help='number of processes reading and decoding blocks ahead of the database writer (default: 1, no workers)')
 
     parser_bootstrap = subparsers.add_parser('bootstrap', help='bootstrap database with hosted snapshot')
     parser_bootstrap.add_argument('-q', '--quiet', dest='quiet', action='store_true', help='suppress progress bar')
+    parser_bootstrap.add_argument('--bootstrap-url', help='the URL (or local path) of the snapshot to download (default: the hosted snapshot)')
+    parser_bootstrap.add_argument('--workers', type=int, default=1, help='number of concurrent byte-range downloads; more than one downloads to a temporary file before extraction (default: 1)')
 
     args = parser.parse_args()
 
@@ -99,7 +135,7 @@ def main():
 
     # Bootstrapping
     if args.action == 'bootstrap':
-        bootstrap(testnet=args.testnet, quiet=args.quiet)
+        bootstrap(testnet=args.testnet, quiet=args.quiet, url=args.bootstrap_url, workers=args.workers)
         sys.exit()
 
     def init_with_catch(fn, init_args):
@@ -112,8 +148,8 @@ def main():
                 raise e
 
     # Configuration
-    COMMANDS_WITH_DB = ['reparse', 'rollback', 'kickstart', 'start', 'vacuum']
-    COMMANDS_WITH_CONFIG = ['debug_config']
+    COMMANDS_WITH_DB = ['reparse', 'rollback', 'kickstart', 'start', 'vacuum', 'analyze']
+    COMMANDS_WITH_CONFIG = ['debug_config', 'snapshot', 'check', 'tune']
     if args.action in COMMANDS_WITH_DB or args.action in COMMANDS_WITH_CONFIG:
         init_args = dict(database_file=args.database_file,
                                 log_file=args.log_file, api_log_file=args.api_log_file,
@@ -137,32 +173,79 @@ def main():
                                 utxo_locks_max_age=args.utxo_locks_max_age)
                                 #,broadcast_tx_mainnet=args.broadcast_tx_mainnet)
 
-    if args.action in COMMANDS_WITH_DB:
+    if args.action == 'start' and args.api_only:
+        init_with_catch(server.initialise_config, init_args)
+
+    elif args.action in COMMANDS_WITH_DB:
         db = init_with_catch(server.initialise, init_args)
 
     elif args.action in COMMANDS_WITH_CONFIG:
         init_with_catch(server.initialise_config, init_args)
 
-    # PARSING
-    if args.action == 'reparse':
-        server.reparse(db)
-
-    elif args.action == 'rollback':
-        server.reparse(db, block_index=args.block_index)
-
-    elif args.action == 'kickstart':
-        server.kickstart(db, bitcoind_dir=args.bitcoind_dir)
-
-    elif args.action == 'start':
-        server.start_all(db)
-
-    elif args.action == 'debug_config':
-        server.debug_config()
-
-    elif args.action == 'vacuum':
-        server.vacuum(db)
-
+    logqueue.set_up(log.ROOT_LOGGER, queued=args.log_queue, json_format=args.log_format == 'json')
+
+    def execute():
+        def track(target_block=None):
+            return telemetry.Telemetry(db, enabled=args.telemetry or bool(args.telemetry_file), target_block=target_block,
+                                       interval=args.telemetry_interval, output_path=args.telemetry_file)
+
+        # PARSING
+        if args.action == 'reparse':
+            with track():
+                server.reparse(db)
+
+        elif args.action == 'rollback':
+            with track(args.block_index):
+                if args.no_checkpoint or not checkpoint.rollback(db, config.DATABASE, args.block_index):
+                    server.reparse(db, block_index=args.block_index)
+
+        elif args.action == 'kickstart':
+            # bitcoind is stopped: the target is the tip of the chain kickstart reads.
+            tracked = (args.telemetry or args.telemetry_file) and args.bitcoind_dir
+            with track(kickstart.chain_height(args.bitcoind_dir) if tracked else None):
+                kickstart.kickstart(db, bitcoind_dir=args.bitcoind_dir, workers=args.workers)
+
+        elif args.action == 'start' and args.api_only:
+            if args.metrics_port:
+                metrics.start(args.metrics_host, args.metrics_port)
+            replica.start_api()
+
+        elif args.action == 'start':
+            if args.metrics_port:
+                metrics.start(args.metrics_host, args.metrics_port, db=db)
+            if args.checkpoint_interval:
+                checkpoint.Checkpointer(config.DATABASE, args.checkpoint_interval, args.checkpoint_retention).start()
+            server.start_all(db)
+
+        elif args.action == 'debug_config':
+            server.debug_config()
+
+        elif args.action == 'vacuum':
+            server.vacuum(db)
+
+        elif args.action == 'analyze':
+            analyze.analyze(db, request_file=args.requests, sample_size=args.sample_size, create_indexes=args.create_indexes)
+
+        elif args.action == 'snapshot':
+            output = args.output or ('counterparty-db-testnet.latest.tar.gz' if args.testnet else 'counterparty-db.latest.tar.gz')
+            snapshot.snapshot(config.DATABASE, output, threads=args.threads, compresslevel=args.compression_level)
+
+        elif args.action == 'check':
+            if conservation.check(config.DATABASE, workers=args.workers):
+                sys.exit(1)
+
+        elif args.action == 'tune':
+            tune.tune(config.BACKEND_URL, ssl_verify=not config.BACKEND_SSL_NO_VERIFY,
+                      sample_size=args.sample_size, max_latency=args.max_latency,
+                      server_concurrency=config.BACKEND_RPC_BATCH_NUM_WORKERS,
+                      config_file=get_config_file_path(args.config_file, 'server.conf') if args.write else None)
+
+        else:
+            parser.print_help()
+
+    if args.profile:
+        profiler.profile_call(execute, args.profile_file)
     else:
-        parser.print_help()
+        execute()
 
 # vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,132 @@
+import os
+import io
+import gzip
+import time
+import hashlib
+import logging
+import sqlite3
+import tarfile
+import collections
+import concurrent.futures
+
+from counterpartycli.util import connect_read_only
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_BLOCK_SIZE = 16 * 1024 * 1024
+SNAPSHOT_COMPRESSION_LEVEL = 6
+SNAPSHOT_CHUNK_SIZE = 1024 * 1024
+
+class ParallelGzipWriter(io.RawIOBase):
+    """Compress blocks of data on several threads, writing them in order as
+       concatenated gzip members (a valid gzip file, readable by `gzip -d`
+       and `util.GzipStream`)."""
+
+    def __init__(self, fileobj, threads=None, block_size=SNAPSHOT_BLOCK_SIZE, compresslevel=SNAPSHOT_COMPRESSION_LEVEL):
+        self.fileobj = fileobj
+        self.threads = threads or os.cpu_count() or 1
+        self.block_size = block_size
+        self.compresslevel = compresslevel
+        self.buffer = bytearray()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = collections.deque()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def submit(self, block):
+        self.pending.append(self.executor.submit(gzip.compress, block, self.compresslevel))
+        # Bound memory usage: never keep more than two blocks per thread in flight.
+        while len(self.pending) > self.threads * 2:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        if self.buffer:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending:
+            self.fileobj.write(self.pending.popleft().result())
+        self.executor.shutdown()
+        super(ParallelGzipWriter, self).close()
+
+def copy_database(source, destination):
+    """Copy `source` into `destination` statement by statement, within one
+       read transaction, for Python versions without `Connection.backup`."""
+    source.execute('BEGIN')
+    try:
+        destination.isolation_level = None
+        destination.execute('PRAGMA journal_mode = OFF')
+        destination.execute('PRAGMA synchronous = OFF')
+        # `iterdump` includes its own `BEGIN TRANSACTION` and `COMMIT`.
+        for statement in source.iterdump():
+            destination.execute(statement)
+    finally:
+        source.rollback()
+
+def backup_database(database_path, backup_path):
+    """Copy a live database with the SQLite online backup API (or, before
+       Python 3.7, through SQL). The copy is a consistent snapshot; with WAL,
+       writers are not blocked meanwhile."""
+    source = connect_read_only(database_path)
+    destination = sqlite3.connect(backup_path)
+    try:
+        if hasattr(source, 'backup'):
+            source.backup(destination)
+        else:
+            copy_database(source, destination)
+        block_index = destination.execute('SELECT MAX(block_index) FROM blocks').fetchone()[0]
+    finally:
+        destination.close()
+        source.close()
+    return block_index
+
+def file_checksum(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(SNAPSHOT_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def snapshot(database_path, output_path, threads=None, compresslevel=SNAPSHOT_COMPRESSION_LEVEL):
+    """Write a bootstrap archive of the database at `database_path`: a
+       gzipped tarball holding the database and its `checksums.txt`."""
+    database_name = os.path.basename(database_path)
+    backup_path = '{}.{}.tmp'.format(output_path, database_name)
+
+    try:
+        start_time = time.time()
+        logger.info('Copying `{}`...'.format(database_path))
+        block_index = backup_database(database_path, backup_path)
+        logger.info('Database copied at block {} in {:.1f}s.'.format(block_index, time.time() - start_time))
+
+        checksums = '{}  {}\n'.format(file_checksum(backup_path), database_name).encode('utf-8')
+
+        start_time = time.time()
+        logger.info('Compressing to `{}`...'.format(output_path))
+        with open(output_path + '.tmp', 'wb') as output_file:
+            with ParallelGzipWriter(output_file, threads=threads, compresslevel=compresslevel) as compressed:
+                with tarfile.open(fileobj=compressed, mode='w|') as tar_file:
+                    checksums_info = tarfile.TarInfo('checksums.txt')
+                    checksums_info.size = len(checksums)
+                    checksums_info.mtime = int(time.time())
+                    tar_file.addfile(checksums_info, io.BytesIO(checksums))
+                    tar_file.add(backup_path, arcname=database_name)
+        os.replace(output_path + '.tmp', output_path)
+        logger.info('Snapshot written in {:.1f}s.'.format(time.time() - start_time))
+    finally:
+        for path in (backup_path, output_path + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    return block_index
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
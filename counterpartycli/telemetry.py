@@ -0,0 +1,157 @@
+import sys
+import json
+import time
+import pkgutil
+import logging
+import importlib
+import functools
+import collections
+
+from counterpartylib.lib import blocks, config
+import counterpartylib.lib.messages
+from counterpartycli.util import patch
+from counterpartycli.download import format_duration
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 10 # seconds
+RATE_WINDOW = 60 # seconds
+
+def message_modules():
+    """Yield `(name, module)` for every message module with a `parse` function."""
+    package = counterpartylib.lib.messages
+    for module_info in pkgutil.walk_packages(package.__path__, package.__name__ + '.'):
+        module = importlib.import_module(module_info.name)
+        if callable(getattr(module, 'parse', None)):
+            yield module_info.name[len(package.__name__) + 1:], module
+
+class Telemetry:
+    """Measure parsing throughput while blocks are (re)parsed: rolling
+       blocks/sec and transactions/sec, time per message type, time spent in
+       SQLite and an ETA. Summaries are written to stderr and, optionally, as
+       JSON lines to `output_path`. Use as a context manager."""
+
+    def __init__(self, db, enabled=True, target_block=None, interval=DEFAULT_INTERVAL, output_path=None):
+        self.db = db
+        self.enabled = enabled
+        self.target_block = target_block
+        self.interval = interval
+        self.output_path = output_path
+        self.undo = []
+
+        self.start_time = None
+        self.last_report = None
+        self.block_index = None
+        self.blocks = 0
+        self.transactions = 0
+        self.parse_time = 0
+        self.sql_time = 0
+        self.message_types = collections.defaultdict(lambda: {'count': 0, 'seconds': 0})
+        self.history = collections.deque()
+
+    def __enter__(self):
+        if self.enabled:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.enabled:
+            self.stop()
+
+    def start(self):
+        if self.target_block is None:
+            self.target_block = list(self.db.cursor().execute('''SELECT MAX(block_index) AS block_index FROM blocks'''))[0]['block_index']
+        self.start_time = self.last_report = time.time()
+        self.history.append((self.start_time, 0, 0))
+
+        self.undo.append(patch(blocks, 'parse_block', self.wrap_parse_block))
+        self.undo.append(patch(blocks, 'parse_tx', self.wrap_parse_tx))
+        for name, module in message_modules():
+            self.undo.append(patch(module, 'parse', functools.partial(self.wrap_message_parse, name)))
+        if hasattr(self.db, 'setprofile'):
+            self.db.setprofile(self.profile_statement)
+            self.undo.append(lambda: self.db.setprofile(None))
+        else:
+            logger.warning('Database connection cannot report statement timings.')
+
+    def stop(self):
+        while self.undo:
+            self.undo.pop()()
+        self.report(time.time(), final=True)
+
+    def profile_statement(self, statement, runtime):
+        self.sql_time += runtime / 1e9
+
+    def wrap_parse_block(self, parse_block):
+        def wrapper(db, block_index, *args, **kwargs):
+            start_time = time.time()
+            try:
+                return parse_block(db, block_index, *args, **kwargs)
+            finally:
+                now = time.time()
+                self.parse_time += now - start_time
+                if block_index != config.MEMPOOL_BLOCK_INDEX:
+                    self.block_index = block_index
+                    self.blocks += 1
+                    self.history.append((now, self.blocks, self.transactions))
+                    while self.history[0][0] < now - RATE_WINDOW and len(self.history) > 2:
+                        self.history.popleft()
+                if now - self.last_report >= self.interval:
+                    self.last_report = now
+                    self.report(now)
+        return wrapper
+
+    def wrap_parse_tx(self, parse_tx):
+        def wrapper(*args, **kwargs):
+            self.transactions += 1
+            return parse_tx(*args, **kwargs)
+        return wrapper
+
+    def wrap_message_parse(self, name, parse):
+        def wrapper(*args, **kwargs):
+            start_time = time.time()
+            try:
+                return parse(*args, **kwargs)
+            finally:
+                self.message_types[name]['count'] += 1
+                self.message_types[name]['seconds'] += time.time() - start_time
+        return wrapper
+
+    def summary(self, now):
+        oldest_time, oldest_blocks, oldest_transactions = self.history[0]
+        elapsed = max(now - oldest_time, 1e-6)
+        blocks_per_sec = (self.blocks - oldest_blocks) / elapsed
+        eta = None
+        if self.target_block is not None and self.block_index is not None and blocks_per_sec:
+            eta = max(self.target_block - self.block_index, 0) / blocks_per_sec
+        return {
+            'time': now,
+            'elapsed': now - self.start_time,
+            'block_index': self.block_index,
+            'target_block': self.target_block,
+            'blocks': self.blocks,
+            'transactions': self.transactions,
+            'blocks_per_sec': blocks_per_sec,
+            'tx_per_sec': (self.transactions - oldest_transactions) / elapsed,
+            'parse_seconds': self.parse_time,
+            'sql_seconds': self.sql_time,
+            'eta_seconds': eta,
+            'message_types': dict(self.message_types)
+        }
+
+    def report(self, now, final=False):
+        summary = self.summary(now)
+        top = sorted(summary['message_types'].items(), key=lambda item: item[1]['seconds'], reverse=True)[:5]
+        parse_time = max(summary['parse_seconds'], 1e-6)
+        sys.stderr.write('{}Block {} | {:.1f} blocks/s, {:.1f} tx/s | SQLite {:.0%} of parse time | ETA {} | {}\n'.format(
+            'Done. ' if final else '',
+            summary['block_index'], summary['blocks_per_sec'], summary['tx_per_sec'],
+            summary['sql_seconds'] / parse_time,
+            format_duration(summary['eta_seconds']) if summary['eta_seconds'] is not None else '?',
+            ', '.join('{} {:.0%}'.format(name, stats['seconds'] / parse_time) for name, stats in top)))
+        if self.output_path:
+            summary['final'] = final
+            with open(self.output_path, 'a') as output_file:
+                output_file.write(json.dumps(summary, sort_keys=True) + '\n')
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
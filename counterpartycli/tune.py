@@ -0,0 +1,129 @@
+import os
+import re
+import time
+import logging
+import statistics
+import concurrent.futures
+
+from prettytable import PrettyTable
+
+from counterpartycli.util import rpc, rpc_batch
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZES = [1, 5, 10, 20, 50, 100, 200, 500, 1000]
+CONCURRENCY_LEVELS = [1, 2, 4, 6, 8]
+SAMPLE_SIZE = 2000 # transactions fetched per measurement
+DEFAULT_MAX_LATENCY = 1.0 # seconds, 95th percentile per batch
+THROUGHPUT_TOLERANCE = 0.95
+POLL_SAMPLES = 20
+POLL_BUDGET = 0.05 # share of one backend connection spent polling for new blocks
+MIN_POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 5.0
+
+def sample_txids(url, size, ssl_verify=False):
+    """Return up to `size` txids from the most recent blocks."""
+    block_index = rpc(url, 'getblockcount', [], ssl_verify=ssl_verify)
+    txids = []
+    while len(txids) < size and block_index >= 0:
+        block_hash = rpc(url, 'getblockhash', [block_index], ssl_verify=ssl_verify)
+        txids += rpc(url, 'getblock', [block_hash], ssl_verify=ssl_verify)['tx']
+        block_index -= 1
+    return txids[:size]
+
+def measure(url, txids, batch_size, concurrency, ssl_verify=False):
+    """Fetch `txids` with `getrawtransaction` in batches of `batch_size`,
+       `concurrency` batches at a time."""
+    batches = [txids[i:i + batch_size] for i in range(0, len(txids), batch_size)]
+
+    def fetch(batch):
+        start_time = time.time()
+        rpc_batch(url, [('getrawtransaction', [txid, 1]) for txid in batch], ssl_verify=ssl_verify)
+        return time.time() - start_time
+
+    start_time = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(executor.map(fetch, batches))
+    elapsed = time.time() - start_time
+    return {
+        'batch_size': batch_size,
+        'concurrency': concurrency,
+        'throughput': len(txids) / elapsed,
+        'latency_p50': latencies[len(latencies) // 2],
+        'latency_p95': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+    }
+
+def poll_latency(url, samples=POLL_SAMPLES, ssl_verify=False):
+    latencies = []
+    for i in range(samples):
+        start_time = time.time()
+        rpc(url, 'getblockcount', [], ssl_verify=ssl_verify)
+        latencies.append(time.time() - start_time)
+    return statistics.median(latencies)
+
+def recommend(results, latency, max_latency=DEFAULT_MAX_LATENCY, concurrency=None):
+    """Pick the smallest batch size within `THROUGHPUT_TOLERANCE` of the best
+       throughput (among the measurements at `concurrency`, the number of
+       batches the server sends at once, meeting `max_latency`), and a poll
+       interval keeping polling under `POLL_BUDGET` of the backend's time."""
+    if any(result['concurrency'] == concurrency for result in results):
+        results = [result for result in results if result['concurrency'] == concurrency]
+    acceptable = [result for result in results if result['latency_p95'] <= max_latency] or results
+    best = max(result['throughput'] for result in acceptable)
+    chosen = min((result for result in acceptable if result['throughput'] >= best * THROUGHPUT_TOLERANCE),
+                 key=lambda result: (result['batch_size'], result['concurrency']))
+    poll_interval = round(min(max(latency / POLL_BUDGET, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL), 2)
+    return {'rpc-batch-size': chosen['batch_size'], 'backend-poll-interval': poll_interval}, chosen
+
+def write_config(config_file, values):
+    """Set `values` in the `[Default]` section of `config_file`, keeping its
+       other lines and comments."""
+    with open(config_file, 'r', encoding='utf8') as fp:
+        lines = fp.readlines()
+    remaining = dict(values)
+    for i, line in enumerate(lines):
+        match = re.match(r'^\s*([\w-]+)\s*=', line)
+        if match and match.group(1) in remaining:
+            lines[i] = '{} = {}\n'.format(match.group(1), remaining.pop(match.group(1)))
+    if lines and not lines[-1].endswith('\n'):
+        lines[-1] += '\n'
+    for key, value in remaining.items():
+        lines.append('{} = {}\n'.format(key, value))
+    with open(config_file + '.tmp', 'w', encoding='utf8') as fp:
+        fp.writelines(lines)
+    os.replace(config_file + '.tmp', config_file)
+
+def tune(url, ssl_verify=False, sample_size=SAMPLE_SIZE, max_latency=DEFAULT_MAX_LATENCY,
+         batch_sizes=BATCH_SIZES, concurrency_levels=CONCURRENCY_LEVELS, server_concurrency=None, config_file=None):
+    """Benchmark the backend at `url` and print the recommended
+       `rpc-batch-size` and `backend-poll-interval`; write them to
+       `config_file` if specified."""
+    txids = sample_txids(url, sample_size, ssl_verify=ssl_verify)
+    if not txids:
+        raise ValueError('Backend returned no transactions to benchmark with.')
+    logger.info('Benchmarking backend with {} transactions.'.format(len(txids)))
+
+    results = []
+    table = PrettyTable(['Batch size', 'Concurrency', 'tx/s', 'p50 latency (s)', 'p95 latency (s)'])
+    for batch_size in batch_sizes:
+        for concurrency in concurrency_levels:
+            result = measure(url, txids, batch_size, concurrency, ssl_verify=ssl_verify)
+            logger.debug('Batch size {}, concurrency {}: {:.0f} tx/s.'.format(batch_size, concurrency, result['throughput']))
+            results.append(result)
+            table.add_row([batch_size, concurrency, '{:.0f}'.format(result['throughput']),
+                           '{:.3f}'.format(result['latency_p50']), '{:.3f}'.format(result['latency_p95'])])
+    print(table)
+
+    latency = poll_latency(url, ssl_verify=ssl_verify)
+    values, chosen = recommend(results, latency, max_latency=max_latency, concurrency=server_concurrency)
+    print('getblockcount latency: {:.3f}s'.format(latency))
+    print('Recommended (at {:.0f} tx/s, p95 latency {:.3f}s):'.format(chosen['throughput'], chosen['latency_p95']))
+    for key, value in values.items():
+        print('    {} = {}'.format(key, value))
+
+    if config_file:
+        write_config(config_file, values)
+        logger.info('Configuration written to `{}`.'.format(config_file))
+    return values
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,144 @@
+"""Fast parsing of raw Bitcoin transactions, and extraction of the
+(obfuscated) Counterparty data they carry."""
+
+import hashlib
+import binascii
+from Crypto.Cipher import ARC4
+
+OP_RETURN = 0x6a
+OP_CHECKMULTISIG = 0xae
+OP_PUSHDATA1 = 0x4c
+OP_PUSHDATA2 = 0x4d
+OP_PUSHDATA4 = 0x4e
+
+class ParseError(Exception):
+    pass
+
+def dhash(data):
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+def hex_hash(data):
+    """Hex of a hash, in the usual (reversed) byte order."""
+    return binascii.hexlify(data[::-1]).decode('ascii')
+
+def read_varint(buf, offset):
+    prefix = buf[offset]
+    if prefix < 0xfd:
+        return prefix, offset + 1
+    size = {0xfd: 2, 0xfe: 4, 0xff: 8}[prefix]
+    return int.from_bytes(buf[offset + 1:offset + 1 + size], 'little'), offset + 1 + size
+
+def parse_tx(buf, offset=0):
+    """Parse the transaction starting at `offset` in `buf`; return it with the
+       offset of the next byte. `vin` items are `(prevout_hash, prevout_n, script)`,
+       with `prevout_hash` in internal byte order; `vout` items are `(value, script)`."""
+    start = offset
+    offset += 4
+    segwit = buf[offset] == 0 and buf[offset + 1] != 0
+    if segwit:
+        offset += 2
+    body_start = offset
+
+    vin = []
+    count, offset = read_varint(buf, offset)
+    for i in range(count):
+        prevout_hash = buf[offset:offset + 32]
+        prevout_n = int.from_bytes(buf[offset + 32:offset + 36], 'little')
+        size, offset = read_varint(buf, offset + 36)
+        vin.append((prevout_hash, prevout_n, buf[offset:offset + size]))
+        offset += size + 4
+
+    vout = []
+    count, offset = read_varint(buf, offset)
+    for i in range(count):
+        value = int.from_bytes(buf[offset:offset + 8], 'little')
+        size, offset = read_varint(buf, offset + 8)
+        vout.append((value, buf[offset:offset + size]))
+        offset += size
+    body_end = offset
+
+    if segwit:
+        for i in range(len(vin)):
+            items, offset = read_varint(buf, offset)
+            for j in range(items):
+                size, offset = read_varint(buf, offset)
+                offset += size
+    offset += 4
+
+    if segwit:
+        stripped = buf[start:start + 4] + buf[body_start:body_end] + buf[offset - 4:offset]
+    else:
+        stripped = buf[start:offset]
+    if offset > len(buf):
+        raise ParseError('Truncated transaction.')
+    return {'txid': hex_hash(dhash(stripped)), 'vin': vin, 'vout': vout, 'raw': stripped}, offset
+
+def script_pushes(script):
+    """Return the opcodes of `script`, with pushed data as bytes."""
+    items = []
+    offset = 0
+    while offset < len(script):
+        opcode = script[offset]
+        offset += 1
+        if 0 < opcode < OP_PUSHDATA1:
+            size = opcode
+        elif opcode in (OP_PUSHDATA1, OP_PUSHDATA2, OP_PUSHDATA4):
+            width = {OP_PUSHDATA1: 1, OP_PUSHDATA2: 2, OP_PUSHDATA4: 4}[opcode]
+            size = int.from_bytes(script[offset:offset + width], 'little')
+            offset += width
+        else:
+            items.append(opcode)
+            continue
+        items.append(bytes(script[offset:offset + size]))
+        offset += size
+    return items
+
+def get_data(tx, prefix):
+    """Return the Counterparty data carried by `tx` in OP_RETURN, pubkeyhash
+       or multisig outputs (de-obfuscated, without `prefix`), or `None`."""
+    if not tx['vin']:
+        return None
+    key = bytes(tx['vin'][0][0][::-1])
+    data = b''
+    found = False
+    for value, script in tx['vout']:
+        if not script:
+            continue
+        if script[0] == OP_RETURN:
+            pushes = script_pushes(script[1:])
+            if pushes and isinstance(pushes[0], bytes):
+                chunk = ARC4.new(key).decrypt(pushes[0])
+                if chunk[:len(prefix)] == prefix:
+                    data += chunk[len(prefix):]
+                    found = True
+        elif p2pkh_hash160(script):
+            chunk = ARC4.new(key).decrypt(p2pkh_hash160(script))
+            if chunk[1:len(prefix) + 1] == prefix:
+                data += chunk[len(prefix) + 1:chunk[0] + 1]
+                found = True
+        elif script[-1] == OP_CHECKMULTISIG:
+            pubkeys = [push for push in script_pushes(script) if isinstance(push, bytes)]
+            if len(pubkeys) < 2:
+                continue
+            chunk = ARC4.new(key).decrypt(b''.join(pubkey[1:-1] for pubkey in pubkeys[:-1]))
+            if chunk[1:len(prefix) + 1] == prefix:
+                data += chunk[len(prefix) + 1:chunk[0] + 1]
+                found = True
+    return data if found else None
+
+def p2pkh_hash160(script):
+    if len(script) == 25 and script[:3] == b'\x76\xa9\x14' and script[23:] == b'\x88\xac':
+        return bytes(script[3:23])
+    return None
+
+def is_candidate(tx, prefix, unspendable_hash160=None):
+    """Whether `tx` may be a Counterparty transaction. False positives are
+       possible, false negatives are not: any transaction carrying `prefix`
+       in clear, carrying obfuscated data or paying the burn address is kept."""
+    if prefix in tx['raw']:
+        return True
+    if unspendable_hash160 and any(p2pkh_hash160(script) == unspendable_hash160 for value, script in tx['vout']):
+        return True
+    return get_data(tx, prefix) is not None
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -1,6 +1,5 @@
 #! /usr/bin/python3
 
-import sys
 import os
 import threading
 import decimal
@@ -17,10 +16,16 @@ import argparse
 import configparser
 import appdirs
 import tarfile
+import urllib.parse
 import urllib.request
+import http.client
 import shutil
 import codecs
-import tempfile
+import io
+import zlib
+import hashlib
+import functools
+import sqlite3
 
 logger = logging.getLogger(__name__)
 
@@ -29,8 +34,16 @@ D = decimal.Decimal
 from counterpartylib import server
 from counterpartylib.lib import config
 from counterpartylib.lib.util import value_input, value_output
+from counterpartycli import download
 
 rpc_sessions = {}
+rpc_adapter = None # transport mounted on new RPC sessions (see `counterpartycli.cassette`)
+
+def patch(module, name, wrapper):
+    """Replace `module.name` with `wrapper(original)` and return a function undoing it."""
+    original = getattr(module, name)
+    setattr(module, name, functools.wraps(original)(wrapper(original)))
+    return lambda: setattr(module, name, original)
 
 class JsonDecimalEncoder(json.JSONEncoder):
     def default(self, o):
@@ -45,6 +58,17 @@ class RPCError(Exception):
     pass
 class AssetError(Exception):
     pass
+class QueryError(Exception):
+    pass
+
+def get_rpc_session(url):
+    if url not in rpc_sessions:
+        rpc_session = requests.Session()
+        if rpc_adapter is not None:
+            rpc_session.mount('http://', rpc_adapter)
+            rpc_session.mount('https://', rpc_adapter)
+        rpc_sessions[url] = rpc_session
+    return rpc_sessions[url]
 
 def rpc(url, method, params=None, ssl_verify=False, tries=1):
     headers = {'content-type': 'application/json'}
@@ -55,11 +79,7 @@ def rpc(url, method, params=None, ssl_verify=False, tries=1):
         "id": 0,
     }
 
-    if url not in rpc_sessions:
-        rpc_session = requests.Session()
-        rpc_sessions[url] = rpc_session
-    else:
-    	rpc_session = rpc_sessions[url]
+    rpc_session = get_rpc_session(url)
 
     response = None
     for i in range(tries):
@@ -88,22 +108,79 @@ def rpc(url, method, params=None, ssl_verify=False, tries=1):
     else:
         raise RPCError('{}'.format(response_json['error']))
 
+def rpc_batch(url, calls, ssl_verify=False):
+    """Send `calls`, a list of `(method, params)`, as a single JSON-RPC batch
+       and return their results in the same order."""
+    headers = {'content-type': 'application/json'}
+    payload = [{
+        "method": method,
+        "params": params,
+        "jsonrpc": "2.0",
+        "id": i,
+    } for i, (method, params) in enumerate(calls)]
+
+    try:
+        response = get_rpc_session(url).post(url, data=json.dumps(payload), headers=headers, verify=ssl_verify, timeout=config.REQUESTS_TIMEOUT)
+    except requests.exceptions.ConnectionError:
+        raise RPCError('Cannot communicate with {}.'.format(url))
+    if response.status_code not in (200, 500):
+        raise RPCError(str(response.status_code) + ' ' + response.reason + ' ' + response.text)
+
+    responses = {item['id']: item for item in response.json()}
+    results = []
+    for i in range(len(calls)):
+        if i not in responses:
+            raise RPCError('No response to call {} of batch.'.format(i))
+        if responses[i].get('error') is not None:
+            raise RPCError('{}'.format(responses[i]['error']))
+        results.append(responses[i]['result'])
+    return results
+
 def api(method, params=None):
     return rpc(config.COUNTERPARTY_RPC, method, params=params, ssl_verify=config.COUNTERPARTY_RPC_SSL_VERIFY)
 
+def api_pages(method, params=None, page_size=1000):
+    """Yield all the rows of a `get_<table>` call, a page at a time. Pin the
+       result set (e.g. with `end_block`) and an `order_by` so that pages
+       don't shift under concurrent writes."""
+    params = dict(params or {})
+    offset = 0
+    while True:
+        params.update({'limit': page_size, 'offset': offset})
+        rows = api(method, params)
+        yield from rows
+        if len(rows) < page_size:
+            break
+        offset += page_size
+
 def wallet_api(method, params=None):
     return rpc(config.WALLET_URL, method, params=params, ssl_verify=config.WALLET_SSL_VERIFY)
 
-def is_divisible(asset):
-    if asset in (config.BTC, config.XCP, 'leverage', 'value', 'fraction', 'price', 'odds'):
-        return True
-    else:
-        sql = '''SELECT * FROM issuances WHERE (status = ? AND asset = ?)'''
-        bindings = ['valid', asset]
-        issuances = api('sql', {'query': sql, 'bindings': bindings})
+DIVISIBILITY = {} # by asset; it never changes once issued
+DIVISIBILITY_CHUNK_SIZE = 500
+
+def get_divisibility(assets):
+    """Return `{asset: divisible}` for `assets`, asking the server, in one
+       query per `DIVISIBILITY_CHUNK_SIZE` assets, only about the assets not
+       seen before."""
+    missing = []
+    for asset in set(assets):
+        if asset in (config.BTC, config.XCP, 'leverage', 'value', 'fraction', 'price', 'odds'):
+            DIVISIBILITY[asset] = True
+        elif asset not in DIVISIBILITY:
+            missing.append(asset)
+    for i in range(0, len(missing), DIVISIBILITY_CHUNK_SIZE):
+        chunk = missing[i:i + DIVISIBILITY_CHUNK_SIZE]
+        sql = '''SELECT asset, divisible FROM issuances WHERE (status = ? AND asset IN ({}))'''.format(','.join(['?'] * len(chunk)))
+        for issuance in api('sql', {'query': sql, 'bindings': ['valid'] + chunk}):
+            DIVISIBILITY.setdefault(issuance['asset'], issuance['divisible'])
+    for asset in missing:
+        if asset not in DIVISIBILITY:
+            raise AssetError('No such asset: {}'.format(asset))
+    return {asset: DIVISIBILITY[asset] for asset in assets}
 
-        if not issuances: raise AssetError('No such asset: {}'.format(asset))
-        return issuances[0]['divisible']
+def is_divisible(asset):
+    return get_divisibility([asset])[asset]
 
 def value_in(quantity, asset, divisible=None):
     if divisible is None:
@@ -115,17 +192,271 @@ def value_out(quantity, asset, divisible=None):
         divisible = is_divisible(asset)
     return value_output(quantity, asset, divisible)
 
-def bootstrap(testnet=False, overwrite=True, ask_confirmation=False, quiet=False):
+GETROWS_OPERATORS = ['=', '==', '!=', '>', '<', '>=', '<=', 'IN', 'LIKE', 'NOT IN', 'NOT LIKE']
+GETROWS_FIELD = re.compile('^[a-z0-9_]+$')
+GETROWS_PARAMS = ('filters', 'filterop', 'order_by', 'order_dir', 'start_block', 'end_block', 'status', 'limit', 'offset')
+
+def getrows_query(table, filters=None, filterop='AND', order_by=None, order_dir=None, start_block=None, end_block=None, status=None, limit=1000, offset=0):
+    """Build the SQL statement and bindings counterparty-server runs for a `get_<table>` API call."""
+    if not GETROWS_FIELD.match(table):
+        raise QueryError('Invalid table')
+    if filterop and filterop.upper() not in ['OR', 'AND']:
+        raise QueryError('Invalid filter operator (OR, AND)')
+    if order_dir and order_dir.upper() not in ['ASC', 'DESC']:
+        raise QueryError('Invalid order direction (ASC, DESC)')
+    if order_by and not GETROWS_FIELD.match(order_by):
+        raise QueryError('Invalid order_by, must be a field name')
+
+    if isinstance(filters, dict):
+        filters = [filters]
+    elif not isinstance(filters, (list, tuple)):
+        filters = []
+
+    def marker(value):
+        if isinstance(value, (list, tuple)):
+            return '({})'.format(','.join(['?'] * len(value)))
+        return '?'
+
+    conditions = []
+    bindings = []
+    for filter_ in filters:
+        if isinstance(filter_, dict):
+            field, op, value = filter_['field'], filter_['op'], filter_['value']
+            case_sensitive = filter_.get('case_sensitive', False)
+        else:
+            field, op, value = filter_[:3]
+            case_sensitive = filter_[3] if len(filter_) == 4 else False
+        if not GETROWS_FIELD.match(field):
+            raise QueryError('Invalid field `{}`'.format(field))
+        if op.upper() not in GETROWS_OPERATORS:
+            raise QueryError('Invalid operator for the field `{}`'.format(field))
+        if isinstance(value, (list, tuple)) and op.upper() not in ['IN', 'NOT IN']:
+            raise QueryError('Invalid value for the field `{}`'.format(field))
+        if table == 'sends' and field == 'memo':
+            value = bytes(value, 'utf-8')
+        elif table == 'sends' and field == 'memo_hex':
+            try:
+                field, value = 'memo', bytes.fromhex(value)
+            except ValueError:
+                raise QueryError('Invalid memo_hex value')
+        # As the server: only an upper case `LIKE` is made case insensitive.
+        if op == 'LIKE' and not case_sensitive:
+            field, value = 'UPPER({})'.format(field), value.upper()
+        conditions.append('{} {} {}'.format(field, op, marker(value)))
+        if isinstance(value, (list, tuple)):
+            bindings += list(value)
+        else:
+            bindings.append(value)
+
+    more_conditions = []
+    if table in ['order_matches', 'bet_matches']:
+        start_field, end_field = 'tx0_block_index', 'tx1_block_index'
+    elif table != 'balances':
+        start_field, end_field = 'block_index', 'block_index'
+    else:
+        start_field = end_field = None
+    if start_field and start_block is not None:
+        more_conditions.append('{} >= ?'.format(start_field))
+        bindings.append(start_block)
+    if end_field and end_block is not None:
+        more_conditions.append('{} <= ?'.format(end_field))
+        bindings.append(end_block)
+    if isinstance(status, list) and status:
+        more_conditions.append('status IN {}'.format(marker(status)))
+        bindings += status
+    elif isinstance(status, str) and status != '':
+        more_conditions.append('status == ?')
+        bindings.append(status)
+
+    statement = 'SELECT * FROM {}'.format(table)
+    all_conditions = []
+    if conditions:
+        all_conditions.append('({})'.format(' {} '.format((filterop or 'AND').upper()).join(conditions)))
+    if more_conditions:
+        all_conditions.append('({})'.format(' AND '.join(more_conditions)))
+    if all_conditions:
+        statement += ' WHERE {}'.format(' AND '.join(all_conditions))
+    if order_by:
+        statement += ' ORDER BY {}'.format(order_by)
+        if order_dir:
+            statement += ' {}'.format(order_dir.upper())
+    if limit:
+        statement += ' LIMIT {}'.format(int(limit))
+        if offset:
+            statement += ' OFFSET {}'.format(int(offset))
+
+    return statement, bindings
+
+def connect_read_only(database_path, check_same_thread=True):
+    """Open the SQLite database at `database_path` read-only (it must exist)."""
+    return sqlite3.connect('file:{}?mode=ro'.format(urllib.request.pathname2url(database_path)), uri=True,
+                           check_same_thread=check_same_thread)
+
+BOOTSTRAP_URL_MAINNET = 'https://s3.amazonaws.com/counterparty-bootstrap/counterparty-db.latest.tar.gz'
+BOOTSTRAP_URL_TESTNET = 'https://s3.amazonaws.com/counterparty-bootstrap/counterparty-db-testnet.latest.tar.gz'
+BOOTSTRAP_CHUNK_SIZE = 1024 * 1024
+BOOTSTRAP_TIMEOUT = 60 # seconds
+BOOTSTRAP_MAX_RESUMES = 10
+BOOTSTRAP_HASHES = {32: 'md5', 64: 'sha256'} # checksum algorithms, by hexdigest length
+
+class BootstrapError(Exception):
+    pass
+
+class ResumableDownload(io.RawIOBase):
+    """Read a URL (or a local file) as a stream. If the connection drops, the
+       download is resumed where it stopped with an HTTP Range request."""
+
+    def __init__(self, url, progress=None, max_resumes=BOOTSTRAP_MAX_RESUMES):
+        self.url = url
+        self.progress = progress
+        self.resumes_left = max_resumes
+        self.position = 0
+        self.total_size = None
+        self.response = self.connect()
+        if self.progress:
+            self.progress.total_size = self.total_size
+
+    def connect(self):
+        scheme = urllib.parse.urlsplit(self.url).scheme
+        if os.path.exists(self.url) or scheme == 'file':
+            path = self.url if os.path.exists(self.url) else urllib.request.url2pathname(urllib.parse.urlsplit(self.url).path)
+            local_file = open(path, 'rb')
+            local_file.seek(self.position)
+            self.total_size = os.fstat(local_file.fileno()).st_size
+            return local_file
+
+        request = urllib.request.Request(self.url)
+        if self.position:
+            request.add_header('Range', 'bytes={}-'.format(self.position))
+        response = urllib.request.urlopen(request, timeout=BOOTSTRAP_TIMEOUT)
+        if self.position and response.status != 206:
+            raise BootstrapError('{} does not support resuming downloads.'.format(self.url))
+        content_length = response.getheader('Content-Length')
+        if content_length is not None:
+            self.total_size = self.position + int(content_length)
+        return response
+
+    def resume(self, reason):
+        if self.resumes_left <= 0:
+            raise BootstrapError('Download interrupted: {}'.format(reason))
+        self.resumes_left -= 1
+        logger.warning('Download interrupted at byte {} ({}). Resuming...'.format(self.position, reason))
+        self.response.close()
+        time.sleep(1)
+        self.response = self.connect()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while True:
+            try:
+                size = self.response.readinto(buffer)
+            except (OSError, http.client.HTTPException) as e:
+                self.resume(e)
+                continue
+            if not size and self.total_size is not None and self.position < self.total_size:
+                self.resume('connection closed early')
+                continue
+            self.position += size
+            if size and self.progress:
+                self.progress.add(size)
+            return size
+
+    def close(self):
+        self.response.close()
+        super(ResumableDownload, self).close()
+
+class GzipStream(io.RawIOBase):
+    """Decompress a gzip stream, including archives made of several
+       concatenated members (as written by parallel compressors)."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            if self.decompressor.unconsumed_tail:
+                data = self.decompressor.unconsumed_tail
+            elif self.decompressor.eof:
+                data = self.decompressor.unused_data
+                self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                if not data:
+                    data = self.fileobj.read(BOOTSTRAP_CHUNK_SIZE)
+                    if not data:
+                        return 0
+            else:
+                data = self.fileobj.read(BOOTSTRAP_CHUNK_SIZE)
+                if not data:
+                    raise BootstrapError('Truncated archive.')
+            self.pending = self.decompressor.decompress(data, BOOTSTRAP_CHUNK_SIZE)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+def parse_checksums(content):
+    """Parse `sha256sum`/`md5sum` style lines into `{filename: hexdigest}`."""
+    checksums = {}
+    for line in content.decode('utf-8').splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            checksum, filename = parts
+            checksums[os.path.basename(filename.lstrip('*'))] = checksum.lower()
+    return checksums
+
+def extract_stream(fileobj, data_dir):
+    """Extract a (streamed) tarball to `data_dir`, hashing files as they are
+       written. Files are extracted with a `.part` suffix; return the list of
+       extracted names, their digests and the content of `checksums.txt`."""
+    extracted, digests, checksums = [], {}, None
+    with tarfile.open(fileobj=fileobj, mode='r|') as tar_file:
+        for member in tar_file:
+            name = os.path.basename(member.name)
+            # Only top-level files (`name` or `./name`) are extracted.
+            if not member.isfile() or name not in (member.name, './' + name):
+                logger.debug('Skipping archive member `{}`.'.format(member.name))
+                continue
+            source = tar_file.extractfile(member)
+            if name == 'checksums.txt':
+                checksums = parse_checksums(source.read())
+                continue
+            hashers = {algorithm: hashlib.new(algorithm) for algorithm in BOOTSTRAP_HASHES.values()}
+            with open(os.path.join(data_dir, name + '.part'), 'wb') as target:
+                extracted.append(name)
+                for chunk in iter(lambda: source.read(BOOTSTRAP_CHUNK_SIZE), b''):
+                    for hasher in hashers.values():
+                        hasher.update(chunk)
+                    target.write(chunk)
+            digests[name] = {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+    return extracted, digests, checksums
+
+def verify_checksums(digests, checksums):
+    if checksums is None:
+        raise BootstrapError('No `checksums.txt` found in archive.')
+    for name in digests:
+        if name not in checksums:
+            raise BootstrapError('No checksum for `{}`.'.format(name))
+        algorithm = BOOTSTRAP_HASHES.get(len(checksums[name]))
+        if algorithm is None:
+            raise BootstrapError('Unknown checksum format for `{}`.'.format(name))
+        if digests[name][algorithm] != checksums[name]:
+            raise BootstrapError('Checksum mismatch for `{}`.'.format(name))
+
+def bootstrap(testnet=False, overwrite=True, ask_confirmation=False, quiet=False, url=None, workers=1):
     data_dir = appdirs.user_data_dir(appauthor=config.XCP_NAME, appname=config.APP_NAME, roaming=True)
 
     # Set Constants.
     if testnet:
-        BOOTSTRAP_URL = 'https://s3.amazonaws.com/counterparty-bootstrap/counterparty-db-testnet.latest.tar.gz'
-        TARBALL_PATH = os.path.join(tempfile.gettempdir(), 'counterpartyd-testnet-db.latest.tar.gz')
+        BOOTSTRAP_URL = url or BOOTSTRAP_URL_TESTNET
         DATABASE_PATH = os.path.join(data_dir, '{}.testnet.db'.format(config.APP_NAME))
     else:
-        BOOTSTRAP_URL = 'https://s3.amazonaws.com/counterparty-bootstrap/counterparty-db.latest.tar.gz'
-        TARBALL_PATH = os.path.join(tempfile.gettempdir(), 'counterpartyd-db.latest.tar.gz')
+        BOOTSTRAP_URL = url or BOOTSTRAP_URL_MAINNET
         DATABASE_PATH = os.path.join(data_dir, '{}.db'.format(config.APP_NAME))
 
     # Prepare Directory.
@@ -134,43 +465,67 @@ def bootstrap(testnet=False, overwrite=True, ask_confirmation=False, quiet=False
     if not overwrite and os.path.exists(DATABASE_PATH):
         return
 
-    # Define Progress Bar.
-    def reporthook(blocknum, blocksize, totalsize):
-        readsofar = blocknum * blocksize
-        if totalsize > 0:
-            percent = readsofar * 1e2 / totalsize
-            s = "\r%5.1f%% %*d / %d" % (
-                percent, len(str(totalsize)), readsofar, totalsize)
-            sys.stderr.write(s)
-            if readsofar >= totalsize: # near the end
-                sys.stderr.write("\n")
-        else: # total size is unknown
-            sys.stderr.write("read %d\n" % (readsofar,))
-
-    print('Downloading database from {}...'.format(BOOTSTRAP_URL))
-    urllib.request.urlretrieve(BOOTSTRAP_URL, TARBALL_PATH, reporthook if not quiet else None)
-
-    print('Extracting to "%s"...' % data_dir)
-    with tarfile.open(TARBALL_PATH, 'r:gz') as tar_file:
-        tar_file.extractall(path=data_dir)
-
-    assert os.path.exists(DATABASE_PATH)
+    # With several workers, fetch byte ranges concurrently into a local file
+    # first; otherwise (or if the server can't), stream straight into `tarfile`.
+    TARBALL_PATH = None
+    if workers > 1 and urllib.parse.urlsplit(BOOTSTRAP_URL).scheme in ('http', 'https'):
+        size, accepts_ranges = download.probe(BOOTSTRAP_URL)
+        if accepts_ranges:
+            TARBALL_PATH = os.path.join(data_dir, os.path.basename(DATABASE_PATH) + '.tar.gz.download')
+            print('Downloading database from {} with {} workers...'.format(BOOTSTRAP_URL, workers))
+            progress = download.Progress(size) if not quiet else None
+            downloaded = False
+            try:
+                download.segmented_download(BOOTSTRAP_URL, TARBALL_PATH, size, workers=workers, progress=progress)
+                downloaded = True
+            finally:
+                if not downloaded and os.path.exists(TARBALL_PATH):
+                    os.remove(TARBALL_PATH)
+            if progress:
+                progress.finish()
+        else:
+            logger.warning('{} does not support byte ranges, downloading with a single connection.'.format(BOOTSTRAP_URL))
+
+    # Download (or read), decompress, hash and extract in a single pass.
+    print('Extracting {} to "{}"...'.format(TARBALL_PATH or BOOTSTRAP_URL, data_dir))
+    progress = download.Progress() if not quiet and not TARBALL_PATH else None
+    source = ResumableDownload(TARBALL_PATH or BOOTSTRAP_URL, progress)
+    extracted = []
+    try:
+        stream = io.BufferedReader(GzipStream(io.BufferedReader(source, BOOTSTRAP_CHUNK_SIZE)), BOOTSTRAP_CHUNK_SIZE)
+        extracted, digests, checksums = extract_stream(stream, data_dir)
+        if progress:
+            progress.finish()
+
+        print('Verifying checksums...')
+        verify_checksums(digests, checksums)
+        for name in extracted:
+            os.replace(os.path.join(data_dir, name + '.part'), os.path.join(data_dir, name))
+    finally:
+        source.close()
+        for name in extracted:
+            if os.path.exists(os.path.join(data_dir, name + '.part')):
+                os.remove(os.path.join(data_dir, name + '.part'))
+        if TARBALL_PATH and os.path.exists(TARBALL_PATH):
+            os.remove(TARBALL_PATH)
+
+    if not os.path.exists(DATABASE_PATH):
+        raise BootstrapError('Database `{}` not found in archive.'.format(os.path.basename(DATABASE_PATH)))
     os.chmod(DATABASE_PATH, 0o660)
 
-    print('Cleaning up...')
-    os.remove(TARBALL_PATH)
-    os.remove(os.path.join(data_dir, 'checksums.txt'))
-
-# Set default values of command line arguments with config file
-def add_config_arguments(arg_parser, config_args, default_config_file, config_file_arg_name='config_file'):
-    cmd_args = arg_parser.parse_known_args()[0]
-
-    config_file = getattr(cmd_args, config_file_arg_name, None)
+def get_config_file_path(config_file, default_config_file):
     if not config_file:
         config_dir = appdirs.user_config_dir(appauthor=config.XCP_NAME, appname=config.APP_NAME, roaming=True)
         if not os.path.isdir(config_dir):
             os.makedirs(config_dir, mode=0o755)
         config_file = os.path.join(config_dir, default_config_file)
+    return config_file
+
+# Set default values of command line arguments with config file
+def add_config_arguments(arg_parser, config_args, default_config_file, config_file_arg_name='config_file'):
+    cmd_args = arg_parser.parse_known_args()[0]
+
+    config_file = get_config_file_path(getattr(cmd_args, config_file_arg_name, None), default_config_file)
 
     # clean BOM
     BUFSIZE = 4096
@@ -6,11 +6,12 @@ logger = logging.getLogger(__name__)
 import sys
 import json
 import time
+import concurrent.futures
 from decimal import Decimal as D
 
 from counterpartycli.wallet import bitcoincore, btcwallet
 from counterpartylib.lib import config, util, exceptions, script
-from counterpartycli.util import api, value_out
+from counterpartycli.util import api, api_pages, value_out, get_divisibility
 
 from pycoin.tx import Tx, SIGHASH_ALL
 from pycoin.encoding import wif_to_tuple_of_secret_exponent_compressed, public_pair_to_hash160_sec
@@ -56,7 +57,8 @@ def pycoin_sign_raw_transaction(tx_hex, private_key_wif):
 
 def sign_raw_transaction(tx_hex, private_key_wif=None):
     if private_key_wif is None:
-        if WALLET().is_locked():
+        UNLOCK_SESSION.renew()
+        if is_locked():
             raise LockedWalletError('Wallet is locked.')
         return WALLET().sign_raw_transaction(tx_hex)
     else:
@@ -80,49 +82,146 @@ def list_unspent():
 def send_raw_transaction(tx_hex):
 	return WALLET().send_raw_transaction(tx_hex)
 
+DEFAULT_UNLOCK_DURATION = 60 # seconds
+UNLOCK_RENEWAL_MARGIN = 10 # seconds before expiry, at most a quarter of the duration
+
+class UnlockSession:
+    """Remember until when the wallet was unlocked, to answer `is_locked`
+       without asking the backend, and, with `renew`, the passphrase, to
+       unlock it again shortly before it expires during long jobs. This
+       lives in the process: it helps library callers and long running
+       commands, not separate runs of the client. The passphrase stays in
+       memory until `forget` (which can't scrub the string)."""
+
+    def __init__(self):
+        self.unlocked_until = None
+        self.margin = UNLOCK_RENEWAL_MARGIN
+        self.passphrase = None
+
+    def is_unlocked(self):
+        return self.unlocked_until is not None and time.monotonic() < self.unlocked_until - self.margin
+
+    def unlock(self, passphrase, duration=None, renew=True):
+        duration = duration or getattr(config, 'UNLOCK_DURATION', DEFAULT_UNLOCK_DURATION)
+        if duration <= 0:
+            raise ValueError('unlock duration must be positive')
+        start = time.monotonic()
+        result = WALLET().unlock(passphrase, duration)
+        self.unlocked_until = start + duration
+        # Short unlocks are renewed in their last quarter, not on every use.
+        self.margin = min(UNLOCK_RENEWAL_MARGIN, duration / 4)
+        self.passphrase = passphrase if renew else None
+        return result
+
+    def renew(self):
+        """Unlock the wallet again if it expires within the renewal margin."""
+        if self.passphrase is not None and not self.is_unlocked():
+            logger.debug('Renewing wallet unlock.')
+            self.unlock(self.passphrase)
+
+    def forget(self):
+        self.unlocked_until = None
+        self.passphrase = None
+
+UNLOCK_SESSION = UnlockSession()
+
 def is_locked():
+    if UNLOCK_SESSION.is_unlocked():
+        return False
     return WALLET().is_locked()
 
-def unlock(passphrase):
-    return WALLET().unlock(passphrase)
+def unlock(passphrase, duration=None, renew=True):
+    return UNLOCK_SESSION.unlock(passphrase, duration=duration, renew=renew)
 
 def wallet_last_block():
     return WALLET().wallet_last_block()
 
+BALANCES_CHUNK_SIZE = 100 # addresses per `get_balances` call
+
+def satoshis(btc_balance):
+    """Turn a BTC balance from the wallet (a float) into satoshis."""
+    return int(D(str(btc_balance)) * config.UNIT)
+
+def render(quantities):
+    """Turn `{asset: quantity}`, in smallest units, into `{asset: balance}`,
+       in `Decimal` units."""
+    divisibility = get_divisibility(quantities)
+    return {asset: D(value_out(quantity, asset, divisible=divisibility[asset])) for asset, quantity in quantities.items()}
+
+def iter_wallet():
+    """Yield `{'address': address, 'balances': {asset: balance}}` for each
+       address of the wallet as soon as its balances are fetched, then
+       `{'assets': {asset: total}}`. Quantities are summed as integers and
+       only turned into `Decimal` units when yielded."""
+    totals = {}
+    bunches = list(get_btc_balances())
+    for i in range(0, len(bunches), BALANCES_CHUNK_SIZE):
+        chunk = bunches[i:i + BALANCES_CHUNK_SIZE]
+        quantities = {}
+        for address, btc_balance in chunk:
+            quantities.setdefault(address, {})
+            if btc_balance:
+                quantities[address]['BTC'] = quantities[address].get('BTC', 0) + satoshis(btc_balance)
+        balances = api_pages('get_balances', {'filters': [('address', 'IN', list(quantities))], 'order_by': 'rowid'})
+        for balance in balances:
+            if balance['quantity']:
+                address_quantities = quantities[balance['address']]
+                address_quantities[balance['asset']] = address_quantities.get(balance['asset'], 0) + balance['quantity']
+        # One query for the divisibility of all the new assets of the chunk.
+        get_divisibility({asset for address_quantities in quantities.values() for asset in address_quantities})
+        for address, address_quantities in quantities.items():
+            for asset, quantity in address_quantities.items():
+                totals[asset] = totals.get(asset, 0) + quantity
+            yield {'address': address, 'balances': render(address_quantities)}
+    yield {'assets': render(totals)}
+
 def wallet():
     wallet = {
         'addresses': {},
         'assets': {}
     }
-
-    def add_total(address, asset, quantity):
-        if quantity:
-            if address not in wallet['addresses']:
-                wallet['addresses'][address] = {}
-            if asset not in wallet['assets']:
-                wallet['assets'][asset]  = 0
-            if asset not in wallet['addresses'][address]:
-                wallet['addresses'][address][asset] = 0
-            wallet['addresses'][address][asset] += quantity
-            wallet['assets'][asset]  += quantity
-
-    for bunch in get_btc_balances():
-        address, btc_balance = bunch
-        add_total(address, 'BTC', btc_balance)
-        balances = api('get_balances', {'filters': [('address', '==', address),]})
-        for balance in balances:
-            asset = balance['asset']
-            balance = D(value_out(balance['quantity'], asset))
-            add_total(address, asset, balance)
-
+    for item in iter_wallet():
+        if 'address' in item:
+            if item['balances']:
+                wallet['addresses'][item['address']] = item['balances']
+        else:
+            wallet['assets'] = item['assets']
     return wallet
 
+ADDRESS_CHUNK_SIZE = 500 # addresses per `IN` filter
+SENDS_WORKERS = 4
+
+def get_sends(asset_name, addresses):
+    """Return the valid sends of `asset_name` from or to `addresses`, in
+       order. The addresses are split into chunks, each with a query for the
+       sends from it and one for the sends to it, fetched (a page at a time)
+       in parallel."""
+    block_index = api('get_running_info')['last_block']['block_index']
+    queries = []
+    for i in range(0, len(addresses), ADDRESS_CHUNK_SIZE):
+        chunk = addresses[i:i + ADDRESS_CHUNK_SIZE]
+        for field in ('source', 'destination'):
+            queries.append({
+                'filters': [('asset', '==', asset_name), (field, 'IN', chunk)],
+                'status': 'valid',
+                'end_block': block_index, # So that pages don't shift.
+                'order_by': 'tx_index'
+            })
+    sends = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=SENDS_WORKERS) as executor:
+        for rows in executor.map(lambda params: list(api_pages('get_sends', params)), queries):
+            for send in rows:
+                # Sends within the wallet may come from two queries.
+                sends[(send['tx_hash'], send.get('msg_index', 0))] = send
+    return sorted(sends.values(), key=lambda send: (send['tx_index'], send.get('msg_index', 0)))
+
 def asset(asset_name):
     supply = api('get_supply', {'asset': asset_name})
     asset_id = api('get_assets', {'filters': [('asset_name', '==', asset_name),]})[0]['asset_id']
+    divisible = get_divisibility([asset_name])[asset_name]
     asset_info = {
         'asset': asset_name,
-        'supply': D(value_out(supply, asset_name)),
+        'supply': D(value_out(supply, asset_name, divisible=divisible)),
         'asset_id': asset_id
     }
     if asset_name in ['XCP', 'BTC']:
@@ -155,54 +254,52 @@ def asset(asset_name):
             'issuer': issuance['issuer']
         })
 
-    asset_info['balance'] = 0
-    asset_info['addresses'] = {}
+    # Summed as integers, turned into `Decimal` units at the end.
+    total = 0
+    quantities = {}
+    bunches = list(get_btc_balances())
+    if asset_name == 'BTC':
+        rows = [(address, satoshis(btc_balance)) for address, btc_balance in bunches]
+    else:
+        wallet_addresses = [address for address, btc_balance in bunches]
+        rows = ((balance['address'], balance['quantity']) for i in range(0, len(wallet_addresses), ADDRESS_CHUNK_SIZE)
+                for balance in api_pages('get_balances', {'filters': [('address', 'IN', wallet_addresses[i:i + ADDRESS_CHUNK_SIZE]), ('asset', '==', asset_name)],
+                                                          'order_by': 'rowid'}))
+    for address, quantity in rows:
+        if quantity:
+            total += quantity
+            quantities[address] = quantities.get(address, 0) + quantity
 
-    for bunch in get_btc_balances():
-        address, btc_balance = bunch
-        if asset_name == 'BTC':
-            balance = btc_balance
-        else:
-            balances = api('get_balances', {'filters': [('address', '==', address), ('asset', '==', asset_name)]})
-            if balances:
-                balance = balances[0]
-                balance = D(value_out(balance['quantity'], asset_name))
-            else:
-                balance = 0
-        if balance:
-            asset_info['balance'] += balance
-            asset_info['addresses'][address] = balance
+    asset_info['balance'] = D(value_out(total, asset_name, divisible=divisible)) if total else 0
+    asset_info['addresses'] = {address: D(value_out(quantity, asset_name, divisible=divisible)) for address, quantity in quantities.items()}
 
     addresses = list(asset_info['addresses'].keys())
 
     if asset_name != 'BTC':
-        all_sends = api('get_sends',  {'filters': [('source', 'IN', addresses), ('destination', 'IN', addresses)], 'filterop': 'OR', 'status': 'valid'})
+        address_set = set(addresses)
         sends = []
-        for send in all_sends:
-            if send['asset'] == asset_name:
-                if send['source'] in addresses and send['destination'] in addresses:
-                    tx_type = 'in-wallet'
-                elif send['source'] in addresses:
-                    tx_type = 'send'
-                elif send['destination'] in addresses:
-                    tx_type = 'receive'
-                send['type'] = tx_type
-                send['quantity'] = D(value_out(send['quantity'], asset_name))
-                sends.append(send)
+        for send in get_sends(asset_name, addresses):
+            if send['source'] in address_set and send['destination'] in address_set:
+                tx_type = 'in-wallet'
+            elif send['source'] in address_set:
+                tx_type = 'send'
+            else:
+                tx_type = 'receive'
+            send['type'] = tx_type
+            send['quantity'] = D(value_out(send['quantity'], asset_name, divisible=divisible))
+            sends.append(send)
         asset_info['sends'] = sends
 
     return asset_info
 
 def balances(address):
-    result = {
-        'BTC': get_btc_balance(address)
+    quantities = {
+        'BTC': satoshis(get_btc_balance(address))
     }
     balances = api('get_balances', {'filters': [('address', '==', address),]})
     for balance in balances:
-        asset = balance['asset']
-        balance = D(value_out(balance['quantity'], asset))
-        result[asset] =  balance
-    return result
+        quantities[balance['asset']] = balance['quantity']
+    return render(quantities)
 
 def pending():
     addresses = []
@@ -215,4 +312,60 @@ def pending():
     awaiting_btcs = api('get_order_matches', {'filters': filters, 'filterop': 'OR', 'status': 'pending'})
     return awaiting_btcs
 
+PENDING_WATCH_INTERVAL = 10 # seconds
+PENDING_ADDRESS_REFRESH = 600 # seconds
+
+def watch_pending(interval=PENDING_WATCH_INTERVAL, address_refresh=PENDING_ADDRESS_REFRESH):
+    """Yield the pending order matches involving the wallet, then, as blocks
+       arrive, `{'event', 'block_index', 'order_match'}` deltas: `new`
+       matches, and `completed` (paid) or `expired` ones.
+
+       The wallet addresses are cached and each poll only fetches the rows of
+       the new blocks, matching them locally, so its cost doesn't depend on
+       the size of the wallet."""
+    addresses = set(get_wallet_addresses())
+    addresses_time = time.time()
+    last_block = api('get_running_info')['last_block']['block_index']
+    known = {}
+    for order_match in pending():
+        known[order_match['id']] = order_match
+        yield {'event': 'pending', 'block_index': last_block, 'order_match': order_match}
+
+    while True:
+        time.sleep(interval)
+        block_index = api('get_running_info')['last_block']['block_index']
+        if block_index is None or block_index <= last_block:
+            continue
+        if time.time() - addresses_time > address_refresh:
+            addresses = set(get_wallet_addresses())
+            addresses_time = time.time()
+
+        # `start_block` filters order matches on `tx0_block_index`, which
+        # would miss new matches against old orders: filter on the match's
+        # own block instead.
+        new_matches = api_pages('get_order_matches', {
+            'filters': [('block_index', '>', last_block)],
+            'end_block': block_index,
+            'status': 'pending',
+            'order_by': 'id'
+        })
+        for order_match in new_matches:
+            if order_match['tx0_address'] in addresses or order_match['tx1_address'] in addresses:
+                known[order_match['id']] = order_match
+                yield {'event': 'new', 'block_index': order_match['block_index'], 'order_match': order_match}
+
+        if known:
+            for event, table in (('completed', 'btcpays'), ('expired', 'order_match_expirations')):
+                rows = api_pages('get_{}'.format(table), {
+                    'filters': [('order_match_id', 'IN', list(known))],
+                    'start_block': last_block + 1,
+                    'end_block': block_index,
+                    'order_by': 'block_index'
+                })
+                for row in rows:
+                    if row['order_match_id'] in known and row.get('status', 'valid') == 'valid':
+                        yield {'event': event, 'block_index': row['block_index'], 'order_match': known.pop(row['order_match_id'])}
+
+        last_block = block_index
+
 # vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -56,10 +56,10 @@ def is_locked():
         else:
             return True # Wallet is locked
     else:
-        False
+        return False
 
-def unlock(passphrase):
-    return rpc('walletpassphrase', [passphrase, 60])
+def unlock(passphrase, duration=60):
+    return rpc('walletpassphrase', [passphrase, duration])
 
 def send_raw_transaction(tx_hex):
     return rpc('sendrawtransaction', [tx_hex])
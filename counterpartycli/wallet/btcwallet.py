@@ -61,8 +61,8 @@ def get_btc_balance(address):
 def is_locked():
     return rpc('walletislocked', [])
 
-def unlock(passphrase):
-    return rpc('walletpassphrase', [passphrase, 60])
+def unlock(passphrase, duration=60):
+    return rpc('walletpassphrase', [passphrase, duration])
 
 def send_raw_transaction(tx_hex):
     return rpc('sendrawtransaction', [tx_hex])
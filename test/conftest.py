@@ -0,0 +1,175 @@
+import os
+import re
+import sys
+import sqlite3
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+import pytest
+
+from counterpartycli import util, wallet
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+import stubrpc # tools/stubrpc.py
+
+class FileServer(ThreadingMixIn, HTTPServer):
+    """Serve `content` at any path, with byte ranges. The first `failures`
+       responses are cut after `cut_after` bytes."""
+    daemon_threads = True
+
+    def __init__(self, content):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FileRequestHandler)
+        self.content = content
+        self.accept_ranges = True
+        self.failures = 0
+        self.cut_after = 0
+        self.ranges = []
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        pass # connections cut on purpose
+
+class FileRequestHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.server.content)))
+        if self.server.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+    def do_GET(self):
+        content = self.server.content
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match and self.server.accept_ranges:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(content) - 1
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(content)))
+        else:
+            start, end = 0, len(content) - 1
+            self.send_response(200)
+        body = content[start:end + 1]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        with self.server.lock:
+            self.server.ranges.append((start, end))
+            cut = self.server.failures > 0
+            if cut:
+                self.server.failures -= 1
+        if cut:
+            self.wfile.write(body[:self.server.cut_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+@pytest.fixture
+def file_server():
+    """Start a `FileServer` and return it; its URL is `server.url`."""
+    def start(content):
+        server = FileServer(content)
+        server.url = 'http://127.0.0.1:{}/archive.tar.gz'.format(server.server_address[1])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+    servers = []
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+class FakeServer:
+    """counterparty-server's `get_running_info`, `get_block_info` and
+       `get_<table>` calls, answered with `util.getrows_query` from an
+       in-memory SQLite database; a table without rows is empty. The hash of
+       a block is its branch followed by its index, and `block_rows(block_index,
+       branch)` returns the `{table: rows}` of a block."""
+
+    def __init__(self, height=0, tables=None, block_rows=None, branch='h'):
+        self.db = sqlite3.connect(':memory:', check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        self.block_rows = block_rows
+        self.branches = []
+        self.height = -1
+        self.calls = []
+        self.extend(height, branch=branch)
+        for table, rows in (tables or {}).items():
+            self.insert(table, rows)
+
+    def tables(self):
+        return [row[0] for row in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+
+    def insert(self, table, rows):
+        with self.lock:
+            for row in rows:
+                if table not in self.tables():
+                    self.db.execute('CREATE TABLE {} ({})'.format(table, ', '.join(row)))
+                self.db.execute('INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(row), ', '.join(['?'] * len(row))), list(row.values()))
+
+    def extend(self, height, start_block=None, branch='h'):
+        """Replace the blocks from `start_block` (by default, those after the
+           last one) with blocks up to `height` on `branch`."""
+        start_block = self.height + 1 if start_block is None else start_block
+        with self.lock:
+            for table in self.tables():
+                if 'block_index' in [row[1] for row in self.db.execute('PRAGMA table_info({})'.format(table))]:
+                    self.db.execute('DELETE FROM {} WHERE block_index >= ?'.format(table), (start_block,))
+        self.branches = [(start, name) for start, name in self.branches if start < start_block] + [(start_block, branch)]
+        self.height = height
+        if self.block_rows:
+            for block_index in range(start_block, height + 1):
+                for table, rows in self.block_rows(block_index, branch).items():
+                    self.insert(table, rows)
+
+    def block_hash(self, block_index):
+        branch = [name for start, name in self.branches if start <= block_index][-1]
+        return '{}{}'.format(branch, block_index)
+
+    def api(self, method, params=None):
+        self.calls.append((method, params))
+        if method == 'get_running_info':
+            return {'last_block': {'block_index': self.height, 'block_hash': self.block_hash(self.height)}}
+        if method == 'get_block_info':
+            if not 0 <= params['block_index'] <= self.height:
+                raise util.RPCError('No such block.')
+            return {'block_index': params['block_index'], 'block_hash': self.block_hash(params['block_index'])}
+        statement, bindings = util.getrows_query(method[4:], **(params or {}))
+        with self.lock:
+            if method[4:] not in self.tables():
+                return []
+            return [dict(row) for row in self.db.execute(statement, bindings)]
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    """Start a `FakeServer` with the given parameters, answer `util.api` and
+       `wallet.api` with it and return it."""
+    def start(**params):
+        server = FakeServer(**params)
+        monkeypatch.setattr(util, 'api', server.api)
+        monkeypatch.setattr(wallet, 'api', server.api)
+        return server
+    return start
+
+@pytest.fixture
+def stub_rpc():
+    """Start a `stubrpc.StubServer` over a `SyntheticWallet` built with the
+       given parameters and return it; its URL is `server.url`."""
+    def start(**wallet_params):
+        server = stubrpc.StubServer(stubrpc.SyntheticWallet(**wallet_params))
+        server.url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+    servers = []
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,54 @@
+import json
+import random
+
+import apsw
+
+from counterpartycli import analyze, cassette, util
+
+ACCESS_LOG_LINE = '127.0.0.1 - - [18/Oct/2016 10:00:00] "GET /rest/Balances/get?address=1Fo%2Bo&asset=XCP&asset=PEPE&op=or HTTP/1.1" 200 -'
+
+def write_requests(path, count):
+    with open(path, 'w') as f:
+        for i in range(count):
+            f.write(json.dumps({'method': 'get_balances', 'params': {'offset': i}}) + '\n')
+            f.write('not a request\n')
+
+def test_load_requests_sample(tmpdir):
+    path = str(tmpdir.join('requests.log'))
+    write_requests(path, 1000)
+    random.seed(1)
+    requests = analyze.load_requests(path, sample_size=50)
+    offsets = [params['offset'] for table, params in requests]
+    assert len(set(offsets)) == 50
+    assert {table for table, params in requests} == {'balances'}
+    assert max(offsets) > 500
+
+def test_load_requests_all(tmpdir):
+    path = str(tmpdir.join('requests.log'))
+    write_requests(path, 10)
+    requests = analyze.load_requests(path, sample_size=50)
+    assert [params['offset'] for table, params in requests] == list(range(10))
+
+def test_cassette_entries():
+    single = cassette.request_key('http://host/', json.dumps({'method': 'get_balances', 'params': {'limit': 10}}))
+    batch = cassette.request_key('http://host/', json.dumps([{'method': 'get_balances', 'params': {}}]))
+    assert analyze.parse_request(json.dumps({'key': single, 'response': '[]'})) == ('balances', {'limit': 10})
+    assert analyze.parse_request(json.dumps({'key': batch, 'response': '[]'})) is None
+
+def test_rest_request_as_server():
+    table, params = analyze.parse_request(ACCESS_LOG_LINE)
+    # The server's `handle_rest` filters on the first value of each argument, as strings.
+    assert util.getrows_query(table, **params) == (
+        'SELECT * FROM balances WHERE (address == ? OR asset == ?) LIMIT 1000', ['1Fo+o', 'XCP'])
+
+def test_index_suggested_from_access_log(tmpdir):
+    path = str(tmpdir.join('access.log'))
+    with open(path, 'w') as f:
+        f.write('127.0.0.1 - - [18/Oct/2016 10:00:00] "GET /rest/balances/get?address=1Foo HTTP/1.1" 200 -\n')
+    db = apsw.Connection(':memory:')
+    # Rows as dicts, as with the server's connection.
+    db.setrowtrace(lambda cursor, row: {name: value for (name, type_), value in zip(cursor.getdescription(), row)})
+    db.cursor().execute('CREATE TABLE balances (address TEXT, asset TEXT, quantity INTEGER)')
+    assert list(analyze.analyze(db, request_file=path)) == ['balances_address_idx']
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
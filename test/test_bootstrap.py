@@ -0,0 +1,84 @@
+import io
+import gzip
+import hashlib
+import tarfile
+
+import pytest
+
+from counterpartycli import util
+
+def make_tarball(files, members=1):
+    """Return a gzipped tarball of `files` (`{name: content}`), with a
+       `checksums.txt`, split into `members` concatenated gzip members."""
+    checksums = ''.join('{}  {}\n'.format(hashlib.sha256(content).hexdigest(), name) for name, content in files.items())
+    tar_data = io.BytesIO()
+    with tarfile.open(fileobj=tar_data, mode='w') as tar_file:
+        for name, content in list(files.items()) + [('checksums.txt', checksums.encode('utf-8'))]:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar_file.addfile(info, io.BytesIO(content))
+    tar_data = tar_data.getvalue()
+    size = len(tar_data) // members + 1
+    return b''.join(gzip.compress(tar_data[i:i + size]) for i in range(0, len(tar_data), size))
+
+def extract(archive, data_dir):
+    stream = io.BufferedReader(util.GzipStream(io.BytesIO(archive)))
+    return util.extract_stream(stream, str(data_dir))
+
+FILES = {
+    'counterparty.db': bytes(range(256)) * 10000,
+    'counterparty.testnet.db': b'testnet' * 1000
+}
+
+@pytest.mark.parametrize('members', [1, 7])
+def test_round_trip(tmpdir, members):
+    extracted, digests, checksums = extract(make_tarball(FILES, members=members), tmpdir)
+    assert sorted(extracted) == sorted(FILES)
+    util.verify_checksums(digests, checksums)
+    for name, content in FILES.items():
+        assert tmpdir.join(name + '.part').read_binary() == content
+
+def test_truncated_archive(tmpdir):
+    archive = make_tarball(FILES)
+    with pytest.raises((util.BootstrapError, tarfile.TarError)):
+        extract(archive[:len(archive) // 2], tmpdir)
+
+def test_verify_checksums(tmpdir):
+    extracted, digests, checksums = extract(make_tarball(FILES), tmpdir)
+    md5 = {name: hashlib.md5(content).hexdigest() for name, content in FILES.items()}
+    util.verify_checksums(digests, md5)
+
+    with pytest.raises(util.BootstrapError, match='mismatch'):
+        util.verify_checksums(digests, dict(checksums, **{'counterparty.db': '0' * 64}))
+    with pytest.raises(util.BootstrapError, match='No checksum'):
+        util.verify_checksums(digests, {'counterparty.db': checksums['counterparty.db']})
+    with pytest.raises(util.BootstrapError, match='Unknown checksum format'):
+        util.verify_checksums(digests, dict(checksums, **{'counterparty.db': 'abc'}))
+    with pytest.raises(util.BootstrapError, match='No `checksums.txt`'):
+        util.verify_checksums(digests, None)
+
+def test_parse_checksums():
+    content = b'0123abcd  counterparty.db\nABCDEF01 *./counterparty.testnet.db\n\ngarbage\n'
+    assert util.parse_checksums(content) == {'counterparty.db': '0123abcd', 'counterparty.testnet.db': 'abcdef01'}
+
+def test_unsafe_members_skipped(tmpdir):
+    tar_data = io.BytesIO()
+    with tarfile.open(fileobj=tar_data, mode='w') as tar_file:
+        info = tarfile.TarInfo('../escape.db')
+        info.size = 3
+        tar_file.addfile(info, io.BytesIO(b'bad'))
+    extracted, digests, checksums = extract(gzip.compress(tar_data.getvalue()), tmpdir)
+    assert extracted == []
+    assert not tmpdir.join('..', 'escape.db.part').check()
+
+def test_resumable_download_local_file(tmpdir):
+    path = tmpdir.join('archive.tar.gz')
+    path.write_binary(make_tarball(FILES))
+    source = util.ResumableDownload(str(path))
+    try:
+        assert source.total_size == path.size()
+        assert source.read() == path.read_binary()
+    finally:
+        source.close()
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
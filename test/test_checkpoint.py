@@ -0,0 +1,122 @@
+import sqlite3
+
+import apsw
+import pytest
+
+from counterpartylib.lib import blocks, check, database
+from counterpartylib.lib import util as lib_util
+from counterpartycli import checkpoint
+
+UNDOLOG_BLOCKS = 3
+
+def connect(path):
+    """A connection as the lib's, with rows as dicts."""
+    db = apsw.Connection(path)
+    db.setrowtrace(lambda cursor, row: {name: value for (name, type_), value in zip(cursor.getdescription(), row)})
+    return db
+
+def make_database(path):
+    db = connect(path)
+    cursor = db.cursor()
+    cursor.execute('''CREATE TABLE blocks (block_index INTEGER PRIMARY KEY, block_hash TEXT, block_time INTEGER);
+                      CREATE TABLE transactions (tx_index INTEGER PRIMARY KEY, block_index INTEGER, source TEXT, destination TEXT, quantity INTEGER);
+                      CREATE TABLE balances (address TEXT PRIMARY KEY, quantity INTEGER);
+                      CREATE TABLE undolog_block (block_index INTEGER PRIMARY KEY)''')
+    return db
+
+def parse_block(db, block_index, block_time):
+    """Stand-in for the lib's: apply the block's transactions to the
+       balances, keeping an undolog of the last few blocks."""
+    cursor = db.cursor()
+    for tx in list(cursor.execute('SELECT * FROM transactions WHERE block_index = ? ORDER BY tx_index', (block_index,))):
+        if tx['source'] is not None:
+            cursor.execute('UPDATE balances SET quantity = quantity - ? WHERE address = ?', (tx['quantity'], tx['source']))
+        cursor.execute('INSERT OR IGNORE INTO balances VALUES (?, 0)', (tx['destination'],))
+        cursor.execute('UPDATE balances SET quantity = quantity + ? WHERE address = ?', (tx['quantity'], tx['destination']))
+    cursor.execute('INSERT INTO undolog_block VALUES (?)', (block_index,))
+    cursor.execute('DELETE FROM undolog_block WHERE block_index <= ?', (block_index - UNDOLOG_BLOCKS,))
+
+def add_block(db, block_index):
+    cursor = db.cursor()
+    cursor.execute('INSERT INTO blocks VALUES (?, ?, ?)', (block_index, 'hash{}'.format(block_index), 1400000000 + block_index))
+    if block_index == 1:
+        transactions = [(None, 'issuer', 1000)]
+    else:
+        transactions = [('issuer', 'holder{}'.format(block_index % 4), block_index), ('holder{}'.format(block_index % 3), 'issuer', 1)]
+    for source, destination, quantity in transactions:
+        cursor.execute('INSERT INTO transactions (block_index, source, destination, quantity) VALUES (?, ?, ?, ?)', (block_index, source, destination, quantity))
+    with db:
+        parse_block(db, block_index, 1400000000 + block_index)
+
+def full_reparse(db, block_index):
+    """Roll back as the lib does without an undolog: reinitialise, then parse
+       every block again."""
+    with db:
+        cursor = db.cursor()
+        cursor.execute('DELETE FROM transactions WHERE block_index > ?', (block_index,))
+        cursor.execute('DELETE FROM blocks WHERE block_index > ?', (block_index,))
+        cursor.execute('DELETE FROM balances')
+        cursor.execute('DELETE FROM undolog_block')
+        for block in list(cursor.execute('SELECT * FROM blocks ORDER BY block_index')):
+            parse_block(db, block['block_index'], block['block_time'])
+
+def dump(path):
+    db = sqlite3.connect(path)
+    try:
+        return list(db.iterdump())
+    finally:
+        db.close()
+
+@pytest.fixture
+def lib(monkeypatch):
+    calls = []
+    monkeypatch.setattr(blocks, 'parse_block', parse_block, raising=False)
+    monkeypatch.setattr(lib_util, 'CURRENT_BLOCK_INDEX', 0, raising=False)
+    monkeypatch.setattr(check, 'software_version', lambda: calls.append('software_version'), raising=False)
+    monkeypatch.setattr(check, 'asset_conservation', lambda db: calls.append('asset_conservation'), raising=False)
+    monkeypatch.setattr(database, 'update_version', lambda db: calls.append('update_version'), raising=False)
+    return calls
+
+def test_rollback_as_full_reparse(tmpdir, lib):
+    database_path, reparsed_path = str(tmpdir.join('counterparty.db')), str(tmpdir.join('reparsed.db'))
+    db = make_database(database_path)
+    for block_index in range(1, 11):
+        add_block(db, block_index)
+    assert checkpoint.take_checkpoint(database_path)[0] == 10
+    for block_index in range(11, 31):
+        add_block(db, block_index)
+
+    reparsed = connect(reparsed_path)
+    with reparsed.backup('main', db, 'main') as backup:
+        backup.step(-1)
+    full_reparse(reparsed, 20)
+    reparsed.close()
+
+    assert checkpoint.rollback(db, database_path, 20)
+    db.close()
+    assert dump(database_path) == dump(reparsed_path)
+    assert lib == ['software_version', 'asset_conservation', 'update_version']
+
+def test_rollback_within_undolog(tmpdir, lib):
+    database_path = str(tmpdir.join('counterparty.db'))
+    db = make_database(database_path)
+    for block_index in range(1, 11):
+        add_block(db, block_index)
+    checkpoint.take_checkpoint(database_path)
+    for block_index in range(11, 15):
+        add_block(db, block_index)
+    before = dump(database_path)
+    # Blocks 12 to 14 are in the undolog: `blocks.reparse` is quicker.
+    assert not checkpoint.rollback(db, database_path, 11)
+    assert dump(database_path) == before
+    assert lib == []
+    assert checkpoint.rollback(db, database_path, 10)
+
+def test_rollback_without_checkpoint(tmpdir, lib):
+    database_path = str(tmpdir.join('counterparty.db'))
+    db = make_database(database_path)
+    for block_index in range(1, 11):
+        add_block(db, block_index)
+    assert not checkpoint.rollback(db, database_path, 5)
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
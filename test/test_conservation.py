@@ -0,0 +1,93 @@
+import sqlite3
+
+import apsw
+import pytest
+
+from counterpartylib.lib import check, config
+from counterpartylib.lib import util as lib_util
+from counterpartycli import conservation
+
+TABLES = {
+    'issuances': ['asset', 'quantity', 'fee_paid', 'status'],
+    'destructions': ['asset', 'quantity', 'status'],
+    'burns': ['earned', 'status'],
+    'dividends': ['fee_paid', 'status'],
+    'balances': ['address', 'asset', 'quantity'],
+    'orders': ['give_asset', 'give_remaining', 'get_asset', 'status'],
+    'order_matches': ['forward_asset', 'forward_quantity', 'backward_asset', 'backward_quantity', 'status'],
+    'bets': ['wager_remaining', 'status'],
+    'bet_matches': ['forward_quantity', 'backward_quantity', 'status'],
+    'rps': ['wager', 'status'],
+    'rps_matches': ['wager', 'status'],
+    'executions': ['gas_cost', 'gas_remained', 'status'],
+    'dispensers': ['asset', 'give_remaining', 'status'],
+    'sweeps': ['fee_paid', 'status'],
+}
+
+ROWS = {
+    # 1000 XCP burned, 60 paid in fees: 940 held or escrowed.
+    'burns': [(1000, 'valid'), (500, 'invalid')],
+    'issuances': [('FOO', 500, 50, 'valid'), ('FOO', 300, 0, 'valid'), ('FOO', 999, 0, 'invalid'), ('BAR', 10, 0, 'valid')],
+    'dividends': [(10, 'valid'), (20, 'invalid')],
+    # FOO: 800 issued, 100 destroyed; 400 held, 300 in orders and order matches.
+    'destructions': [('FOO', 100, 'valid'), ('FOO', 50, 'invalid')],
+    'balances': [('a', 'XCP', 600), ('b', 'XCP', 70), ('a', 'FOO', 250), ('b', 'FOO', 150), ('b', 'BAR', 10)],
+    'orders': [('XCP', 150, 'FOO', 'open'), ('XCP', 70, 'BTC', 'expired'), ('FOO', 100, 'XCP', 'open')],
+    'order_matches': [('FOO', 200, 'XCP', 30, 'pending'), ('FOO', 80, 'XCP', 40, 'completed')],
+    'bets': [(40, 'open'), (15, 'filled')],
+    'bet_matches': [(5, 5, 'pending')],
+    'rps': [(10, 'open')],
+    'rps_matches': [(10, 'resolved and pending'), (3, 'concluded')],
+    'executions': [(5, 0, 'valid'), (2, 3, 'out of gas')],
+}
+
+def make_database(path):
+    db = sqlite3.connect(path)
+    with db:
+        for table, columns in TABLES.items():
+            db.execute('CREATE TABLE {} ({})'.format(table, ', '.join(columns)))
+        for table, rows in ROWS.items():
+            db.executemany('INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(TABLES[table]), ', '.join(['?'] * len(TABLES[table]))), rows)
+    return db
+
+def lib_connection(path):
+    """A connection as the lib's, with rows as dicts."""
+    db = apsw.Connection(path, flags=apsw.SQLITE_OPEN_READONLY)
+    db.setrowtrace(lambda cursor, row: {name: value for (name, type_), value in zip(cursor.getdescription(), row)})
+    return db
+
+@pytest.fixture
+def database(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'XCP', 'XCP', raising=False)
+    path = str(tmpdir.join('counterparty.db'))
+    make_database(path).close()
+    return path
+
+def test_totals_as_lib(database):
+    totals = conservation.check_assets(database, conservation.list_assets(database))
+    assert totals == {'XCP': (940, 940), 'FOO': (700, 700), 'BAR': (10, 10)}
+    db = lib_connection(database)
+    try:
+        held = lib_util.held(db)
+        assert {asset: supply for asset, (supply, held_) in totals.items()} == lib_util.supplies(db)
+        assert {asset: held_ for asset, (supply, held_) in totals.items()} == {asset: held.get(asset) or 0 for asset in totals}
+        check.asset_conservation(db)
+    finally:
+        db.close()
+    assert conservation.check(database, workers=2) == {}
+
+def test_discrepancy_as_lib(database, capsys):
+    db = sqlite3.connect(database)
+    with db:
+        db.execute('''UPDATE balances SET quantity = quantity + 5 WHERE address = 'a' AND asset = 'FOO' ''')
+    db.close()
+    assert conservation.check(database, workers=2) == {'FOO': (700, 705)}
+    assert 'FOO' in capsys.readouterr().out
+    db = lib_connection(database)
+    try:
+        with pytest.raises(check.SanityError, match='FOO'):
+            check.asset_conservation(db)
+    finally:
+        db.close()
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,65 @@
+import io
+import json
+
+import pytest
+
+from counterpartycli import deposits
+
+def block_credits(block_index, branch):
+    """Credits to two addresses in each block."""
+    return {'credits': [{'block_index': block_index, 'address': address, 'asset': 'XCP', 'quantity': block_index,
+                         'event': '{}{}'.format(branch, block_index)} for address in ('deposit', 'other')]}
+
+@pytest.fixture
+def server(fake_server):
+    return fake_server(height=120, block_rows=block_credits, branch='a')
+
+def credits(output):
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+def test_cursor(tmpdir):
+    path = str(tmpdir.join('cursor'))
+    assert deposits.read_cursor(path) == []
+    deposits.write_cursor(path, [(20, 'h20'), (10, 'h10')])
+    assert deposits.read_cursor(path) == [(20, 'h20'), (10, 'h10')]
+    with open(path, 'w') as f:
+        json.dump({'block_index': 30}, f)
+    assert deposits.read_cursor(path) == [(30, None)]
+
+def test_scan_pages_by_rowid(server):
+    found = list(deposits.scan(frozenset(['deposit']), 10, 19))
+    assert [credit['block_index'] for credit in found] == list(range(10, 20))
+    assert {params['order_by'] for method, params in server.calls} == {'rowid'}
+
+def test_watch_confirmed_blocks(server, tmpdir):
+    path = str(tmpdir.join('cursor'))
+    output = io.StringIO()
+    deposits.watch(frozenset(['deposit']), path, output=output, start_block=1, once=True)
+    assert [credit['block_index'] for credit in credits(output)] == list(range(1, 116))
+    assert deposits.read_cursor(path)[:2] == [(115, 'a115'), (100, 'a100')]
+
+    server.extend(125, branch='a')
+    output = io.StringIO()
+    deposits.watch(frozenset(['deposit']), path, output=output, once=True)
+    assert [credit['block_index'] for credit in credits(output)] == list(range(116, 121))
+
+def test_watch_rescans_after_reorg(server, tmpdir, caplog):
+    path = str(tmpdir.join('cursor'))
+    deposits.watch(frozenset(['deposit']), path, output=io.StringIO(), start_block=1, confirmations=1, once=True)
+    assert deposits.read_cursor(path)[:2] == [(120, 'a120'), (100, 'a100')]
+
+    server.extend(121, start_block=110, branch='b')
+    output = io.StringIO()
+    deposits.watch(frozenset(['deposit']), path, output=output, confirmations=1, once=True)
+    assert 'reorganised' in caplog.text
+    assert [credit['event'] for credit in credits(output)] == \
+        ['a{}'.format(block_index) for block_index in range(101, 110)] + ['b{}'.format(block_index) for block_index in range(110, 122)]
+    assert deposits.read_cursor(path)[:2] == [(121, 'b121'), (100, 'a100')]
+
+def test_watch_no_common_block(server, tmpdir):
+    path = str(tmpdir.join('cursor'))
+    deposits.write_cursor(path, [(50, 'x50'), (40, 'x40')])
+    with pytest.raises(deposits.DepositsError):
+        deposits.watch(frozenset(['deposit']), path, output=io.StringIO(), once=True)
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,81 @@
+import io
+import os
+
+import pytest
+
+from counterpartycli import download, util
+
+CONTENT = os.urandom(1000003)
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(download.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(util.time, 'sleep', lambda seconds: None)
+
+def test_probe(file_server):
+    server = file_server(CONTENT)
+    assert download.probe(server.url) == (len(CONTENT), True)
+    server.accept_ranges = False
+    assert download.probe(server.url) == (len(CONTENT), False)
+
+def test_segmented_download(tmpdir, file_server):
+    server = file_server(CONTENT)
+    path = str(tmpdir.join('archive'))
+    download.segmented_download(server.url, path, len(CONTENT), workers=4, segment_size=100000)
+    assert open(path, 'rb').read() == CONTENT
+    assert sorted(server.ranges) == [(start, min(start + 100000, len(CONTENT)) - 1) for start in range(0, len(CONTENT), 100000)]
+
+def test_segment_retries_resume(tmpdir, file_server):
+    server = file_server(CONTENT)
+    server.failures, server.cut_after = 3, 12345
+    path = str(tmpdir.join('archive'))
+    download.segmented_download(server.url, path, len(CONTENT), workers=1, segment_size=len(CONTENT))
+    assert open(path, 'rb').read() == CONTENT
+    # Each retry asks for the rest of the segment only.
+    assert server.ranges == [(12345 * i, len(CONTENT) - 1) for i in range(4)]
+
+def test_segment_retries_exhausted(tmpdir, file_server):
+    server = file_server(CONTENT)
+    server.failures, server.cut_after = 10, 10
+    path = str(tmpdir.join('archive'))
+    with pytest.raises(download.DownloadError, match='failed'):
+        download.segmented_download(server.url, path, len(CONTENT), workers=2, segment_size=len(CONTENT), retries=2)
+    assert len(server.ranges) == 3
+
+def test_segment_without_ranges(tmpdir, file_server):
+    server = file_server(CONTENT)
+    server.accept_ranges = False
+    with pytest.raises(download.DownloadError):
+        download.segmented_download(server.url, str(tmpdir.join('archive')), len(CONTENT), workers=1, retries=0)
+
+def test_resumable_download(file_server):
+    server = file_server(CONTENT)
+    server.failures, server.cut_after = 2, 54321
+    source = util.ResumableDownload(server.url)
+    try:
+        assert source.read() == CONTENT
+    finally:
+        source.close()
+    assert server.ranges == [(0, len(CONTENT) - 1), (54321, len(CONTENT) - 1), (108642, len(CONTENT) - 1)]
+
+def test_progress_eta_past_a_day():
+    stream = io.StringIO()
+    progress = download.Progress(total_size=10 ** 9, stream=stream)
+    progress.done = 10 ** 6
+    progress.display(progress.start_time + 100)
+    # 999 MB at 10 kB/s.
+    assert stream.getvalue().endswith('ETA 1d 03h 45m')
+
+@pytest.mark.parametrize('error', [download.DownloadError('failed'), KeyboardInterrupt()])
+def test_bootstrap_removes_partial_download(tmpdir, file_server, monkeypatch, error):
+    server = file_server(CONTENT)
+    monkeypatch.setattr(util.appdirs, 'user_data_dir', lambda **kwargs: str(tmpdir))
+    def segmented_download(url, path, size, workers=1, progress=None):
+        open(path, 'wb').close()
+        raise error
+    monkeypatch.setattr(download, 'segmented_download', segmented_download)
+    with pytest.raises(type(error)):
+        util.bootstrap(url=server.url, workers=2, quiet=True)
+    assert tmpdir.listdir() == []
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
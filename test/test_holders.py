@@ -0,0 +1,94 @@
+import pytest
+
+from counterpartylib.lib import config
+from counterpartycli import holders, util
+
+def validate_quantity(address_quantity, quantity_per_unit, divisible, dividend_divisible):
+    """The computation of `dividend.validate`, in counterparty-lib."""
+    dividend_quantity = address_quantity * quantity_per_unit
+    if divisible: dividend_quantity /= config.UNIT
+    if not dividend_divisible: dividend_quantity /= config.UNIT
+    return int(dividend_quantity)
+
+@pytest.fixture
+def server(monkeypatch, fake_server):
+    monkeypatch.setattr(config, 'TESTNET', False, raising=False)
+    monkeypatch.setattr(config, 'DEFAULT_MULTISIG_DUST_SIZE', 7800, raising=False)
+    monkeypatch.setitem(util.DIVISIBILITY, 'DIVISIBLE', True)
+    monkeypatch.setitem(util.DIVISIBILITY, 'NONDIVISIBLE', False)
+    balances = [
+        {'address': 'issuer', 'asset': 'DIVISIBLE', 'quantity': 50 * config.UNIT},
+        {'address': 'holder1', 'asset': 'DIVISIBLE', 'quantity': 3 * config.UNIT + 1},
+        {'address': 'holder2', 'asset': 'DIVISIBLE', 'quantity': 12345},
+        {'address': 'empty', 'asset': 'DIVISIBLE', 'quantity': 0},
+        {'address': 'holder1', 'asset': 'NONDIVISIBLE', 'quantity': 7},
+        {'address': 'holder2', 'asset': 'NONDIVISIBLE', 'quantity': 3},
+    ]
+    orders = [{'source': 'holder2', 'give_asset': 'DIVISIBLE', 'give_remaining': config.UNIT, 'status': 'open'}]
+    credits = [
+        {'address': 'issuer', 'asset': 'DIVISIBLE', 'quantity': 60 * config.UNIT, 'block_index': 290000},
+        {'address': 'holder1', 'asset': 'DIVISIBLE', 'quantity': 2 * config.UNIT, 'block_index': 295000},
+        {'address': 'empty', 'asset': 'DIVISIBLE', 'quantity': config.UNIT, 'block_index': 295000},
+    ]
+    debits = [
+        {'address': 'issuer', 'asset': 'DIVISIBLE', 'quantity': 3 * config.UNIT, 'block_index': 295000},
+        {'address': 'empty', 'asset': 'DIVISIBLE', 'quantity': config.UNIT, 'block_index': 295000},
+    ]
+    return fake_server(height=500000, tables={'balances': balances, 'orders': orders, 'credits': credits, 'debits': debits})
+
+def test_aggregator_spills():
+    aggregator = holders.Aggregator(max_in_memory=2)
+    try:
+        for address, quantity, dividend in [('a', 1, 0), ('b', 5, 1), ('a', 2, 1), ('c', 4, 0), ('b', -1, 2)]:
+            aggregator.add(address, quantity, dividend)
+        assert aggregator.db is not None
+        assert list(aggregator) == [('b', 4, 3), ('c', 4, 0), ('a', 3, 1)]
+    finally:
+        aggregator.close()
+
+def test_dividend_quantity_rounds_as_validate():
+    for quantity, quantity_per_unit in [(3553260803050964942, 56448163), (3 * config.UNIT + 1, config.UNIT // 3), (12345, 1)]:
+        for divisible in (True, False):
+            for dividend_divisible in (True, False):
+                assert int(holders.dividend_quantity(quantity, quantity_per_unit, divisible, dividend_divisible)) == \
+                    validate_quantity(quantity, quantity_per_unit, divisible, dividend_divisible)
+
+def test_dividend_to_current_holders(server):
+    holdings = holders.holders('DIVISIBLE', quantity_per_unit=config.UNIT // 10, source='issuer')
+    dividends = {address: dividend for address, quantity, dividend in holdings}
+    assert dividends == {
+        'issuer': 0,
+        'holder1': validate_quantity(3 * config.UNIT + 1, config.UNIT // 10, True, True),
+        # The balance and the escrowed quantity are paid, and rounded down, separately.
+        'holder2': validate_quantity(12345, config.UNIT // 10, True, True) + validate_quantity(config.UNIT, config.UNIT // 10, True, True),
+    }
+    assert holdings.summary['dividend_total'] == sum(dividends.values())
+    # holder1, holder2 and the empty balance, but not the source.
+    assert holdings.summary['fee'] == int(0.0002 * config.UNIT * 3)
+    assert holdings.summary['holders'] == 3
+
+def test_nondivisible_dividend(server):
+    holdings = holders.holders('NONDIVISIBLE', quantity_per_unit=config.UNIT, dividend_asset='NONDIVISIBLE')
+    assert {address: dividend for address, quantity, dividend in holdings} == {'holder1': 7, 'holder2': 3}
+
+def test_btc_dividend_dust(server):
+    holdings = holders.holders('NONDIVISIBLE', quantity_per_unit=2000, dividend_asset=config.BTC)
+    assert {address: dividend for address, quantity, dividend in holdings} == {'holder1': 14000, 'holder2': 0}
+    assert holdings.summary['fee'] == 0
+
+def test_dividend_before_protocol_changes(server):
+    holdings = holders.holders('DIVISIBLE', block_index=295000, quantity_per_unit=config.UNIT, source='issuer')
+    dividends = {address: dividend for address, quantity, dividend in holdings}
+    # Before block 296000 the source is paid too, and before block 330000 there is no fee.
+    assert dividends == {'issuer': 57 * config.UNIT, 'holder1': 2 * config.UNIT}
+    assert holdings.summary['dividend_total'] == 59 * config.UNIT
+    assert holdings.summary['fee'] == 0
+
+def test_fee_at_past_block(server):
+    server.db.execute('UPDATE credits SET block_index = 340000 WHERE rowid = 1')
+    holdings = holders.holders('DIVISIBLE', block_index=340000, quantity_per_unit=config.UNIT, source='issuer')
+    assert {address for address, quantity, dividend in holdings} == {'issuer', 'holder1'}
+    # holder1 and the emptied address.
+    assert holdings.summary['fee'] == int(0.0002 * config.UNIT * 2)
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,164 @@
+import os
+import struct
+import binascii
+import multiprocessing
+
+import pytest
+
+from counterpartylib import server
+from counterpartylib.lib import blocks, config
+from counterpartylib.lib import util as lib_util
+from counterpartylib.lib.kickstart import blocks_parser
+from counterpartycli import kickstart, txparse
+
+pytestmark = pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+    reason='the workers must inherit the stand-in decoder')
+
+def compact_size(n):
+    if n < 0xfd:
+        return bytes([n])
+    return b'\xfd' + struct.pack('<H', n)
+
+def var_int(n):
+    """Bitcoin's VARINT, as read by `BCDataStream.read_var_int`."""
+    data = [n & 0x7f]
+    while n > 0x7f:
+        n = (n >> 7) - 1
+        data.insert(0, (n & 0x7f) | 0x80)
+    return bytes(data)
+
+def make_tx(prevout_hash, outputs):
+    tx = struct.pack('<i', 1) + compact_size(1)
+    tx += prevout_hash + struct.pack('<I', 0) + compact_size(0) + struct.pack('<I', 0xffffffff)
+    tx += compact_size(len(outputs))
+    for value, script in outputs:
+        tx += struct.pack('<q', value) + compact_size(len(script)) + script
+    return tx + struct.pack('<I', 0)
+
+PAY = b'\x76\xa9\x14' + b'\x11' * 20 + b'\x88\xac'
+
+def data_output(data):
+    return 0, bytes([txparse.OP_RETURN, len(data)]) + data
+
+class FakeLevelDB(dict):
+
+    def close(self):
+        pass
+
+def make_chain(directory, length=40, blocks_per_file=15):
+    """Write `length` blocks to block files in `directory`; every third block
+       has a transaction carrying data and spending one of an earlier block.
+       Return the block index and the hashes of the blocks."""
+    ldb = FakeLevelDB()
+    hashes = []
+    previous = b'\x00' * 32
+    spendable = None
+    files = {}
+    for height in range(length):
+        transactions = [make_tx(b'\x00' * 32, [(50, PAY)])]
+        if spendable is not None and height % 3 == 0:
+            transactions.append(make_tx(spendable, [data_output(('block %d' % height).encode()), (10, PAY)]))
+        transactions.append(make_tx(struct.pack('<I', height) * 8, [(20, PAY)]))
+        spendable = txparse.dhash(transactions[-1])
+
+        header = struct.pack('<i', 1) + previous + b'\x00' * 32 + struct.pack('<III', 1400000000 + height, 0, height)
+        body = compact_size(len(transactions))
+        file_num = height // blocks_per_file
+        content = files.setdefault(file_num, bytearray())
+        position = len(content) + 8
+        for tx in transactions:
+            ldb[b't' + txparse.dhash(tx)] = var_int(file_num) + var_int(position) + var_int(len(body))
+            body += tx
+        block = header + body
+        content += struct.pack('<iI', 0x0b110907, len(block)) + block
+
+        previous = txparse.dhash(header)
+        ldb[b'b' + previous] = var_int(1) + var_int(height) + var_int(0) + var_int(len(transactions)) + \
+            var_int(file_num) + var_int(position) + var_int(0) + header
+        hashes.append(txparse.hex_hash(previous))
+    ldb[b'B'] = previous # the chainstate's best block
+
+    os.makedirs(os.path.join(directory, 'blocks', 'index'))
+    for file_num, content in files.items():
+        with open(os.path.join(directory, 'blocks', 'blk%05d.dat' % file_num), 'wb') as f:
+            f.write(bytes(content))
+    return ldb, hashes
+
+def get_tx_info(tx_hex, block_parser=None, block_index=None):
+    """Stand-in for the lib's decoder: the source of a transaction carrying
+       data is looked up, as in `blocks.get_tx_info`."""
+    tx, offset = txparse.parse_tx(binascii.unhexlify(tx_hex))
+    data = [script[2:] for value, script in tx['vout'] if script[0] == txparse.OP_RETURN]
+    if not data:
+        return b'', None, None, None, None
+    prevout = block_parser.read_raw_transaction(txparse.hex_hash(tx['vin'][0][0]))
+    return prevout['tx_hash'], None, None, None, data[0]
+
+def read_chain(db, bitcoind_dir=None, skip=None):
+    """Read the blocks as `blocks.kickstart` does, from the last one back to
+       the first, skipping the block at height `skip`."""
+    parser = blocks.BlockchainParser(os.path.join(bitcoind_dir, 'blocks'), os.path.join(bitcoind_dir, 'blocks', 'index'))
+    decoded = []
+    current_hash = db['last_hash']
+    while current_hash:
+        block = parser.read_raw_block(current_hash)
+        for tx in block['transactions']:
+            decoded.append((block['block_index'], tx['tx_hash'], blocks.get_tx_info(tx['__data__'], block_parser=parser, block_index=block['block_index'])))
+        current_hash = block['hash_prev'] if current_hash != db['first_hash'] else None
+        if skip is not None and block['block_index'] == skip + 1:
+            current_hash = db['hashes'][skip - 1]
+    parser.close()
+    return decoded
+
+@pytest.fixture
+def chain(tmpdir, monkeypatch):
+    ldb, hashes = make_chain(str(tmpdir))
+    monkeypatch.setattr(blocks_parser, 'open_leveldb', lambda leveldb_dir: ldb)
+    monkeypatch.setattr(blocks, 'BlockchainParser', blocks_parser.BlockchainParser, raising=False)
+    monkeypatch.setattr(blocks, 'get_tx_info', get_tx_info, raising=False)
+    monkeypatch.setattr(server, 'kickstart', read_chain, raising=False)
+    monkeypatch.setattr(lib_util, 'CURRENT_BLOCK_INDEX', 0, raising=False)
+    monkeypatch.setattr(config, 'TESTNET', False, raising=False)
+    monkeypatch.setattr(config, 'BLOCK_FIRST_MAINNET_HASH', hashes[0], raising=False)
+    for name in kickstart.bulktx.PARSER_SETTINGS:
+        monkeypatch.setattr(config, name, getattr(config, name, None), raising=False)
+    return {'path': str(tmpdir), 'hashes': hashes, 'first_hash': hashes[0], 'last_hash': hashes[-1]}
+
+def test_workers_decode_as_writer(chain, caplog):
+    sequential = kickstart.kickstart(chain, bitcoind_dir=chain['path'])
+    assert len(sequential) == 40 * 2 + 13
+    assert sum(1 for block_index, tx_hash, info in sequential if info[4] is not None) == 13
+
+    parallel = kickstart.kickstart(chain, bitcoind_dir=chain['path'], workers=3)
+    assert parallel == sequential
+    assert 'not read ahead' not in caplog.text
+    assert blocks.get_tx_info is get_tx_info
+    assert blocks.BlockchainParser is blocks_parser.BlockchainParser
+
+def test_data_transactions_deferred_to_writer(chain):
+    parser = kickstart.PrefetchingParser(os.path.join(chain['path'], 'blocks'), None, 2)
+    try:
+        block = parser.read_raw_block(chain['last_hash'])
+        assert block['block_index'] == 39
+        assert len(block['transactions']) == 3
+        assert len(parser.tx_infos) == 2
+    finally:
+        parser.close()
+
+def test_chain_height(chain, monkeypatch, caplog):
+    assert kickstart.chain_height(chain['path']) == 39
+    def open_leveldb(leveldb_dir):
+        raise Exception('Ensure that bitcoind is stopped.')
+    monkeypatch.setattr(blocks_parser, 'open_leveldb', open_leveldb)
+    assert kickstart.chain_height(chain['path']) is None
+    assert 'bitcoind is stopped' in caplog.text
+
+def test_unexpected_block_read_without_workers(chain, monkeypatch, caplog):
+    sequential = read_chain(chain, chain['path'], skip=20)
+    monkeypatch.setattr(server, 'kickstart', lambda db, bitcoind_dir=None: read_chain(db, bitcoind_dir, skip=20))
+    decoded = kickstart.kickstart(chain, bitcoind_dir=chain['path'], workers=2)
+    assert decoded == sequential
+    assert 'not read ahead' in caplog.text
+    assert 20 not in [block_index for block_index, tx_hash, info in decoded]
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
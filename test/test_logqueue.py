@@ -0,0 +1,76 @@
+import sys
+import json
+import logging
+
+import pytest
+
+from counterpartylib.lib import api
+from counterpartycli import logqueue
+
+def make_record(exc_info=None):
+    return logging.LogRecord('counterpartylib.lib.blocks', logging.ERROR, __file__, 1, 'Block %s: %s', (100, 'invalid'), exc_info)
+
+def exc_info():
+    try:
+        raise ValueError('bad transaction')
+    except ValueError:
+        return sys.exc_info()
+
+def test_json_formatter():
+    entry = json.loads(logqueue.JSONFormatter().format(make_record()))
+    assert entry == {'time': entry['time'], 'level': 'ERROR', 'logger': 'counterpartylib.lib.blocks', 'message': 'Block 100: invalid'}
+    entry = json.loads(logqueue.JSONFormatter().format(make_record(exc_info())))
+    assert entry['exception'].startswith('Traceback (most recent call last):')
+    assert entry['exception'].endswith('ValueError: bad transaction')
+
+def test_queued_record_keeps_traceback():
+    handler = logqueue.QueueingHandler(None, ())
+    record = handler.prepare(make_record(exc_info()))
+    assert (record.msg, record.args, record.exc_info) == ('Block 100: invalid', None, None)
+    entry = json.loads(logqueue.JSONFormatter().format(record))
+    assert entry['message'] == 'Block 100: invalid'
+    assert entry['exception'].endswith('ValueError: bad transaction')
+
+@pytest.fixture
+def file_logger(tmpdir, monkeypatch):
+    path = str(tmpdir.join('server.log'))
+    logger = logging.getLogger('test_logqueue')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    handler = logging.FileHandler(path)
+    logger.addHandler(handler)
+    # `set_up` patches the API server and registers the writer to stop at exit.
+    monkeypatch.setattr(api, 'init_api_access_log', getattr(api, 'init_api_access_log', None), raising=False)
+    monkeypatch.setattr(logqueue.atexit, 'register', lambda func: None)
+    monkeypatch.setattr(logqueue, 'WRITER', None)
+    yield logger, path
+    for queued in list(logger.handlers):
+        logger.removeHandler(queued)
+    handler.close()
+
+def test_records_flushed_when_writer_stops(file_logger):
+    logger, path = file_logger
+    logqueue.set_up(logger, queued=True, json_format=True)
+    assert logqueue.file_handlers(logger) == []
+    assert logqueue.QueueingHandler in [type(handler) for handler in logger.handlers]
+    for i in range(logqueue.BATCH_SIZE + 10):
+        logger.info('Record %d.', i)
+    try:
+        raise ValueError('bad transaction')
+    except ValueError:
+        logger.exception('Last record.')
+    logqueue.WRITER.stop()
+    assert not logqueue.WRITER.is_alive()
+
+    entries = [json.loads(line) for line in open(path)]
+    assert [entry['message'] for entry in entries] == ['Record {}.'.format(i) for i in range(logqueue.BATCH_SIZE + 10)] + ['Last record.']
+    assert entries[-1]['exception'].endswith('ValueError: bad transaction')
+
+def test_json_without_queue(file_logger):
+    logger, path = file_logger
+    logqueue.set_up(logger, json_format=True)
+    assert logqueue.WRITER is None
+    logger.warning('Direct.')
+    assert json.loads(open(path).read())['message'] == 'Direct.'
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
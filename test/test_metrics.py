@@ -0,0 +1,104 @@
+import pytest
+
+from counterpartylib.lib import api, config
+from counterpartylib.lib import util as lib_util
+from counterpartycli import metrics
+
+class Clock:
+    """`time` for the metrics, advanced by the stand-in handlers."""
+
+    def __init__(self):
+        self.now = 1000
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(metrics, 'time', clock)
+    monkeypatch.setattr(config, 'MEMPOOL_BLOCK_INDEX', 9999999, raising=False)
+    monkeypatch.setattr(api, 'API_TABLES', ['balances', 'sends'], raising=False)
+    monkeypatch.setattr(lib_util, 'CURRENT_BLOCK_INDEX', 500000, raising=False)
+    return clock
+
+def test_histogram_buckets():
+    histogram = metrics.Histogram('latency_seconds', 'Latency.', (0.01, 0.1, 1), ('method',))
+    for value in (0.005, 0.01, 0.05, 2):
+        histogram.observe(value, 'get_balances')
+    histogram.observe(0.5, 'get_"sends"')
+    assert histogram.render() == [
+        '# HELP latency_seconds Latency.',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{method="get_\\"sends\\"",le="0.01"} 0',
+        'latency_seconds_bucket{method="get_\\"sends\\"",le="0.1"} 0',
+        'latency_seconds_bucket{method="get_\\"sends\\"",le="1"} 1',
+        'latency_seconds_bucket{method="get_\\"sends\\"",le="+Inf"} 1',
+        'latency_seconds_sum{method="get_\\"sends\\""} 0.5',
+        'latency_seconds_count{method="get_\\"sends\\""} 1',
+        # Cumulative: each bucket counts the values at or under its bound.
+        'latency_seconds_bucket{method="get_balances",le="0.01"} 2',
+        'latency_seconds_bucket{method="get_balances",le="0.1"} 3',
+        'latency_seconds_bucket{method="get_balances",le="1"} 3',
+        'latency_seconds_bucket{method="get_balances",le="+Inf"} 4',
+        'latency_seconds_sum{method="get_balances"} 2.065',
+        'latency_seconds_count{method="get_balances"} 4',
+    ]
+
+def test_render(clock):
+    m = metrics.Metrics()
+    m.backend_height = 500003
+
+    def parse_block(db, block_index, block_time):
+        clock.now += 2
+    parse_block = m.wrap_parse_block(parse_block)
+    for block_index in range(499998, 500001):
+        parse_block(None, block_index, 0)
+    parse_block(None, config.MEMPOOL_BLOCK_INDEX, 0)
+
+    def handle(request_str, dispatcher):
+        clock.now += 0.02
+    handle = m.wrap_handle(handle)
+    handle('{"method": "get_balances", "params": {}}', {'get_balances': None})
+    handle('{"method": "drop_tables"}', {'get_balances': None})
+    handle('not json', {'get_balances': None})
+
+    lines = m.render().splitlines()
+    for line in [
+        '# TYPE counterparty_last_block gauge', 'counterparty_last_block 500000',
+        'counterparty_backend_height 500003', 'counterparty_block_lag 3',
+        'counterparty_blocks_per_second 0.05',
+        '# TYPE counterparty_blocks_parsed_total counter', 'counterparty_blocks_parsed_total 3',
+        'counterparty_sqlite_busy_total 0',
+        'counterparty_api_requests_total{method="get_balances"} 1',
+        # Methods the server doesn't have, and requests it can't read.
+        'counterparty_api_requests_total{method="unknown"} 2',
+        'counterparty_block_parse_duration_seconds_bucket{le="2.5"} 3',
+        'counterparty_block_parse_duration_seconds_bucket{le="1"} 0',
+        'counterparty_block_parse_duration_seconds_count 3',
+    ]:
+        assert line in lines
+    # No series for the mempool until a mempool transaction is parsed.
+    assert not [line for line in lines if line.startswith('counterparty_mempool_tx_parse_duration_seconds_count')]
+
+    clock.now += metrics.RATE_WINDOW
+    assert 'counterparty_blocks_per_second 0.0' in m.render().splitlines()
+
+def test_rest_requests_counted(clock):
+    m = metrics.Metrics()
+    app = type('App', (), {})()
+    def wsgi_app(environ, start_response):
+        clock.now += 0.2
+        return [b'[]']
+    app.wsgi_app = wsgi_app
+    m.wrap_init_api_access_log(lambda app: None)(app)
+
+    for path in ('/rest/Balances/get', '/rest/sends/get', '/rest/secrets/get', '/rest/balances', '/'):
+        assert app.wsgi_app({'PATH_INFO': path}, None) == [b'[]']
+    lines = m.render().splitlines()
+    assert 'counterparty_api_requests_total{method="get_balances"} 1' in lines
+    assert 'counterparty_api_requests_total{method="get_sends"} 1' in lines
+    assert 'counterparty_api_requests_total{method="unknown"} 2' in lines
+    assert 'counterparty_api_request_duration_seconds_bucket{method="get_sends",le="0.25"} 1' in lines
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,57 @@
+import logging
+import sqlite3
+
+import pytest
+
+from counterpartycli import mirror, util
+
+def block_credits(block_index, branch):
+    """Three credits in each block but the first, all with the same `block_index`."""
+    return {'credits': [] if block_index == 0 else [{'block_index': block_index, 'address': 'address{}'.format(i), 'quantity': block_index * 10 + i} for i in range(3)]}
+
+@pytest.fixture
+def server(fake_server):
+    return fake_server(height=10, block_rows=block_credits)
+
+def test_sync_pages_rows_of_a_block(server, tmpdir, monkeypatch):
+    api_pages = util.api_pages
+    monkeypatch.setattr(util, 'api_pages', lambda method, params: api_pages(method, params, page_size=2))
+    path = str(tmpdir.join('mirror.db'))
+    assert mirror.sync(path, tables=['credits'], start_block=1) == 10
+    db = sqlite3.connect(path)
+    quantities = [row[0] for row in db.execute('SELECT quantity FROM credits ORDER BY quantity')]
+    assert quantities == [block_index * 10 + i for block_index in range(1, 11) for i in range(3)]
+
+def test_use_current_mirror(server, tmpdir):
+    path = str(tmpdir.join('mirror.db'))
+    mirror.sync(path, tables=['credits'], start_block=1)
+    server.db.execute('DELETE FROM credits')
+    mirror.use(path)
+    assert len(util.api('get_credits', {'filters': [('address', '==', 'address0')]})) == 10
+    assert util.api('get_running_info')['last_block']['block_index'] == 10
+
+def test_use_mirror_within_lag(server, tmpdir, caplog):
+    caplog.set_level(logging.INFO)
+    path = str(tmpdir.join('mirror.db'))
+    mirror.sync(path, tables=['credits'], start_block=1)
+    server.extend(10 + mirror.DEFAULT_MAX_LAG)
+    mirror.use(path)
+    assert len(util.api('get_credits', {'filters': [('address', '==', 'address0')]})) == 10
+    assert '{} blocks behind'.format(mirror.DEFAULT_MAX_LAG) in caplog.text
+
+@pytest.mark.parametrize('height, max_lag', [(10 + mirror.DEFAULT_MAX_LAG + 1, mirror.DEFAULT_MAX_LAG), (11, 0)])
+def test_use_mirror_behind(server, tmpdir, caplog, height, max_lag):
+    path = str(tmpdir.join('mirror.db'))
+    mirror.sync(path, tables=['credits'], start_block=1)
+    server.extend(height)
+    mirror.use(path, max_lag=max_lag)
+    assert len(util.api('get_credits', {'filters': [('address', '==', 'address0')]})) == height
+    assert 'answering from the server' in caplog.text
+
+def test_use_missing_mirror(server, tmpdir):
+    path = str(tmpdir.join('mirror.db'))
+    with pytest.raises(mirror.MirrorError):
+        mirror.use(path)
+    assert not tmpdir.join('mirror.db').check()
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,34 @@
+import argparse
+
+from counterpartycli import profiler
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='counterparty-client')
+    profiler.add_arguments(parser, 'counterparty-client')
+    subparsers = parser.add_subparsers(dest='action')
+    subparsers.add_parser('wallet')
+    return parser
+
+def test_profile_does_not_take_the_action():
+    args = make_parser().parse_args(['--profile', 'wallet'])
+    assert args.profile is True
+    assert args.action == 'wallet'
+    assert args.profile_file == 'counterparty-client.prof'
+
+def test_profile_file():
+    args = make_parser().parse_args(['--profile', '--profile-file', '/tmp/wallet.prof', 'wallet'])
+    assert args.profile is True
+    assert args.profile_file == '/tmp/wallet.prof'
+    assert args.action == 'wallet'
+
+def test_no_profile():
+    args = make_parser().parse_args(['wallet'])
+    assert args.profile is False
+
+def test_profile_call(tmpdir):
+    path = str(tmpdir.join('test.prof'))
+    assert profiler.profile_call(lambda: sum(range(1000)), path) == sum(range(1000))
+    assert tmpdir.join('test.prof').check()
+    assert tmpdir.join('test.prof.collapsed').check()
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
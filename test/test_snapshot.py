@@ -0,0 +1,81 @@
+import io
+import sqlite3
+
+import pytest
+
+from counterpartycli import snapshot, util
+
+def make_database(path, blocks=100):
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA journal_mode = WAL')
+    db.execute('CREATE TABLE blocks (block_index INTEGER PRIMARY KEY, block_hash TEXT)')
+    db.execute('CREATE INDEX blocks_hash_idx ON blocks (block_hash)')
+    with db:
+        db.executemany('INSERT INTO blocks VALUES (?, ?)', [(i, 'hash{}'.format(i)) for i in range(blocks)])
+    return db
+
+def dump(path):
+    db = sqlite3.connect(path)
+    try:
+        return list(db.iterdump())
+    finally:
+        db.close()
+
+@pytest.mark.parametrize('use_backup', [True, False])
+def test_backup_database(tmpdir, monkeypatch, use_backup):
+    database_path, backup_path = str(tmpdir.join('counterparty.db')), str(tmpdir.join('backup.db'))
+    db = make_database(database_path)
+    if not use_backup:
+        monkeypatch.setattr(snapshot, 'connect_read_only', lambda path: NoBackupConnection(util.connect_read_only(path)))
+    # An open writer doesn't block the copy.
+    db.execute('BEGIN')
+    db.execute('INSERT INTO blocks VALUES (100, ?)', ('uncommitted',))
+    assert snapshot.backup_database(database_path, backup_path) == 99
+    db.rollback()
+    db.close()
+    assert dump(backup_path) == dump(database_path)
+
+class NoBackupConnection:
+    """A connection as on Python versions before 3.7."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __getattr__(self, name):
+        if name == 'backup':
+            raise AttributeError(name)
+        return getattr(self.connection, name)
+
+def test_connect_read_only(tmpdir):
+    database_path = str(tmpdir.join('counterparty.db'))
+    make_database(database_path).close()
+    db = util.connect_read_only(database_path)
+    with pytest.raises(sqlite3.OperationalError):
+        db.execute('DELETE FROM blocks')
+    db.close()
+    with pytest.raises(sqlite3.OperationalError):
+        util.connect_read_only(str(tmpdir.join('missing.db')))
+
+def test_snapshot_round_trip(tmpdir):
+    database_path = str(tmpdir.join('counterparty.db'))
+    make_database(database_path, blocks=5000).close()
+    output_path = str(tmpdir.join('snapshot.tar.gz'))
+    assert snapshot.snapshot(database_path, output_path, threads=3) == 4999
+
+    # Small blocks give an archive of many gzip members.
+    small_path = str(tmpdir.join('small.tar.gz'))
+    with open(small_path, 'wb') as output_file:
+        with snapshot.ParallelGzipWriter(output_file, threads=2, block_size=1000) as compressed:
+            compressed.write(open(database_path, 'rb').read())
+    with open(small_path, 'rb') as archive:
+        assert util.GzipStream(archive).read() == open(database_path, 'rb').read()
+
+    extract_dir = tmpdir.mkdir('extract')
+    with open(output_path, 'rb') as archive:
+        stream = io.BufferedReader(util.GzipStream(archive))
+        extracted, digests, checksums = util.extract_stream(stream, str(extract_dir))
+    assert extracted == ['counterparty.db']
+    util.verify_checksums(digests, checksums)
+    assert dump(str(extract_dir.join('counterparty.db.part'))) == dump(database_path)
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
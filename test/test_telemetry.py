@@ -0,0 +1,71 @@
+import json
+import types
+
+import pytest
+
+from counterpartylib.lib import blocks
+from counterpartycli import download, telemetry
+
+class Clock:
+    """`time` for the telemetry, advanced by the stand-in parsers."""
+
+    def __init__(self):
+        self.now = 0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def lib(monkeypatch):
+    clock = Clock()
+    def parse(db, tx, message):
+        clock.now += 5
+    messages = types.SimpleNamespace(parse=parse)
+    def parse_tx(db, tx):
+        messages.parse(db, tx, b'')
+    def parse_block(db, block_index, block_time):
+        for tx in range(2):
+            blocks.parse_tx(db, tx)
+    monkeypatch.setattr(telemetry, 'time', clock)
+    monkeypatch.setattr(telemetry, 'message_modules', lambda: [('send', messages)])
+    monkeypatch.setattr(blocks, 'parse_tx', parse_tx, raising=False)
+    monkeypatch.setattr(blocks, 'parse_block', parse_block, raising=False)
+    return parse_block
+
+@pytest.mark.parametrize('seconds, duration', [
+    (0, '0m 00s'), (59.9, '0m 59s'), (3599, '59m 59s'), (7260, '2h 01m'),
+    (86400 + 3600 + 120, '1d 01h 02m'), (3 * 86400 + 5, '3d 00h 00m'), (40 * 86400, '40d 00h 00m')])
+def test_format_duration(seconds, duration):
+    assert download.format_duration(seconds) == duration
+
+def test_rates_and_eta(lib, tmpdir, capsys):
+    path = str(tmpdir.join('telemetry.jsonl'))
+    with telemetry.Telemetry(None, target_block=100000, interval=1000, output_path=path):
+        for block_index in range(1, 11):
+            blocks.parse_block(None, block_index, 0)
+    assert blocks.parse_block is lib
+
+    summary = json.loads(open(path).read())
+    assert summary['final']
+    assert (summary['blocks'], summary['transactions'], summary['block_index']) == (10, 20, 10)
+    # A block every 10 seconds, over the last minute.
+    assert summary['blocks_per_sec'] == pytest.approx(0.1)
+    assert summary['tx_per_sec'] == pytest.approx(0.2)
+    assert summary['eta_seconds'] == pytest.approx(999900)
+    assert summary['message_types'] == {'send': {'count': 20, 'seconds': 100}}
+    assert 'ETA 11d 13h 45m' in capsys.readouterr().err
+
+def test_periodic_reports(lib, tmpdir):
+    path = str(tmpdir.join('telemetry.jsonl'))
+    with telemetry.Telemetry(None, target_block=10, interval=30, output_path=path):
+        for block_index in range(1, 11):
+            blocks.parse_block(None, block_index, 0)
+    reports = [json.loads(line) for line in open(path)]
+    assert [(report['block_index'], report['final']) for report in reports] == [(3, False), (6, False), (9, False), (10, True)]
+    assert reports[-1]['eta_seconds'] == 0
+
+def test_disabled(lib):
+    with telemetry.Telemetry(None, enabled=False):
+        assert blocks.parse_block is lib
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
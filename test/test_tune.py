@@ -0,0 +1,45 @@
+import pytest
+
+from counterpartylib.lib import config
+from counterpartycli import tune, util
+
+@pytest.fixture
+def backend(monkeypatch, stub_rpc):
+    monkeypatch.setattr(config, 'REQUESTS_TIMEOUT', 5, raising=False)
+    monkeypatch.setattr(util, 'rpc_sessions', {})
+    # Every request costs 10 ms, and every call in it 2 ms more.
+    return stub_rpc(addresses=5, utxos=5, request_latency=0.01, call_latency=0.002)
+
+def test_tune_against_slow_backend(backend, tmpdir, capsys):
+    config_file = tmpdir.join('server.conf')
+    config_file.write('# Counterparty server\n[Default]\n; from the package\nrpc-batch-size = 20\nbackend-connect = localhost\n')
+    # Batches of 60 calls take about 130 ms, over `max_latency`; batches of 10 make
+    # 6 requests instead of 60, and are the fastest.
+    values = tune.tune(backend.url, sample_size=60, max_latency=0.1, batch_sizes=[1, 10, 60], concurrency_levels=[1],
+                       config_file=str(config_file))
+    assert values['rpc-batch-size'] == 10
+    # A `getblockcount` takes at least 12 ms: polled every 0.24 s or more, for 5% of the backend's time.
+    assert 0.24 <= values['backend-poll-interval'] <= 1
+    assert config_file.read() == '# Counterparty server\n[Default]\n; from the package\nrpc-batch-size = 10\n' \
+                                 'backend-connect = localhost\nbackend-poll-interval = {}\n'.format(values['backend-poll-interval'])
+    assert 'rpc-batch-size = 10' in capsys.readouterr().out
+
+def test_recommend_at_server_concurrency():
+    results = [
+        {'batch_size': 10, 'concurrency': 1, 'throughput': 1000, 'latency_p95': 0.1},
+        {'batch_size': 10, 'concurrency': 4, 'throughput': 3000, 'latency_p95': 0.2},
+        {'batch_size': 100, 'concurrency': 4, 'throughput': 3100, 'latency_p95': 0.5},
+        {'batch_size': 500, 'concurrency': 4, 'throughput': 5000, 'latency_p95': 2.0},
+    ]
+    values, chosen = tune.recommend(results, 0.001, concurrency=4)
+    assert values == {'rpc-batch-size': 10, 'backend-poll-interval': tune.MIN_POLL_INTERVAL}
+    values, chosen = tune.recommend(results, 1, max_latency=5, concurrency=4)
+    assert values == {'rpc-batch-size': 500, 'backend-poll-interval': tune.MAX_POLL_INTERVAL}
+
+def test_write_config_without_final_newline(tmpdir):
+    config_file = tmpdir.join('server.conf')
+    config_file.write('[Default]\n# rpc-batch-size = 1\nbackend-poll-interval=0.5')
+    tune.write_config(str(config_file), {'backend-poll-interval': 0.25, 'rpc-batch-size': 50})
+    assert config_file.read() == '[Default]\n# rpc-batch-size = 1\nbackend-poll-interval = 0.25\nrpc-batch-size = 50\n'
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
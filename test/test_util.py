@@ -0,0 +1,60 @@
+import types
+
+import pytest
+
+from counterpartycli import util
+
+def test_patch():
+    module = types.ModuleType('module')
+    def double(x):
+        """Double `x`."""
+        return x * 2
+    module.double = double
+    undo = util.patch(module, 'double', lambda original: lambda x: original(x) + 1)
+    assert module.double(3) == 7
+    assert module.double.__doc__ == 'Double `x`.'
+    undo()
+    assert module.double is double
+
+# `(table, params, statement, bindings)`, with the statement and bindings built
+# by `get_rows` in counterpartylib's `api.py` for the same call.
+GETROWS_VECTORS = [
+    ('balances', {},
+     'SELECT * FROM balances LIMIT 1000', []),
+    ('balances', {'filters': {'field': 'address', 'op': '==', 'value': 'addr'}},
+     'SELECT * FROM balances WHERE (address == ?) LIMIT 1000', ['addr']),
+    ('balances', {'filters': [['address', 'IN', ['a', 'b']], ['quantity', '>', 0]], 'filterop': 'or', 'start_block': 10},
+     'SELECT * FROM balances WHERE (address IN (?,?) OR quantity > ?) LIMIT 1000', ['a', 'b', 0]),
+    ('assets', {'filters': [{'field': 'asset_name', 'op': 'LIKE', 'value': 'pep%'}]},
+     'SELECT * FROM assets WHERE (UPPER(asset_name) LIKE ?) LIMIT 1000', ['PEP%']),
+    ('assets', {'filters': [{'field': 'asset_name', 'op': 'like', 'value': 'pep%'}]},
+     'SELECT * FROM assets WHERE (asset_name like ?) LIMIT 1000', ['pep%']),
+    ('assets', {'filters': [['asset_name', 'LIKE', 'Pep%', True]]},
+     'SELECT * FROM assets WHERE (asset_name LIKE ?) LIMIT 1000', ['Pep%']),
+    ('order_matches', {'start_block': 10, 'end_block': 20, 'status': ['pending', 'completed'], 'order_by': 'tx0_index', 'order_dir': 'desc'},
+     'SELECT * FROM order_matches WHERE (tx0_block_index >= ? AND tx1_block_index <= ? AND status IN (?,?)) ORDER BY tx0_index DESC LIMIT 1000',
+     [10, 20, 'pending', 'completed']),
+    ('sends', {'filters': [['source', '==', 'addr']], 'start_block': 10, 'status': 'valid', 'limit': 100, 'offset': 200},
+     'SELECT * FROM sends WHERE (source == ?) AND (block_index >= ? AND status == ?) LIMIT 100 OFFSET 200',
+     ['addr', 10, 'valid']),
+    ('sends', {'filters': [['memo_hex', '==', '6869'], ['memo', '==', 'hi']], 'limit': 0},
+     'SELECT * FROM sends WHERE (memo == ? AND memo == ?)', [b'hi', b'hi']),
+]
+
+def test_getrows_query_matches_server():
+    for table, params, statement, bindings in GETROWS_VECTORS:
+        assert util.getrows_query(table, **params) == (statement, bindings)
+
+def test_getrows_query_errors():
+    for table, params in [
+            ('balances; DROP TABLE balances', {}),
+            ('balances', {'filterop': 'xor'}),
+            ('balances', {'order_dir': 'up'}),
+            ('balances', {'order_by': 'quantity; --'}),
+            ('balances', {'filters': [['address', 'MATCH', 'a']]}),
+            ('balances', {'filters': [['address', '==', ['a', 'b']]]}),
+            ('sends', {'filters': [['memo_hex', '==', 'xyz']]})]:
+        with pytest.raises(util.QueryError):
+            util.getrows_query(table, **params)
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
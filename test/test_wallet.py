@@ -0,0 +1,154 @@
+import itertools
+from decimal import Decimal as D
+
+import pytest
+
+from counterpartycli import util, wallet
+
+class FakeBackend:
+
+    def __init__(self):
+        self.unlocks = []
+        self.btc_balances = []
+
+    def get_wallet_addresses(self):
+        return [address for address, btc_balance in self.btc_balances]
+
+    def get_btc_balances(self):
+        return self.btc_balances
+
+    def unlock(self, passphrase, duration):
+        self.unlocks.append((passphrase, duration))
+
+    def is_locked(self):
+        return True
+
+    def sign_raw_transaction(self, tx_hex):
+        return tx_hex
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = FakeBackend()
+    monkeypatch.setattr(wallet, 'WALLET', lambda: backend)
+    now = [1000.0]
+    monkeypatch.setattr(wallet.time, 'monotonic', lambda: now[0])
+    backend.now = now
+    return backend
+
+def test_renewed_before_expiry(backend):
+    session = wallet.UnlockSession()
+    session.unlock('secret', duration=60)
+    backend.now[0] += 49
+    session.renew()
+    assert len(backend.unlocks) == 1
+    backend.now[0] += 2
+    session.renew()
+    assert backend.unlocks == [('secret', 60), ('secret', 60)]
+
+def test_short_unlock_not_renewed_on_every_use(backend):
+    session = wallet.UnlockSession()
+    session.unlock('secret', duration=8)
+    backend.now[0] += 5
+    session.renew()
+    assert len(backend.unlocks) == 1
+    assert session.is_unlocked()
+    backend.now[0] += 1
+    session.renew()
+    assert len(backend.unlocks) == 2
+
+def test_unlock_without_renewal(backend):
+    session = wallet.UnlockSession()
+    session.unlock('secret', duration=60, renew=False)
+    assert session.passphrase is None
+    backend.now[0] += 55
+    session.renew()
+    assert len(backend.unlocks) == 1
+
+def test_invalid_duration(backend):
+    with pytest.raises(ValueError):
+        wallet.UnlockSession().unlock('secret', duration=-1)
+    assert backend.unlocks == []
+
+def order_match(id, tx0_address, tx1_address, block_index, tx0_block_index=None):
+    return {'id': id, 'tx0_address': tx0_address, 'tx1_address': tx1_address, 'tx0_block_index': tx0_block_index or block_index,
+            'tx1_block_index': block_index, 'block_index': block_index, 'status': 'pending'}
+
+def test_watch_pending(backend, fake_server, monkeypatch):
+    backend.btc_balances = [('w1', 0), ('w2', 0)]
+    server = fake_server(height=100, tables={'order_matches': [order_match('m1', 'w1', 'x', 99), order_match('m0', 'x', 'y', 99)]})
+    # Each poll finds the server at the next of these blocks, with these rows.
+    blocks = iter([
+        (100, {}),
+        (101, {'order_matches': [order_match('m2', 'x', 'w2', 101, tx0_block_index=90), order_match('m3', 'x', 'y', 101)],
+               'btcpays': [{'order_match_id': 'm1', 'block_index': 101, 'status': 'valid'}]}),
+        (103, {'btcpays': [{'order_match_id': 'm2', 'block_index': 102, 'status': 'invalid: wrong amount'}],
+               'order_match_expirations': [{'order_match_id': 'm2', 'block_index': 103}]}),
+    ])
+    def sleep(interval):
+        height, tables = next(blocks)
+        server.extend(height)
+        for table, rows in tables.items():
+            server.insert(table, rows)
+    monkeypatch.setattr(wallet.time, 'sleep', sleep)
+
+    events = [(event['event'], event['block_index'], event['order_match']['id']) for event in itertools.islice(wallet.watch_pending(), 4)]
+    assert events == [('pending', 100, 'm1'), ('new', 101, 'm2'), ('completed', 101, 'm1'), ('expired', 103, 'm2')]
+    # Only the rows of the new blocks are fetched.
+    assert [params['start_block'] for method, params in server.calls if method == 'get_btcpays'] == [101, 102]
+
+@pytest.fixture
+def divisibility(monkeypatch):
+    monkeypatch.setitem(util.DIVISIBILITY, 'DIVISIBLE', True)
+    monkeypatch.setitem(util.DIVISIBILITY, 'NONDIVISIBLE', False)
+
+def test_iter_wallet_streams_exact_totals(backend, fake_server, divisibility, monkeypatch):
+    monkeypatch.setattr(wallet, 'BALANCES_CHUNK_SIZE', 2)
+    backend.btc_balances = [('a', 0.1), ('b', 0.2), ('c', 0), ('d', 12345678.12345678)]
+    server = fake_server(tables={'balances': [
+        {'address': 'a', 'asset': 'XCP', 'quantity': 2 ** 53 + 1},
+        {'address': 'b', 'asset': 'XCP', 'quantity': 1},
+        {'address': 'b', 'asset': 'NONDIVISIBLE', 'quantity': 3},
+        {'address': 'c', 'asset': 'DIVISIBLE', 'quantity': 0},
+        {'address': 'd', 'asset': 'NONDIVISIBLE', 'quantity': 2 ** 53 + 1},
+        {'address': 'x', 'asset': 'XCP', 'quantity': 5},
+    ]})
+    items = wallet.iter_wallet()
+    assert next(items) == {'address': 'a', 'balances': {'BTC': D('0.1'), 'XCP': D('90071992.54740993')}}
+    # The balances of the second chunk aren't fetched yet.
+    assert len([method for method, params in server.calls if method == 'get_balances']) == 1
+    assert list(items) == [
+        {'address': 'b', 'balances': {'BTC': D('0.2'), 'XCP': D('0.00000001'), 'NONDIVISIBLE': D(3)}},
+        {'address': 'c', 'balances': {}},
+        {'address': 'd', 'balances': {'BTC': D('12345678.12345678'), 'NONDIVISIBLE': D(2 ** 53 + 1)}},
+        {'assets': {'BTC': D('12345678.42345678'), 'XCP': D('90071992.54740994'), 'NONDIVISIBLE': D(2 ** 53 + 4)}},
+    ]
+    assert wallet.wallet() == {
+        'addresses': {'a': {'BTC': D('0.1'), 'XCP': D('90071992.54740993')},
+                      'b': {'BTC': D('0.2'), 'XCP': D('0.00000001'), 'NONDIVISIBLE': D(3)},
+                      'd': {'BTC': D('12345678.12345678'), 'NONDIVISIBLE': D(2 ** 53 + 1)}},
+        'assets': {'BTC': D('12345678.42345678'), 'XCP': D('90071992.54740994'), 'NONDIVISIBLE': D(2 ** 53 + 4)},
+    }
+
+def send(tx_index, source, destination, asset='XCP', status='valid', msg_index=0, block_index=100):
+    return {'tx_index': tx_index, 'tx_hash': 'send{}'.format(tx_index), 'msg_index': msg_index, 'block_index': block_index,
+            'source': source, 'destination': destination, 'asset': asset, 'quantity': tx_index, 'status': status}
+
+def test_get_sends_chunks_and_deduplicates(fake_server, monkeypatch):
+    monkeypatch.setattr(wallet, 'ADDRESS_CHUNK_SIZE', 2)
+    server = fake_server(height=100, tables={'sends': [
+        send(1, 'w1', 'x'),
+        send(2, 'x', 'w3'),
+        send(3, 'w1', 'w3'), # within the wallet, across chunks
+        send(3, 'w1', 'w2', msg_index=1), # within a chunk
+        send(4, 'w2', 'x', asset='OTHER'),
+        send(5, 'w2', 'x', status='invalid: insufficient funds'),
+        send(6, 'x', 'y'),
+        send(7, 'w2', 'x', block_index=101), # after the last block the server parsed
+    ]})
+    sends = wallet.get_sends('XCP', ['w1', 'w2', 'w3'])
+    assert [(send['tx_index'], send['msg_index']) for send in sends] == [(1, 0), (2, 0), (3, 0), (3, 1)]
+    queries = [params['filters'][1] for method, params in server.calls if method == 'get_sends']
+    assert sorted(queries) == [('destination', 'IN', ['w1', 'w2']), ('destination', 'IN', ['w3']),
+                               ('source', 'IN', ['w1', 'w2']), ('source', 'IN', ['w3'])]
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
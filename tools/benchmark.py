@@ -0,0 +1,206 @@
+#! /usr/bin/env python3
+
+"""Benchmark the client views and message composition offline.
+
+Record a cassette once against live servers, then replay it as often as
+needed on an isolated machine:
+
+    python tools/benchmark.py record bench.jsonl --address ADDRESS --asset ASSET --destination ADDRESS
+    python tools/benchmark.py run bench.jsonl --address ADDRESS --asset ASSET --destination ADDRESS --latency 0.005
+
+Measure how the wallet views scale against a synthetic wallet served locally:
+
+    python tools/benchmark.py scale --addresses 100 1000 10000 --utxos-per-address 3 --assets 50
+"""
+
+import sys
+import json
+import time
+import argparse
+import logging
+import statistics
+import tracemalloc
+from prettytable import PrettyTable
+
+from counterpartylib.lib import log
+logger = logging.getLogger(__name__)
+
+from counterpartycli import util, wallet, messages, clientapi, cassette
+from counterpartycli.client import CONFIG_ARGS as CLIENT_CONFIG_ARGS
+
+import stubrpc # tools/stubrpc.py
+
+ACTIONS = ['wallet', 'asset', 'balances', 'pending', 'send']
+
+def compose_args(**kwargs):
+    """Build the arguments `messages.compose` expects, with the client defaults."""
+    args = {}
+    for arg in CLIENT_CONFIG_ARGS:
+        key = arg[0][-1].replace('--', '').replace('-', '_')
+        args[key] = arg[1].get('default')
+    args.update({'fee': None, 'memo': None, 'memo_is_hex': False, 'use_enhanced_send': True})
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+def get_actions(args):
+    actions = {
+        'wallet': lambda: wallet.wallet(),
+        'asset': lambda: wallet.asset(args.asset),
+        'balances': lambda: wallet.balances(args.address),
+        'pending': lambda: wallet.pending(),
+        'send': lambda: messages.compose('send', compose_args(source=args.address, destination=args.destination,
+                                                               asset=args.asset, quantity=args.quantity))
+    }
+    return [(name, actions[name]) for name in args.actions]
+
+def measure(func, repeat):
+    durations = []
+    for i in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start_time)
+    return durations
+
+def run(args):
+    adapter = cassette.replay(args.cassette, latency=args.latency)
+    results = {}
+    for name, func in get_actions(args):
+        calls = adapter.calls
+        durations = measure(func, args.repeat)
+        results[name] = {
+            'calls': (adapter.calls - calls) // args.repeat,
+            'min': min(durations),
+            'median': statistics.median(durations),
+            'mean': statistics.mean(durations),
+            'max': max(durations)
+        }
+
+    table = PrettyTable(['Action', 'RPC calls', 'Min (ms)', 'Median (ms)', 'Mean (ms)', 'Max (ms)'])
+    for name in results:
+        result = results[name]
+        table.add_row([name, result['calls']] + ['{:.2f}'.format(result[key] * 1000) for key in ('min', 'median', 'mean', 'max')])
+    print(table)
+
+    if args.output:
+        with open(args.output, 'a') as output_file:
+            output_file.write(json.dumps({'time': int(time.time()), 'latency': args.latency, 'repeat': args.repeat, 'results': results}, sort_keys=True) + '\n')
+
+def record(args):
+    cassette.record(args.cassette)
+    for name, func in get_actions(args):
+        logger.info('Recording `{}`.'.format(name))
+        func()
+
+SCALE_VIEWS = ['wallet', 'asset', 'get_btc_balances', 'get_input_value']
+
+def get_scale_views(seed, utxos):
+    tx_hex = stubrpc.spending_tx_hex(seed, range(0, utxos, max(1, utxos // 100)))
+    views = {
+        'wallet': lambda: wallet.wallet(),
+        'asset': lambda: wallet.asset(stubrpc.synthetic_asset(0)),
+        'get_btc_balances': lambda: list(wallet.get_btc_balances()),
+        'get_input_value': lambda: messages.get_input_value(tx_hex)
+    }
+    return [(name, views[name]) for name in SCALE_VIEWS]
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def scale(args):
+    results = []
+    for addresses in args.addresses:
+        utxos = addresses * args.utxos_per_address
+        logger.info('Generating a wallet of {} addresses, {} UTXOs and {} assets.'.format(addresses, utxos, args.assets))
+        process, port = stubrpc.start_process(addresses=addresses, utxos=utxos, assets=args.assets, seed=args.seed)
+        try:
+            util.rpc_sessions.clear()
+            clientapi.initialize(counterparty_rpc_connect='127.0.0.1', counterparty_rpc_port=port,
+                                 wallet_name=args.wallet_name, wallet_connect='127.0.0.1', wallet_port=port,
+                                 wallet_password='stub')
+            for name, func in get_scale_views(args.seed, utxos):
+                durations = measure(func, args.repeat)
+                results.append({
+                    'view': name,
+                    'addresses': addresses,
+                    'utxos': utxos,
+                    'assets': args.assets,
+                    'median': statistics.median(durations),
+                    'peak_memory': peak_memory(func)
+                })
+        finally:
+            process.terminate()
+            process.join()
+
+    table = PrettyTable(['View', 'Addresses', 'UTXOs', 'Assets', 'Median (ms)', 'Peak memory (KiB)'])
+    for result in sorted(results, key=lambda result: (result['view'], result['addresses'])):
+        table.add_row([result['view'], result['addresses'], result['utxos'], result['assets'],
+                       '{:.2f}'.format(result['median'] * 1000), result['peak_memory'] // 1024])
+    print(table)
+
+    if args.output:
+        with open(args.output, 'a') as output_file:
+            output_file.write(json.dumps({'time': int(time.time()), 'repeat': args.repeat, 'results': results}, sort_keys=True) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(prog='counterparty-benchmark', description='Benchmark client actions against recorded RPC cassettes')
+    parser.add_argument('--config-file', help='the location of the client configuration file')
+    util.add_config_arguments(parser, CLIENT_CONFIG_ARGS, 'client.conf')
+
+    subparsers = parser.add_subparsers(dest='mode', help='the mode to run in')
+    parser_record = subparsers.add_parser('record', help='run the actions against live servers and record a cassette')
+    parser_run = subparsers.add_parser('run', help='replay a cassette and time the actions')
+    parser_run.add_argument('--latency', type=float, default=0, help='latency added to each replayed RPC request, in seconds (default: 0)')
+    parser_run.add_argument('--repeat', type=int, default=10, help='number of runs of each action (default: 10)')
+    parser_run.add_argument('--output', help='append the results, as JSON, to the specified file')
+    parser_scale = subparsers.add_parser('scale', help='time the wallet views against synthetic wallets of increasing size')
+    parser_scale.add_argument('--addresses', type=int, nargs='+', default=[100, 1000, 10000], help='wallet sizes, in addresses (default: 100 1000 10000)')
+    parser_scale.add_argument('--utxos-per-address', type=int, default=3, help='number of UTXOs per address (default: 3)')
+    parser_scale.add_argument('--assets', type=int, default=20, help='number of assets (default: 20)')
+    parser_scale.add_argument('--seed', type=int, default=0, help='seed of the synthetic wallets (default: 0)')
+    parser_scale.add_argument('--repeat', type=int, default=3, help='number of runs of each view (default: 3)')
+    parser_scale.add_argument('--output', help='append the results, as JSON, to the specified file')
+    for subparser in (parser_record, parser_run):
+        subparser.add_argument('cassette', help='the cassette file')
+        subparser.add_argument('--actions', nargs='+', choices=ACTIONS, default=ACTIONS, help='the actions to benchmark (default: all)')
+        subparser.add_argument('--address', required=True, help='the wallet address used by `balances` and as `send` source')
+        subparser.add_argument('--asset', default='XCP', help='the asset used by `asset` and `send` (default: XCP)')
+        subparser.add_argument('--destination', help='the `send` destination address (default: ADDRESS)')
+        subparser.add_argument('--quantity', default='0.00000001', help='the `send` quantity (default: 0.00000001)')
+
+    args = parser.parse_args()
+    if args.mode is None:
+        parser.print_help()
+        sys.exit(1)
+    log.set_up(logger, verbose=args.verbose)
+
+    if args.mode == 'scale':
+        scale(args)
+        return
+
+    args.destination = args.destination or args.address
+    if args.mode == 'run' and not args.wallet_password:
+        args.wallet_password = 'replay' # never sent anywhere, but required by `clientapi.initialize`
+
+    clientapi.initialize(testnet=args.testnet, testcoin=args.testcoin,
+                        counterparty_rpc_connect=args.counterparty_rpc_connect, counterparty_rpc_port=args.counterparty_rpc_port,
+                        counterparty_rpc_user=args.counterparty_rpc_user, counterparty_rpc_password=args.counterparty_rpc_password,
+                        counterparty_rpc_ssl=args.counterparty_rpc_ssl, counterparty_rpc_ssl_verify=args.counterparty_rpc_ssl_verify,
+                        wallet_name=args.wallet_name, wallet_connect=args.wallet_connect, wallet_port=args.wallet_port,
+                        wallet_user=args.wallet_user, wallet_password=args.wallet_password,
+                        wallet_ssl=args.wallet_ssl, wallet_ssl_verify=args.wallet_ssl_verify,
+                        requests_timeout=args.requests_timeout)
+
+    if args.mode == 'record':
+        record(args)
+    else:
+        run(args)
+
+if __name__ == '__main__':
+    main()
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,246 @@
+"""Local JSON-RPC server impersonating both counterparty-server and the
+wallet backend, serving a synthetic wallet of any size.
+
+Everything is derived from `seed`, so a client can rebuild addresses and
+UTXO identifiers (see `synthetic_address` and `synthetic_txid`) without
+sharing any state with the server process."""
+
+import json
+import binascii
+import time
+import random
+import hashlib
+import logging
+import sqlite3
+import threading
+import multiprocessing
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+from counterpartycli.util import getrows_query
+
+logger = logging.getLogger(__name__)
+
+B58_DIGITS = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+UNIT = 100000000
+BLOCK_INDEX = 500000
+TRANSACTIONS_PER_BLOCK = 500
+
+TABLES = {
+    'balances': ['address', 'asset', 'quantity'],
+    'assets': ['asset_id', 'asset_name', 'block_index'],
+    'issuances': ['tx_index', 'tx_hash', 'block_index', 'asset', 'quantity', 'divisible', 'source', 'issuer',
+                  'transfer', 'callable', 'call_date', 'call_price', 'description', 'fee_paid', 'locked', 'status'],
+    'sends': ['tx_index', 'tx_hash', 'block_index', 'source', 'destination', 'asset', 'quantity', 'status', 'memo'],
+    'order_matches': ['id', 'tx0_index', 'tx0_hash', 'tx0_address', 'tx1_index', 'tx1_hash', 'tx1_address',
+                      'forward_asset', 'forward_quantity', 'backward_asset', 'backward_quantity', 'tx0_block_index',
+                      'tx1_block_index', 'block_index', 'tx0_expiration', 'tx1_expiration', 'match_expire_index',
+                      'fee_paid', 'status']
+}
+
+class StubRPCError(Exception):
+    pass
+
+def b58encode(data):
+    number = int.from_bytes(data, 'big')
+    encoded = ''
+    while number:
+        number, remainder = divmod(number, 58)
+        encoded = B58_DIGITS[remainder] + encoded
+    padding = len(data) - len(data.lstrip(b'\0'))
+    return B58_DIGITS[0] * padding + encoded
+
+def synthetic_address(seed, index):
+    payload = b'\0' + hashlib.sha256('address:{}:{}'.format(seed, index).encode()).digest()[:20]
+    checksum = hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+    return b58encode(payload + checksum)
+
+def synthetic_txid(seed, index):
+    return hashlib.sha256('utxo:{}:{}'.format(seed, index).encode()).hexdigest()
+
+def synthetic_asset(index):
+    name = ''
+    index += 26 ** 4 # at least five letters
+    while index:
+        index, remainder = divmod(index, 26)
+        name = chr(ord('A') + remainder) + name
+    return 'B' + name
+
+def spending_tx_hex(seed, utxo_indexes):
+    """Serialize an unsigned transaction spending the given synthetic UTXOs."""
+    raw = (1).to_bytes(4, 'little') + bytes([len(utxo_indexes)])
+    for index in utxo_indexes:
+        raw += bytes.fromhex(synthetic_txid(seed, index))[::-1] + (0).to_bytes(4, 'little') + b'\0' + b'\xff' * 4
+    raw += b'\x01' + (0).to_bytes(8, 'little') + b'\0' + (0).to_bytes(4, 'little')
+    return binascii.hexlify(raw).decode('ascii')
+
+class SyntheticWallet:
+    """N addresses, M UTXOs and K assets, with balances, sends and order
+       matches. `request_latency` and `call_latency` (in seconds) simulate a
+       slow backend, per HTTP request and per call."""
+
+    def __init__(self, addresses=100, utxos=300, assets=10, seed=0, request_latency=0, call_latency=0):
+        self.seed = seed
+        self.request_latency = request_latency
+        self.call_latency = call_latency
+        self.addresses = [synthetic_address(seed, i) for i in range(addresses)]
+        self.address_set = set(self.addresses)
+        self.assets = ['XCP'] + [synthetic_asset(i) for i in range(assets)]
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(':memory:', check_same_thread=False)
+        self.db.row_factory = lambda cursor, row: dict(zip([column[0] for column in cursor.description], row))
+        for table, columns in TABLES.items():
+            self.db.execute('CREATE TABLE {} ({})'.format(table, ', '.join(columns)))
+
+        rand = random.Random(seed)
+        self.utxos = []
+        for i in range(utxos):
+            self.utxos.append({
+                'txid': synthetic_txid(seed, i),
+                'vout': 0,
+                'address': self.addresses[i % addresses],
+                'amount': rand.randint(1, 100 * UNIT) / UNIT,
+                'confirmations': rand.randint(0, 1000),
+                'scriptPubKey': ''
+            })
+
+        balances, issuances, assets_rows, sends, order_matches = [], [], [], [], []
+        for asset_index, asset in enumerate(self.assets):
+            assets_rows.append((str(asset_index + 1), asset, BLOCK_INDEX - 1000))
+            if asset != 'XCP':
+                issuances.append((asset_index, 'issuance{}'.format(asset_index), BLOCK_INDEX - 1000, asset, 1000000 * UNIT,
+                                  asset_index % 2 == 0, self.addresses[0], self.addresses[0], False, False, 0, 0.0, asset, 0, False, 'valid'))
+        for address in self.addresses:
+            for asset in rand.sample(self.assets, max(1, len(self.assets) // 3)):
+                balances.append((address, asset, rand.randint(0, 1000 * UNIT)))
+        outsider = synthetic_address(seed, -1)
+        for tx_index in range(len(self.addresses) * 2):
+            source, destination = rand.choice(self.addresses), rand.choice(self.addresses + [outsider])
+            sends.append((tx_index, 'send{}'.format(tx_index), BLOCK_INDEX - tx_index, source, destination,
+                          rand.choice(self.assets), rand.randint(1, 10 * UNIT), 'valid', None))
+        for index in range(max(1, len(self.addresses) // 10)):
+            tx0_hash, tx1_hash = 'order{}a'.format(index), 'order{}b'.format(index)
+            order_matches.append(('{}_{}'.format(tx0_hash, tx1_hash), index, tx0_hash, rand.choice(self.addresses), index + 1, tx1_hash, outsider,
+                                  'BTC', rand.randint(1, UNIT), 'XCP', rand.randint(1, UNIT), BLOCK_INDEX - 5, BLOCK_INDEX - 4, BLOCK_INDEX - 4,
+                                  10, 10, BLOCK_INDEX + 16, 0, 'pending'))
+        for table, rows in (('balances', balances), ('issuances', issuances), ('assets', assets_rows), ('sends', sends), ('order_matches', order_matches)):
+            self.db.executemany('INSERT INTO {} VALUES ({})'.format(table, ','.join(['?'] * len(TABLES[table]))), rows)
+        self.db.execute('CREATE INDEX balances_address_idx ON balances (address)')
+
+    def query(self, statement, bindings=()):
+        with self.lock:
+            return self.db.execute(statement, bindings).fetchall()
+
+    def get_rows(self, table, **params):
+        statement, bindings = getrows_query(table, **params)
+        return self.query(statement, bindings)
+
+    # Wallet backend.
+    def listaddressgroupings(self):
+        amounts = {}
+        for utxo in self.utxos:
+            amounts[utxo['address']] = amounts.get(utxo['address'], 0) + utxo['amount']
+        return [[[address, amounts.get(address, 0), ''] for address in self.addresses]]
+
+    def listunspent(self, minconf=0, maxconf=99999):
+        return [utxo for utxo in self.utxos if minconf <= utxo['confirmations'] <= maxconf]
+
+    def validateaddress(self, address):
+        ismine = address in self.address_set
+        return {'isvalid': True, 'address': address, 'ismine': ismine, 'pubkey': '02' + '00' * 32 if ismine else None}
+
+    def getinfo(self):
+        return {'blocks': BLOCK_INDEX, 'unlocked_until': 0}
+
+    def walletislocked(self):
+        return False
+
+    # Blockchain backend.
+    def getblockcount(self):
+        return BLOCK_INDEX
+
+    def getblockhash(self, block_index):
+        # The height is encoded in the hash, so that `getblock` can recover it.
+        return '{:08x}'.format(block_index) + hashlib.sha256('block:{}:{}'.format(self.seed, block_index).encode()).hexdigest()[8:]
+
+    def getblock(self, block_hash, verbose=True):
+        block_index = int(block_hash[:8], 16)
+        txids = [synthetic_txid(self.seed, block_index * TRANSACTIONS_PER_BLOCK + i) for i in range(TRANSACTIONS_PER_BLOCK)]
+        return {'hash': block_hash, 'height': block_index, 'tx': txids}
+
+    def getrawtransaction(self, txid, verbose=0):
+        raw = spending_tx_hex(self.seed, [0])
+        if verbose:
+            return {'txid': txid, 'hex': raw}
+        return raw
+
+    # counterparty-server.
+    def get_supply(self, asset):
+        return self.query('SELECT COALESCE(SUM(quantity), 0) AS supply FROM balances WHERE asset = ?', (asset,))[0]['supply']
+
+    def get_running_info(self):
+        return {'last_block': {'block_index': BLOCK_INDEX}, 'running_testnet': False, 'db_caught_up': True}
+
+    def sql(self, query, bindings=None):
+        return self.query(query, bindings or [])
+
+    def call(self, method, params):
+        if self.call_latency:
+            time.sleep(self.call_latency)
+        if method.startswith('get_') and method[4:] in TABLES:
+            return self.get_rows(method[4:], **(params or {}))
+        func = getattr(self, method, None)
+        if func is None or method.startswith('_') or method in ('call', 'query', 'get_rows'):
+            raise StubRPCError('Method not found: {}'.format(method))
+        if isinstance(params, dict):
+            return func(**params)
+        return func(*(params or []))
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+
+    def handle_call(self, payload):
+        try:
+            result, error = self.server.wallet.call(payload.get('method'), payload.get('params')), None
+        except Exception as e:
+            result, error = None, {'code': -1, 'message': str(e)}
+        return {'jsonrpc': '2.0', 'id': payload.get('id'), 'result': result, 'error': error}
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        if self.server.wallet.request_latency:
+            time.sleep(self.server.wallet.request_latency)
+        if isinstance(payload, list):
+            response = [self.handle_call(call) for call in payload]
+        else:
+            response = self.handle_call(payload)
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, wallet, host='127.0.0.1', port=0):
+        HTTPServer.__init__(self, (host, port), StubRequestHandler)
+        self.wallet = wallet
+
+def serve(connection, host, port, **wallet_params):
+    server = StubServer(SyntheticWallet(**wallet_params), host=host, port=port)
+    connection.send(server.server_address[1])
+    server.serve_forever()
+
+def start_process(host='127.0.0.1', port=0, **wallet_params):
+    """Serve a synthetic wallet from a child process (so that its memory is
+       not accounted to the client) and return the process and its port."""
+    parent_connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=serve, args=(child_connection, host, port), kwargs=wallet_params, daemon=True)
+    process.start()
+    return process, parent_connection.recv()
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4